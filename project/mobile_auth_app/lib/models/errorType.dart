@@ -10,7 +10,9 @@ enum ErrorType {
   tokenInvalidOrExpired(6, "TOKEN_INVALID_OR_EXPIRED", "Token non valido o scaduto"),
   unauthorized(7, "UNAUTHORIZED", "Operazione non autorizzata"),
   deviceAlreadyRegistered(8, "DEVICE_ALREADY_REGISTERED", "Il dispositivo risulta già registrato"),
-  assocFailure(9, "ASSOC_FAILURE", "Associazione del dispositivo non riuscita");
+  assocFailure(9, "ASSOC_FAILURE", "Associazione del dispositivo non riuscita"),
+  unsupportedGroup(10, "UNSUPPORTED_GROUP", "Nessun gruppo crittografico in comune con il server"),
+  nonceInvalid(11, "NONCE_INVALID", "Nonce non valido, scaduto o già utilizzato");
 
   final int code;
   final String label;
@@ -17,7 +17,8 @@ enum MessageType {
   handshakeRes(13, "HANDSHAKE_RES", "Risposta handshake"),
   loggedOut(14, "LOGGED_OUT", "Logout effettuato"),
   devicesRequest(15, "DEVICES_REQUEST", "Richiesta elenco dispositivi"),
-  devicesResponse(16, "DEVICES_RESPONSE", "Risposta elenco dispositivi");
+  devicesResponse(16, "DEVICES_RESPONSE", "Risposta elenco dispositivi"),
+  authProof(17, "AUTH_PROOF", "Ricevuta prova di autenticazione non interattiva");
 
   final int code;
   final String label;
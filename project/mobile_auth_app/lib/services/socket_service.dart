@@ -1,21 +1,31 @@
 import 'dart:async';
 import 'dart:convert';
 import 'dart:io';
+import 'dart:typed_data';
 import '../models/messageType.dart';
 
+/// Dimensione dell'header di ogni frame (lunghezza del payload, big-endian).
+const int frameHeaderSize = 4;
+const int defaultMaxFrameSize = 64 * 1024;
+
 class SocketService {
   Socket? _socket;
   late Stream<List<int>> _socketStream;
   final String host;
   final int port;
+  final int maxFrameSize;
   final void Function(Map<String, dynamic> message)? onMessage;
 
   // coda dei messaggi ricevuti
   final List<Map<String, dynamic>> _messageQueue = [];
 
+  // byte ricevuti ma non ancora ricomposti in un frame completo
+  final BytesBuilder _pending = BytesBuilder(copy: false);
+
   SocketService({
     required this.host,
     required this.port,
+    this.maxFrameSize = defaultMaxFrameSize,
     this.onMessage,
   });
 
@@ -52,9 +62,36 @@ Future<bool> connect({Duration timeout = const Duration(seconds: 3)}) async {
   }
 }
 
+  /// Riassembla i frame: un frame può arrivare spezzato e più frame possono
+  /// arrivare nello stesso chunk.
   void _onData(List<int> data) {
+    _pending.add(data);
+    final buffer = _pending.takeBytes();
+    var offset = 0;
+
+    while (buffer.length - offset >= frameHeaderSize) {
+      final length = ByteData.sublistView(buffer, offset, offset + frameHeaderSize)
+          .getUint32(0, Endian.big);
+      if (length > maxFrameSize) {
+        print('[SOCKET ERROR]: Frame di $length byte oltre il limite di $maxFrameSize');
+        dispose();
+        return;
+      }
+      if (buffer.length - offset < frameHeaderSize + length) break;
+
+      final start = offset + frameHeaderSize;
+      _onFrame(Uint8List.sublistView(buffer, start, start + length));
+      offset = start + length;
+    }
+
+    if (offset < buffer.length) {
+      _pending.add(Uint8List.sublistView(buffer, offset));
+    }
+  }
+
+  void _onFrame(List<int> frame) {
     try {
-      final messageString = utf8.decode(data);
+      final messageString = utf8.decode(frame);
       final decoded = jsonDecode(messageString);
       if (decoded is Map<String, dynamic>) {
         _messageQueue.add(decoded);
@@ -85,7 +122,10 @@ Future<bool> connect({Duration timeout = const Duration(seconds: 3)}) async {
     };
 
     final jsonString = jsonEncode(payload);
-    _socket?.write(jsonString);
+    final body = utf8.encode(jsonString);
+    final header = ByteData(frameHeaderSize)..setUint32(0, body.length, Endian.big);
+    _socket?.add(header.buffer.asUint8List());
+    _socket?.add(body);
     print("[SOCKET]: Messaggio inviato -> $jsonString");
   }
 
@@ -0,0 +1,58 @@
+import argparse
+import random
+import sys
+import time
+import timeit
+from pathlib import Path
+
+# Le utility condivise vengono prese dalla cartella del server
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root / "server"))
+
+from utils.fixed_base import DEFAULT_WINDOW, FixedBaseExp
+from utils.groups import GROUPS
+
+
+def bench_group(group_id: str, window: int, number: int) -> None:
+    p = GROUPS[group_id]["p"]
+    q = GROUPS[group_id]["q"]
+    g = GROUPS[group_id]["g"]
+
+    start = time.perf_counter()
+    fb = FixedBaseExp(g, p, max_bits=q.bit_length(), window=window).build()
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    exponents = [random.randrange(1, q) for _ in range(number)]
+    for x in exponents[:10]:
+        assert fb.pow(x) == pow(g, x, p)
+
+    builtin_s = timeit.timeit(lambda: [pow(g, x, p) for x in exponents], number=1)
+    fixed_s = timeit.timeit(lambda: [fb.pow(x) for x in exponents], number=1)
+
+    print(
+        f"{group_id:<12} window={window} build={build_ms:8.1f} ms | "
+        f"pow={builtin_s / number * 1e3:7.3f} ms | "
+        f"fixed-base={fixed_s / number * 1e3:7.3f} ms | "
+        f"speedup={builtin_s / fixed_s:5.2f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Confronto tra esponenziazione a base fissa e pow() builtin"
+    )
+    parser.add_argument("-w", "--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("-n", "--number", type=int, default=200)
+    parser.add_argument(
+        "groups",
+        nargs="*",
+        default=[gid for gid, params in GROUPS.items() if params.get("type") != "ec"],
+    )
+    args = parser.parse_args()
+
+    for group_id in args.groups:
+        bench_group(group_id, args.window, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""
+Microbenchmark delle operazioni crittografiche e di serializzazione del server.
+
+Per ogni gruppo di GROUPS misura l'esponenziazione generica (pow(g, x, p) o il
+prodotto scalare sulla curva), quella a base fissa, la verifica della risposta al
+variare del numero di dispositivi (con e senza tabelle per chiave), la verifica a
+lotti e la sfida Fiat-Shamir; inoltre generate_token, i nonce e la codifica e
+decodifica dei messaggi di handshake e di autenticazione, in JSON e in binario.
+
+Ogni misura fa un riscaldamento e calibra il numero di chiamate per campione; i
+campioni vengono poi raccolti a turni su tutte le misure. Si riportano mediana,
+minimo, media e deviazione standard per operazione. Con --output i risultati vengono
+salvati in JSON; con --baseline vengono confrontati con quelli salvati e il processo
+esce con codice 1 se una misura peggiora oltre --threshold. Il confronto usa di
+default il minimo dei campioni: il codice misurato è deterministico e il rumore
+(scheduler, altri processi) può solo allungare i tempi, quindi il minimo è la stima
+più stabile; --metric median usa la mediana.
+
+    python3 benchmarks/bench_primitives.py -o baseline.json
+    python3 benchmarks/bench_primitives.py --baseline baseline.json --threshold 0.15
+    python3 benchmarks/bench_primitives.py -k verify -g secp256k1
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Le utility condivise vengono prese dalla cartella del server
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root / "server"))
+
+from utils.fiat_shamir import NonceIssuer, derive_challenge
+from utils.framing import FrameDecoder, encode_frame
+from utils.group import get_group
+from utils.groups import GROUPS
+from utils.message import MessageType
+import utils.verifier as verifier
+from utils.verifier import (
+    DEFAULT_KEY_CACHE_SIZE,
+    DEFAULT_KEY_TABLE_CACHE_SIZE,
+    KeyCache,
+    verify_batch,
+    verify_response,
+)
+from utils.wire import ENCODING_BINARY, JSON_CODEC, get_codec
+
+from server import generate_token
+
+DEFAULT_DEVICES = (1, 4, 16)
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_REPEAT = 15
+DEFAULT_MIN_TIME = 0.02
+DEFAULT_WARMUP = 0.1
+DEFAULT_THRESHOLD = 0.15
+METRICS = {"min": "min_us", "median": "median_us"}
+# Input diversi usati a rotazione, così che nessuna misura riusi sempre gli stessi valori
+INPUTS = 16
+
+
+class Benchmark:
+    """
+    Una misura: `setup` prepara gli input e restituisce la funzione da cronometrare.
+    `ops` è il numero di operazioni svolte da una chiamata (es. le prove di un lotto):
+    i tempi riportati sono per operazione.
+    """
+
+    def __init__(self, name: str, setup: Callable[[], Callable[[], object]], ops: int = 1):
+        self.name = name
+        self.setup = setup
+        self.ops = ops
+
+
+def cycle(values: list) -> Callable[[], object]:
+    return itertools.cycle(values).__next__
+
+
+def with_key_cache(cache: KeyCache, fn: Callable[[], object]) -> Callable[[], object]:
+    """
+    Esegue `fn` con una cache delle chiavi propria della misura: le misure vengono
+    eseguite a turni e ognuna deve ritrovare le proprie chiavi e tabelle.
+    """
+
+    def run():
+        verifier._key_cache = cache
+        return fn()
+
+    return run
+
+
+# ---------- misure ----------
+
+
+def group_benchmarks(group_id: str, devices: List[int], batch_size: int) -> List[Benchmark]:
+    group = get_group(group_id)
+    q = group.q
+
+    def exp():
+        xs = cycle([random.randrange(1, q) for _ in range(INPUTS)])
+        g = group.generator
+        return lambda: group.exp(g, xs())
+
+    def base_exp():
+        group.precompute()
+        xs = cycle([random.randrange(1, q) for _ in range(INPUTS)])
+        return lambda: group.base_exp(xs())
+
+    def proofs(n: int, count: int = INPUTS) -> list:
+        """
+        Prove valide di un utente con n dispositivi; la chiave giusta è l'ultima (caso
+        peggiore). Le chiavi sono le stesse per tutte le prove, come per un utente che
+        si autentica più volte.
+        """
+        alphas = [random.randrange(1, q) for _ in range(n)]
+        pks = [group.encode(group.base_exp(a)) for a in alphas]
+        result = []
+        for _ in range(count):
+            t = random.randrange(1, q)
+            c = random.randrange(0, q)
+            z = (t + alphas[-1] * c) % q
+            result.append((group.base_exp(t), c, z, pks))
+        return result
+
+    def verify(n: int, max_tables: int):
+        def setup():
+            group.precompute()
+            items = proofs(n)
+            next_item = cycle(items)
+            fn = with_key_cache(
+                KeyCache(DEFAULT_KEY_CACHE_SIZE, max_tables),
+                lambda: verify_response(group_id, *next_item()),
+            )
+            for _ in items:
+                assert fn() is not None
+            return fn
+
+        return setup
+
+    def batch():
+        group.precompute()
+        # Prove di utenti diversi, come in un lotto raccolto dal server
+        jobs = [proofs(1, 1)[0] for _ in range(batch_size)]
+        fn = with_key_cache(
+            KeyCache(DEFAULT_KEY_CACHE_SIZE, DEFAULT_KEY_TABLE_CACHE_SIZE),
+            lambda: verify_batch(group_id, jobs),
+        )
+        assert None not in fn()
+        return fn
+
+    def challenge():
+        temp = group.encode(group.base_exp(random.randrange(1, q)))
+        nonce = NonceIssuer().issue()
+        return lambda: derive_challenge(group_id, q, "username", temp, nonce)
+
+    benchmarks = [
+        Benchmark(f"exp/{group_id}", exp),
+        Benchmark(f"base-exp/{group_id}", base_exp),
+    ]
+    for n in devices:
+        benchmarks.append(
+            Benchmark(f"verify/{group_id}/devices={n}", verify(n, DEFAULT_KEY_TABLE_CACHE_SIZE))
+        )
+        benchmarks.append(Benchmark(f"verify-no-tables/{group_id}/devices={n}", verify(n, 0)))
+    if group.batchable and batch_size > 1:
+        benchmarks.append(
+            Benchmark(f"verify-batch/{group_id}/proofs={batch_size}", batch, ops=batch_size)
+        )
+    benchmarks.append(Benchmark(f"fiat-shamir/{group_id}", challenge))
+    return benchmarks
+
+
+def message_benchmarks(group_id: str) -> List[Benchmark]:
+    """Codifica (JSON o binaria, con il frame) e decodifica dei messaggi più frequenti."""
+    group = get_group(group_id)
+    temp = group.encode(group.base_exp(random.randrange(1, group.q)))
+    nonce = NonceIssuer().issue()
+    messages = {
+        "handshake-req": (MessageType.HANDSHAKE_REQ, {"groups": list(GROUPS)}),
+        "group-selection": (
+            MessageType.GROUP_SELECTION,
+            {"group_id": group_id, "nonce": nonce, "encoding": ENCODING_BINARY},
+        ),
+        "auth-request": (
+            MessageType.AUTH_REQUEST,
+            {"username": "username", "temp": temp, "key_id": "0" * 16},
+        ),
+        "challenge": (MessageType.CHALLENGE, {"challenge": hex(random.randrange(group.q))}),
+        "auth-proof": (
+            MessageType.AUTH_PROOF,
+            {
+                "username": "username",
+                "temp": temp,
+                "response": hex(random.randrange(group.q)),
+                "nonce": nonce,
+                "key_id": "0" * 16,
+            },
+        ),
+    }
+
+    benchmarks = []
+    for codec in (JSON_CODEC, get_codec(ENCODING_BINARY, group)):
+        for name, (msg_type, extra) in messages.items():
+            frame = encode_frame(codec.encode(msg_type, extra))
+
+            def encode(codec=codec, msg_type=msg_type, extra=extra):
+                return lambda: encode_frame(codec.encode(msg_type, extra))
+
+            def decode(codec=codec, frame=frame):
+                def run():
+                    decoder = FrameDecoder()
+                    decoder.feed(frame)
+                    return codec.decode(decoder.next_frame())
+
+                return run
+
+            benchmarks.append(Benchmark(f"{codec.name}/{name}/encode", encode))
+            benchmarks.append(Benchmark(f"{codec.name}/{name}/decode", decode))
+    return benchmarks
+
+
+def misc_benchmarks(group_id: str) -> List[Benchmark]:
+    group = get_group(group_id)
+    pk = group.encode(group.base_exp(random.randrange(1, group.q)))
+
+    def issue():
+        issuer = NonceIssuer()
+        return issuer.issue
+
+    def check():
+        issuer = NonceIssuer()
+        nonces = cycle([issuer.issue() for _ in range(INPUTS)])
+        return lambda: issuer.expires_at(nonces())
+
+    return [
+        Benchmark("token/generate", lambda: lambda: generate_token(32, pk, "device")),
+        Benchmark("nonce/issue", issue),
+        Benchmark("nonce/check", check),
+    ]
+
+
+# ---------- esecuzione ----------
+
+
+def calibrate(bench: Benchmark, min_time: float, warmup: float) -> Tuple[timeit.Timer, int]:
+    """Prepara la misura, la riscalda e sceglie quante chiamate fare per campione."""
+    fn = bench.setup()
+
+    deadline = time.perf_counter() + warmup
+    while time.perf_counter() < deadline:
+        fn()
+
+    # Abbastanza chiamate da superare min_time, per ridurre il rumore del timer
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            return timer, number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def run(benchmarks: List[Benchmark], repeat: int, min_time: float, warmup: float) -> dict:
+    """
+    Esegue le misure a turni: ad ogni turno un campione per misura. Le variazioni di
+    velocità della macchina durante l'esecuzione si distribuiscono così su tutte le
+    misure, invece di penalizzare solo quelle eseguite in quel momento.
+    """
+    prepared = [(bench, *calibrate(bench, min_time, warmup)) for bench in benchmarks]
+    samples: Dict[str, List[float]] = {bench.name: [] for bench in benchmarks}
+    for _ in range(repeat):
+        for bench, timer, number in prepared:
+            samples[bench.name].append(timer.timeit(number) / number / bench.ops * 1e6)
+
+    results = {}
+    for bench, _, number in prepared:
+        values = samples[bench.name]
+        results[bench.name] = {
+            "median_us": statistics.median(values),
+            "min_us": min(values),
+            "mean_us": statistics.fmean(values),
+            "stdev_us": statistics.stdev(values) if len(values) > 1 else 0.0,
+            "repeat": repeat,
+            "number": number,
+            "ops": bench.ops,
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, metric: str) -> List[str]:
+    """Stampa le variazioni rispetto alla baseline e restituisce le misure oltre la soglia."""
+    key = METRICS[metric]
+    regressions = []
+    print(
+        f"\nConfronto con {baseline['meta'].get('timestamp', 'baseline')} "
+        f"({metric}, soglia {threshold:.0%})"
+    )
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        change = result[key] / old[key] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<46}{old[key]:>12.2f}{result[key]:>12.2f} us"
+            f"{change:>+9.1%}{'  REGRESSIONE' if regressed else ''}"
+        )
+
+    if baseline["meta"].get("python") != platform.python_version():
+        print(
+            f"Attenzione: baseline misurata con Python {baseline['meta'].get('python')}, "
+            f"ora {platform.python_version()}"
+        )
+    return regressions
+
+
+def select(benchmarks: List[Benchmark], patterns: Optional[List[str]]) -> List[Benchmark]:
+    if not patterns:
+        return benchmarks
+    return [b for b in benchmarks if any(p in b.name for p in patterns)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmark delle primitive crittografiche e dei messaggi"
+    )
+    parser.add_argument(
+        "-g", "--groups", nargs="*", default=list(GROUPS), help="Gruppi da misurare"
+    )
+    parser.add_argument(
+        "-k",
+        "--filter",
+        action="append",
+        help="Esegue solo le misure il cui nome contiene il testo (ripetibile)",
+    )
+    parser.add_argument(
+        "-d",
+        "--devices",
+        type=int,
+        nargs="*",
+        default=list(DEFAULT_DEVICES),
+        help="Numero di dispositivi per le misure di verifica",
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=DEFAULT_REPEAT, help="Campioni per misura"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=DEFAULT_MIN_TIME, help="Durata minima di un campione (s)"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=DEFAULT_WARMUP, help="Riscaldamento per misura (s)"
+    )
+    parser.add_argument("-o", "--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("-b", "--baseline", help="Risultati JSON con cui confrontare")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Peggioramento massimo ammesso (0.15 = 15%%)",
+    )
+    parser.add_argument(
+        "--metric", choices=list(METRICS), default="min", help="Statistica da confrontare"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seme per gli input casuali")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    unknown = [g for g in args.groups if g not in GROUPS]
+    if unknown:
+        raise SystemExit(f"Gruppi sconosciuti: {unknown}")
+
+    benchmarks = []
+    for group_id in args.groups:
+        benchmarks += group_benchmarks(group_id, args.devices, args.batch_size)
+    message_group = args.groups[0] if args.groups else next(iter(GROUPS))
+    benchmarks += message_benchmarks(message_group)
+    benchmarks += misc_benchmarks(message_group)
+    benchmarks = select(benchmarks, args.filter)
+
+    print(f"Esecuzione di {len(benchmarks)} misure in {args.repeat} turni...\n")
+    results = run(benchmarks, args.repeat, args.min_time, args.warmup)
+
+    print(f"{'misura':<46}{'mediana':>12}{'min':>12}{'stdev':>10}")
+    for bench in benchmarks:
+        result = results[bench.name]
+        print(
+            f"{bench.name:<46}{result['median_us']:>9.2f} us{result['min_us']:>9.2f} us"
+            f"{result['stdev_us'] / result['median_us']:>9.1%}"
+        )
+
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=4)
+        print(f"\nRisultati salvati in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.metric)
+        if regressions:
+            print(f"\n{len(regressions)} misure peggiorate oltre la soglia")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,583 @@
+"""
+Generatore di carico per il protocollo di autenticazione.
+
+Ogni utente virtuale ha la propria connessione e ripete gli scenari del mix
+(autenticazione, registrazione, abbinamento di un secondo dispositivo, handshake)
+con ClientConnection e ClientApp del client. Con --rate gli scenari partono al ritmo
+indicato (al secondo, su tutti gli utenti), altrimenti ogni utente avvia il successivo
+appena termina il precedente. Alla fine vengono stampati throughput, latenze
+p50/p95/p99 ed errori per tipo di messaggio; con --output i risultati vengono salvati
+in JSON, con --compare vengono confrontati con quelli di un'esecuzione precedente.
+
+    python3 benchmarks/loadgen.py --local --users 200 --duration 30 --output run.json
+    python3 benchmarks/loadgen.py -i 127.0.0.1 -p 65432 --users 2000 --rate 500 \\
+        --mix auth=80,register=10,assoc=5,handshake=5 --compare run.json
+"""
+
+import argparse
+import datetime
+import json
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Il generatore usa la logica di protocollo del client
+project_root = Path(__file__).resolve().parent.parent
+sys.path.append(str(project_root / "client"))
+
+from client import ClientApp, ClientConnection, logger
+from utils.message import MessageType
+from utils.wire import ENCODING_BINARY, SUPPORTED_ENCODINGS
+
+DEFAULT_MIX = "auth=80,register=10,assoc=5,handshake=5"
+# Gli scenari in ritardo di oltre questa soglia rispetto a --rate vengono contati
+LATE_THRESHOLD = 0.010
+# Stack dei thread degli utenti virtuali: ne servono migliaia
+THREAD_STACK_SIZE = 512 * 1024
+PERCENTILES = (50, 95, 99)
+SERVER_START_TIMEOUT = 60.0
+
+
+class MemoryKeyStore:
+    """Chiavi private degli utenti virtuali, in memoria invece che in ~/.config/schnorr."""
+
+    def __init__(self):
+        self._keys = {}
+
+    def load_private_key(self, username: str) -> tuple[int, str]:
+        return self._keys[username]
+
+    def save_private_key(self, username: str, key: int, group_id: str) -> None:
+        self._keys[username] = (key, group_id)
+
+
+class Stats:
+    """Latenze ed errori per tipo di messaggio, raccolti da tutti i thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, dict[str, int]] = {}
+        self.scenarios = 0
+        self.late = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, op: str, seconds: float, error: str | None) -> None:
+        with self._lock:
+            self.latencies.setdefault(op, []).append(seconds)
+            if error is not None:
+                counts = self.errors.setdefault(op, {})
+                counts[error] = counts.get(error, 0) + 1
+
+    def scenario_done(self, late: bool) -> None:
+        with self._lock:
+            self.scenarios += 1
+            self.late += late
+
+    def add_traffic(self, sent: int, received: int) -> None:
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+
+class Pacer:
+    """Distribuisce gli avvii degli scenari a `rate` al secondo tra tutti i thread."""
+
+    def __init__(self, rate: float, start: float):
+        self.rate = rate
+        self.start = start
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self) -> bool:
+        """Attende il prossimo avvio; restituisce True se è già in ritardo."""
+        if not self.rate:
+            return False
+        with self._lock:
+            slot = self.start + self._next / self.rate
+            self._next += 1
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return delay < -LATE_THRESHOLD
+
+
+class VirtualUser:
+    def __init__(self, index: int, args, keys: MemoryKeyStore, stats: Stats, run_id: str):
+        self.index = index
+        self.args = args
+        self.keys = keys
+        self.stats = stats
+        self.username = f"lg-{run_id}-{index}"
+        self.registrations = 0
+        self.pairings = 0
+        self.ready = False
+        self.app: ClientApp | None = None
+
+    # ---------- connessione ----------
+
+    def connect(self, keys: MemoryKeyStore | None = None) -> ClientApp:
+        sock = socket.create_connection((self.args.ip, self.args.port), self.args.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = ClientConnection(sock)
+        return ClientApp(
+            conn,
+            interactive=self.args.interactive,
+            keys=keys or self.keys,
+            encodings=[self.args.encoding],
+            commitments=self.args.commitments,
+        )
+
+    def close(self, app: ClientApp) -> None:
+        """Chiude la connessione e aggiunge i byte scambiati al traffico misurato."""
+        conn = app.client_conn
+        self.stats.add_traffic(conn.bytes_sent, conn.bytes_received)
+        conn.close()
+
+    def reconnect(self) -> bool:
+        if self.app is not None:
+            self.close(self.app)
+        self.app = None
+        try:
+            self.app = self.connect()
+        except OSError as e:
+            self.stats.record("CONNECT", 0.0, type(e).__name__)
+            return False
+        return self.handshake(self.app)
+
+    def timed(self, msg_type: MessageType, app: ClientApp, fn, *args, **kwargs) -> bool:
+        app.client_conn.last_error = None
+        start = time.perf_counter()
+        try:
+            ok = bool(fn(*args, **kwargs))
+            error = None
+        except (OSError, KeyError, ValueError) as e:
+            ok = False
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+        if not ok and error is None:
+            last_error = app.client_conn.last_error
+            error = last_error.label if last_error is not None else "FAILED"
+        self.stats.record(msg_type.label, elapsed, error)
+        return ok
+
+    def handshake(self, app: ClientApp) -> bool:
+        return self.timed(
+            MessageType.HANDSHAKE_REQ, app, app.handshake, app.client_conn, self.args.groups
+        )
+
+    def auth(self) -> bool:
+        return self.timed(self.auth_type(), self.app, self.app.auth, self.username)
+
+    def auth_type(self) -> MessageType:
+        if self.args.interactive or not self.app.fast_auth:
+            return MessageType.AUTH_REQUEST
+        return MessageType.AUTH_PROOF
+
+    # ---------- scenari (iniziano e finiscono senza sessione) ----------
+
+    def setup(self) -> bool:
+        return self.reconnect() and self.scenario_register(self.username)
+
+    def scenario_auth(self) -> bool:
+        return self.auth() and self.logout(self.app)
+
+    def scenario_register(self, username: str | None = None) -> bool:
+        if username is None:
+            self.registrations += 1
+            username = f"{self.username}-r{self.registrations}"
+        return self.timed(
+            MessageType.REGISTER, self.app, self.app.register, username, f"loadgen-{self.index}"
+        ) and self.logout(self.app)
+
+    def scenario_assoc(self) -> bool:
+        if not self.auth():
+            return False
+        try:
+            # Il secondo dispositivo salva la propria chiave per lo stesso username:
+            # non deve sostituire quella del dispositivo principale
+            second = self.connect(MemoryKeyStore())
+        except OSError as e:
+            self.stats.record("CONNECT", 0.0, type(e).__name__)
+            return False
+        try:
+            if not self.handshake(second):
+                return False
+            self.pairings += 1
+            confirmed = []
+
+            # Il dispositivo principale conferma il token dalla propria connessione
+            def confirm(token: str) -> None:
+                confirmed.append(
+                    self.timed(MessageType.TOKEN_ASSOC, self.app, self.app.confirm_assoc, token)
+                )
+
+            ok = self.timed(
+                MessageType.ASSOC_REQUEST,
+                second,
+                second.assoc,
+                f"loadgen-{self.index}-p{self.pairings}",
+                on_token=confirm,
+            )
+            ok = ok and all(confirmed) and self.logout(second)
+        finally:
+            self.close(second)
+        return ok and self.logout(self.app)
+
+    def scenario_handshake(self) -> bool:
+        return self.handshake(self.app)
+
+    def logout(self, app: ClientApp) -> bool:
+        return self.timed(MessageType.LOGOUT, app, app.log_out)
+
+    # ---------- ciclo ----------
+
+    def run(self, barrier: threading.Barrier, pacer_box: list, end_box: list, mix: list) -> None:
+        # Connessione e registrazione iniziali non entrano nelle misure
+        stats, self.stats = self.stats, Stats()
+        self.ready = self.setup()
+        self.stats = stats
+        if self.app is not None:
+            self.app.client_conn.bytes_sent = self.app.client_conn.bytes_received = 0
+        barrier.wait()
+        if not self.ready:
+            return
+        pacer, end = pacer_box[0], end_box[0]
+        names, weights = zip(*mix)
+        while True:
+            late = pacer.wait()
+            if time.perf_counter() >= end:
+                break
+            scenario = random.choices(names, weights)[0]
+            ok = getattr(self, f"scenario_{scenario}")()
+            self.stats.scenario_done(late)
+            # Dopo un errore la sessione è in uno stato incerto: si riparte da capo
+            if not ok and not self.reconnect():
+                time.sleep(self.args.timeout)
+                self.reconnect()
+        if self.app is not None:
+            self.close(self.app)
+
+
+# ---------- risultati ----------
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Percentile con il metodo nearest-rank su una lista ordinata."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[rank]
+
+
+def summarize(stats: Stats, elapsed: float, args, setup_failures: int) -> dict:
+    operations = {}
+    total_messages = 0
+    for op, values in sorted(stats.latencies.items()):
+        values.sort()
+        errors = sum(stats.errors.get(op, {}).values())
+        total_messages += len(values)
+        operations[op] = {
+            "count": len(values),
+            "errors": errors,
+            "per_s": len(values) / elapsed,
+            "mean_ms": sum(values) / len(values) * 1e3,
+            **{f"p{p}_ms": percentile(values, p) * 1e3 for p in PERCENTILES},
+            "max_ms": values[-1] * 1e3,
+        }
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "target": f"{args.ip}:{args.port}",
+        "config": {
+            "users": args.users,
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": args.mix,
+            "interactive": args.interactive,
+            "groups": args.groups,
+            "encoding": args.encoding,
+        },
+        "elapsed_s": elapsed,
+        "setup_failures": setup_failures,
+        "scenarios": stats.scenarios,
+        "late_scenarios": stats.late,
+        "throughput": {
+            "scenarios_per_s": stats.scenarios / elapsed,
+            "messages_per_s": total_messages / elapsed,
+        },
+        "traffic": {
+            "bytes_sent": stats.bytes_sent,
+            "bytes_received": stats.bytes_received,
+            "bytes_per_scenario": (
+                (stats.bytes_sent + stats.bytes_received) / stats.scenarios
+                if stats.scenarios
+                else 0.0
+            ),
+        },
+        "operations": operations,
+        "errors": stats.errors,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"\nScenari: {result['scenarios']} in {result['elapsed_s']:.1f} s "
+        f"({result['throughput']['scenarios_per_s']:.1f}/s, "
+        f"{result['throughput']['messages_per_s']:.1f} scambi/s), "
+        f"in ritardo: {result['late_scenarios']}, setup falliti: {result['setup_failures']}"
+    )
+    traffic = result["traffic"]
+    print(
+        f"Traffico ({result['config']['encoding']}): {traffic['bytes_sent']} byte inviati, "
+        f"{traffic['bytes_received']} ricevuti, "
+        f"{traffic['bytes_per_scenario']:.0f} byte per scenario"
+    )
+    print(
+        f"{'tipo':<14}{'numero':>9}{'errori':>8}{'/s':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for op, s in result["operations"].items():
+        print(
+            f"{op:<14}{s['count']:>9}{s['errors']:>8}{s['per_s']:>9.1f}"
+            f"{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}"
+        )
+    for op, counts in result["errors"].items():
+        print(f"errori {op}: {counts}")
+
+
+def print_comparison(result: dict, baseline: dict) -> None:
+    """Variazione percentuale di throughput e p95 rispetto a un'esecuzione precedente."""
+
+    def delta(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+7.1f}%" if old else "    n/d"
+
+    old_rate = baseline["throughput"]["scenarios_per_s"]
+    print(
+        f"\nRispetto a {baseline.get('timestamp', 'baseline')}: scenari/s "
+        f"{delta(result['throughput']['scenarios_per_s'], old_rate)}"
+    )
+    old_traffic = baseline.get("traffic")
+    if old_traffic:
+        print(
+            f"byte per scenario "
+            f"{delta(result['traffic']['bytes_per_scenario'], old_traffic['bytes_per_scenario'])}"
+        )
+    for op, s in result["operations"].items():
+        old = baseline["operations"].get(op)
+        if old is None:
+            continue
+        print(
+            f"{op:<14} p50 {delta(s['p50_ms'], old['p50_ms'])}  "
+            f"p95 {delta(s['p95_ms'], old['p95_ms'])}  "
+            f"p99 {delta(s['p99_ms'], old['p99_ms'])}  "
+            f"errori {old['errors']} -> {s['errors']}"
+        )
+
+
+# ---------- server locale ----------
+
+
+def start_local_server(args, workdir: Path) -> subprocess.Popen:
+    """Avvia server.py con utenti e token in memoria, su una porta libera di localhost."""
+    server_dir = project_root / "server"
+    with open(server_dir / "config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    config.update(host="127.0.0.1", port=port, db_backend="memory", pairing_backend="memory")
+    if config.get("fixed_base_cache_dir"):
+        config["fixed_base_cache_dir"] = str(server_dir / config["fixed_base_cache_dir"])
+    for option in args.server_option:
+        key, _, value = option.partition("=")
+        try:
+            config[key] = json.loads(value)
+        except json.JSONDecodeError:
+            config[key] = value
+    # Con utenti in memoria il server rifiuta la modalità multiprocesso
+    if config.get("processes", 1) > 1:
+        raise RuntimeError("Il server locale usa il backend in memoria: processes deve essere 1")
+
+    with open(workdir / "config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=4)
+
+    log = open(workdir / "server.log", "w")
+    process = subprocess.Popen(
+        [sys.executable, str(server_dir / "server.py")],
+        cwd=workdir,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    args.ip, args.port = "127.0.0.1", port
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Il server locale è terminato, vedi {workdir / 'server.log'}")
+        try:
+            socket.create_connection((args.ip, args.port), 1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Il server locale non ha aperto la porta in tempo")
+
+
+def stop_local_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ---------- main ----------
+
+
+def parse_mix(mix: str) -> list[tuple[str, float]]:
+    scenarios = []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if not hasattr(VirtualUser, f"scenario_{name}"):
+            raise SystemExit(f"Scenario sconosciuto: {name}")
+        scenarios.append((name, float(weight or 1)))
+    return scenarios
+
+
+def raise_file_limit(users: int) -> None:
+    """Ogni utente virtuale usa fino a 2 socket: alza il limite dei file aperti se serve."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * users + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generatore di carico per il server di autenticazione di Schnorr"
+    )
+    parser.add_argument("-i", "--ip", default="127.0.0.1", help="Indirizzo IP del server")
+    parser.add_argument("-p", "--port", type=int, default=65432, help="Porta del server")
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Avvia un server locale con utenti e token in memoria",
+    )
+    parser.add_argument(
+        "--server-option",
+        action="append",
+        default=[],
+        metavar="CHIAVE=VALORE",
+        help="Sovrascrive una voce di config.json del server locale (ripetibile)",
+    )
+    parser.add_argument(
+        "-u", "--users", type=int, default=100, help="Utenti virtuali concorrenti"
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=0,
+        help="Scenari avviati al secondo (0: ogni utente riparte appena finisce)",
+    )
+    parser.add_argument("-t", "--duration", type=float, default=30, help="Durata (secondi)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Pesi degli scenari")
+    parser.add_argument(
+        "-g", "--groups", nargs="*", default=None, help="Gruppi proposti nell'handshake"
+    )
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="Usa l'autenticazione interattiva (sfida inviata dal server)",
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=SUPPORTED_ENCODINGS,
+        default=ENCODING_BINARY,
+        help="Codifica dei messaggi proposta nell'handshake",
+    )
+    parser.add_argument(
+        "--commitments",
+        type=int,
+        default=0,
+        help="Commitment precalcolati dai client (0: calcolati al momento, come un client "
+        "appena avviato)",
+    )
+    parser.add_argument("--timeout", type=float, default=10, help="Timeout dei socket (secondi)")
+    parser.add_argument("-o", "--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("--compare", help="Risultati JSON di un'esecuzione precedente")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    mix = parse_mix(args.mix)
+
+    # Con migliaia di utenti virtuali i log del client vanno limitati agli errori
+    logger.logger.remove()
+    logger.logger.add(sys.stderr, level="ERROR")
+
+    raise_file_limit(args.users)
+    threading.stack_size(THREAD_STACK_SIZE)
+
+    workdir = Path(tempfile.mkdtemp(prefix="loadgen-"))
+    server = start_local_server(args, workdir) if args.local else None
+    try:
+        stats = Stats()
+        keys = MemoryKeyStore()
+        run_id = f"{int(time.time()):x}{random.randrange(16**4):04x}"
+        users = [VirtualUser(i, args, keys, stats, run_id) for i in range(args.users)]
+
+        # Il tempo parte quando tutti gli utenti sono connessi e registrati
+        pacer_box, end_box = [], []
+
+        def start_clock():
+            now = time.perf_counter()
+            pacer_box.append(Pacer(args.rate, now))
+            end_box.append(now + args.duration)
+
+        barrier = threading.Barrier(args.users, action=start_clock)
+        threads = [
+            threading.Thread(target=u.run, args=(barrier, pacer_box, end_box, mix), daemon=True)
+            for u in users
+        ]
+        print(f"Avvio di {args.users} utenti virtuali verso {args.ip}:{args.port}...")
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - pacer_box[0].start
+
+        setup_failures = sum(not u.ready for u in users)
+        result = summarize(stats, elapsed, args, setup_failures)
+    finally:
+        if server is not None:
+            stop_local_server(server)
+
+    print_report(result)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(result, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+        print(f"\nRisultati salvati in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
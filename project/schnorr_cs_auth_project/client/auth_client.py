@@ -0,0 +1,518 @@
+"""
+Libreria client per servizi che autenticano molti utenti verso lo stesso server.
+
+A differenza del menu di client.py (una connessione e un utente alla volta), AuthClient
+tiene un pool di connessioni per server e gruppo, riusa l'esito dell'handshake per le
+connessioni successive e autentica più utenti in parallelo sulle stesse connessioni:
+ogni richiesta porta un `request_id`, che il server riporta nella risposta.
+
+Le autenticazioni sono solo verifiche: il server conserva una sessione per connessione,
+quindi la libreria non apre sessioni né segna i dispositivi come collegati (AUTH_PROOF
+con `verify_only`) e non c'è alcun logout da eseguire.
+
+    with AuthClient("127.0.0.1", 65432) as auth:
+        auth.authenticate("alice")
+        auth.authenticate_many(["bob", "carol", "dave"])
+
+Le chiavi private vengono lette con `keys.find_private_key` (di default i file di
+KeyManager in ~/.config/schnorr).
+"""
+
+import itertools
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from client import ClientConnection, KeyManager, logger
+from utils.commitments import DEFAULT_POOL_SIZE, get_commitment_pool
+from utils.fiat_shamir import DEFAULT_NONCE_TTL, derive_challenge
+from utils.group import Group, get_group, key_fingerprint
+from utils.groups import GROUPS
+from utils.message import ErrorType, MessageType
+from utils.wire import ENCODING_JSON, REQUEST_ID_LIMIT, SUPPORTED_ENCODINGS, scalar_value
+
+# Connessioni aperte al massimo verso un server, per gruppo
+DEFAULT_CONNECTIONS = 4
+# Autenticazioni contemporanee per connessione in `authenticate_many`
+DEFAULT_FLOWS_PER_CONNECTION = 8
+# Attesa massima di una risposta (secondi)
+DEFAULT_TIMEOUT = 10.0
+# I nonce conservati più a lungo vengono scartati: il server li accetta per
+# DEFAULT_NONCE_TTL secondi dall'emissione
+NONCE_MAX_AGE = DEFAULT_NONCE_TTL / 2
+
+
+@dataclass(frozen=True)
+class HandshakeResult:
+    """Esito dell'handshake con un server, riusato per tutte le sue connessioni."""
+
+    group_id: str
+    encoding: str
+    # True se il server emette nonce, cioè accetta AUTH_PROOF
+    fast_auth: bool
+
+
+_handshakes: Dict[Tuple[str, int, str], HandshakeResult] = {}
+_handshakes_lock = threading.Lock()
+
+
+def cached_handshake(host: str, port: int, group_id: str) -> Optional[HandshakeResult]:
+    """Esito dell'ultimo handshake riuscito con il server nel gruppo `group_id`."""
+    return _handshakes.get((host, port, group_id))
+
+
+def forget_handshake(host: str, port: int, group_id: str) -> None:
+    """Dimentica l'esito dell'handshake, es. dopo un cambio di configurazione del server."""
+    with _handshakes_lock:
+        _handshakes.pop((host, port, group_id), None)
+
+
+class MultiplexedConnection:
+    """
+    Connessione condivisa da più richieste contemporanee.
+
+    Ogni richiesta riceve un `request_id` che il server riporta in tutte le sue
+    risposte: un thread di lettura consegna ogni messaggio al Future della richiesta
+    corrispondente, così che più thread possano attendere risposte sulla stessa
+    connessione. Il server elabora i messaggi di una connessione in ordine, quindi il
+    parallelismo vero viene dal pool; sulla singola connessione le richieste si
+    accodano senza attese di rete tra l'una e l'altra.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = DEFAULT_TIMEOUT):
+        sock = socket.create_connection((host, port), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Le attese hanno il proprio timeout: il thread di lettura resta fermo su recv
+        sock.settimeout(None)
+        self.conn = ClientConnection(sock)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.handshake: Optional[HandshakeResult] = None
+        self.group: Optional[Group] = None
+        # Flussi di autenticazione che stanno usando la connessione (vedi ConnectionPool)
+        self.users = 0
+        # Gli scambi AUTH_REQUEST/AUTH_RESPONSE usano la sessione della connessione
+        self.exclusive = threading.Lock()
+        self.closed = False
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._nonces: Deque[Tuple[float, str]] = deque()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(
+            target=self._read_loop, name=f"reader-{host}:{port}", daemon=True
+        )
+        self._reader.start()
+
+    # ---------- richieste ----------
+
+    def _submit(self, msg_type: MessageType, fields: Optional[dict]) -> Tuple[int, Future]:
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError(f"Connessione con {self.host}:{self.port} chiusa")
+            request_id = next(self._ids) % REQUEST_ID_LIMIT
+            self._pending[request_id] = future
+        with self._send_lock:
+            sent = self.conn.send(msg_type, {**(fields or {}), "request_id": request_id})
+        if not sent:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            future.set_exception(ConnectionError(f"Invio di {msg_type} non riuscito"))
+        return request_id, future
+
+    def request(self, msg_type: MessageType, fields: Optional[dict] = None) -> Future:
+        """Invia una richiesta; il Future restituisce la risposta (anche un ERROR)."""
+        return self._submit(msg_type, fields)[1]
+
+    def call(self, msg_type: MessageType, fields: Optional[dict] = None) -> dict:
+        """Invia una richiesta e ne attende la risposta per al più `timeout` secondi."""
+        request_id, future = self._submit(msg_type, fields)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+
+    def notify(self, msg_type: MessageType, fields: Optional[dict] = None) -> bool:
+        """Invia un messaggio che non prevede risposta."""
+        with self._send_lock:
+            return self.conn.send(msg_type, fields)
+
+    # ---------- handshake e nonce ----------
+
+    def negotiate(self, groups: List[str], encodings: List[str]) -> Tuple[HandshakeResult, str]:
+        """Handshake sulla connessione; restituisce l'esito e il nonce ricevuto."""
+        response = self.call(MessageType.HANDSHAKE_REQ, {"groups": groups, "encodings": encodings})
+        if response.get("type_code") != MessageType.GROUP_SELECTION.code:
+            error = ErrorType.from_code(response.get("error_code"))
+            raise ConnectionError(
+                f"Handshake con {self.host}:{self.port} non riuscito: "
+                f"{error.message() if error else response.get('type')}"
+            )
+        if response.get("group_id") not in GROUPS:
+            raise ConnectionError(f"Gruppo {response.get('group_id')} non supportato dal client")
+        # La codifica è già stata cambiata dal thread di lettura
+        self.notify(MessageType.HANDSHAKE_RES)
+        result = HandshakeResult(
+            response["group_id"],
+            response.get("encoding", ENCODING_JSON),
+            response.get("nonce") is not None,
+        )
+        self.handshake = result
+        self.group = get_group(result.group_id)
+        return result, response.get("nonce")
+
+    def take_nonce(self) -> Optional[str]:
+        """Un nonce non ancora usato e non troppo vecchio, se disponibile."""
+        now = time.monotonic()
+        with self._lock:
+            while self._nonces:
+                received, nonce = self._nonces.popleft()
+                if now - received < NONCE_MAX_AGE:
+                    return nonce
+        return None
+
+    def put_nonce(self, nonce: Optional[str]) -> None:
+        if nonce:
+            with self._lock:
+                self._nonces.append((time.monotonic(), nonce))
+
+    def fresh_nonce(self) -> Optional[str]:
+        """Chiede un nonce al server ripetendo l'handshake con i parametri già negoziati."""
+        _, nonce = self.negotiate([self.handshake.group_id], [self.handshake.encoding])
+        return nonce
+
+    # ---------- ricezione e chiusura ----------
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                msg = self.conn.receive()
+            except OSError:
+                msg = None
+            if msg is None:
+                break
+
+            if msg.get("type_code") == MessageType.GROUP_SELECTION.code:
+                # I messaggi successivi usano la codifica scelta: va cambiata prima di
+                # leggere il prossimo frame
+                group_id = msg.get("group_id")
+                if group_id in GROUPS:
+                    self.conn.set_encoding(msg.get("encoding", ENCODING_JSON), get_group(group_id))
+
+            with self._lock:
+                future = self._pending.pop(msg.get("request_id"), None)
+            if future is not None:
+                future.set_result(msg)
+        self._fail_pending()
+
+    def _fail_pending(self) -> None:
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError(f"Connessione con {self.host}:{self.port} chiusa")
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+        self.conn.close()
+
+
+class ConnectionPool:
+    """
+    Connessioni verso un server in un gruppo, aperte al bisogno fino a `size`.
+
+    Ogni flusso di autenticazione prende la connessione meno usata; ne apre una nuova
+    solo se tutte sono già in uso e il limite non è stato raggiunto. Le connessioni
+    chiuse vengono scartate e sostituite. La prima connessione negozia codifica e
+    disponibilità dei nonce, le successive propongono direttamente quelle.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        group_id: str,
+        size: int = DEFAULT_CONNECTIONS,
+        encodings: Optional[List[str]] = None,
+        commitments: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.group_id = group_id
+        self.size = size
+        self.encodings = encodings or SUPPORTED_ENCODINGS
+        self.commitments = commitments
+        self.timeout = timeout
+        self._connections: List[MultiplexedConnection] = []
+        self._opening = 0
+        self._lock = threading.Lock()
+        # Segnalata quando una connessione in apertura è pronta (o non è stata aperta)
+        self._ready = threading.Condition(self._lock)
+        self.opened = 0
+
+    def _open(self) -> MultiplexedConnection:
+        conn = MultiplexedConnection(self.host, self.port, self.timeout)
+        cached = cached_handshake(self.host, self.port, self.group_id)
+        try:
+            result, nonce = conn.negotiate(
+                [self.group_id], [cached.encoding] if cached else self.encodings
+            )
+        except (ConnectionError, TimeoutError):
+            conn.close()
+            raise
+        conn.put_nonce(nonce)
+
+        if cached is None:
+            # Prima connessione nel gruppo: tabelle e commitment per le autenticazioni
+            conn.group.precompute(KeyManager.SCHNORR_DIR)
+            get_commitment_pool(conn.group, self.commitments)
+            with _handshakes_lock:
+                _handshakes[(self.host, self.port, self.group_id)] = result
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Connessione da usare per un flusso; resta condivisa con gli altri flussi."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                conn.users -= 1
+
+    def _acquire(self) -> MultiplexedConnection:
+        with self._lock:
+            while True:
+                self._connections = [c for c in self._connections if not c.closed]
+                full = len(self._connections) + self._opening >= self.size
+                least = min(self._connections, key=lambda c: c.users, default=None)
+                if least is not None and (least.users == 0 or full):
+                    least.users += 1
+                    return least
+                if not full:
+                    break
+                # Tutte le connessioni disponibili sono ancora in apertura
+                self._ready.wait()
+            self._opening += 1
+
+        try:
+            conn = self._open()
+        except (OSError, TimeoutError):
+            with self._lock:
+                self._opening -= 1
+                self._ready.notify_all()
+                if least is None or least.closed:
+                    raise
+                # Il server non accetta altre connessioni: si condivide quella esistente
+                least.users += 1
+                return least
+
+        with self._lock:
+            self._opening -= 1
+            self._connections.append(conn)
+            self.opened += 1
+            conn.users += 1
+            self._ready.notify_all()
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connections": len(self._connections),
+                "opened": self.opened,
+                "in_use": sum(c.users for c in self._connections),
+            }
+
+
+class AuthClient:
+    """
+    Autenticazione di più utenti verso un server su connessioni condivise.
+
+    Con un server che emette nonce ogni autenticazione è un solo AUTH_PROOF (Fiat-Shamir)
+    e più utenti possono autenticarsi insieme sulla stessa connessione. Altrimenti si
+    ricade sullo scambio interattivo, che usa la sessione della connessione ed è quindi
+    eseguito da un flusso alla volta per connessione. Il server deve riportare il
+    `request_id` nelle risposte.
+
+    Un'autenticazione riuscita non lascia login sul server: AUTH_PROOF viene inviato con
+    `verify_only`, e nello scambio interattivo (che non lo prevede) la sessione aperta
+    dal server viene chiusa subito con LOGOUT.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        connections: int = DEFAULT_CONNECTIONS,
+        keys=KeyManager,
+        encodings: Optional[List[str]] = None,
+        commitments: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.keys = keys
+        self.encodings = encodings
+        self.commitments = commitments
+        self.timeout = timeout
+        self._pools: Dict[str, ConnectionPool] = {}
+        self._pools_lock = threading.Lock()
+        # Impronte delle chiavi già calcolate, per (gruppo, chiave privata)
+        self._key_ids: Dict[Tuple[str, int], str] = {}
+
+    def __enter__(self) -> "AuthClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def pool(self, group_id: str) -> ConnectionPool:
+        """Pool delle connessioni nel gruppo `group_id`, creato al primo utilizzo."""
+        pool = self._pools.get(group_id)
+        if pool is not None:
+            return pool
+        with self._pools_lock:
+            pool = self._pools.get(group_id)
+            if pool is None:
+                pool = self._pools[group_id] = ConnectionPool(
+                    self.host, self.port, group_id, self.connections,
+                    self.encodings, self.commitments, self.timeout,
+                )
+            return pool
+
+    def _key_id(self, group: Group, alpha: int) -> str:
+        key = (group.group_id, alpha)
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = key_fingerprint(group.encode(group.base_exp(alpha)))
+            self._key_ids[key] = key_id
+        return key_id
+
+    # ---------- autenticazione ----------
+
+    def authenticate(self, username: str) -> bool:
+        """Autentica `username` con la sua chiave privata; può essere chiamato da più thread."""
+        key = self.keys.find_private_key(username)
+        if key is None:
+            logger.warning(f"[CLIENT] Chiave privata di {username} non trovata")
+            return False
+        alpha, group_id = key
+
+        with self.pool(group_id).connection() as conn:
+            if conn.handshake.fast_auth:
+                return self._auth_proof(conn, username, alpha)
+            with conn.exclusive:
+                return self._auth_interactive(conn, username, alpha)
+
+    def authenticate_many(
+        self, usernames: Iterable[str], workers: Optional[int] = None
+    ) -> Dict[str, bool]:
+        """Autentica gli utenti in parallelo; restituisce l'esito per ciascuno."""
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            return {}
+        workers = workers or min(
+            len(usernames), self.connections * DEFAULT_FLOWS_PER_CONNECTION
+        )
+
+        def attempt(username: str) -> bool:
+            try:
+                return self.authenticate(username)
+            except (ConnectionError, TimeoutError) as e:
+                logger.warning(f"[CLIENT] Autenticazione di {username} interrotta: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth") as executor:
+            return dict(zip(usernames, executor.map(attempt, usernames)))
+
+    def _auth_proof(self, conn: MultiplexedConnection, username: str, alpha: int) -> bool:
+        group = conn.group
+        commitments = get_commitment_pool(group, self.commitments)
+        # Un secondo tentativo solo se il nonce risulta scaduto o già usato
+        for _ in range(2):
+            nonce = conn.take_nonce() or conn.fresh_nonce()
+            alpha_t, u_t = commitments.take()
+            c = derive_challenge(group.group_id, group.q, username, u_t, nonce)
+            response = conn.call(
+                MessageType.AUTH_PROOF,
+                {
+                    "username": username,
+                    "temp": u_t,
+                    "response": hex((alpha_t + alpha * c) % group.q),
+                    "nonce": nonce,
+                    "key_id": self._key_id(group, alpha),
+                    "verify_only": True,
+                },
+            )
+            type_code = response.get("type_code")
+            if type_code in (MessageType.ACCEPTED.code, MessageType.REJECTED.code):
+                conn.put_nonce(response.get("nonce"))
+                return type_code == MessageType.ACCEPTED.code
+
+            error = ErrorType.from_code(response.get("error_code"))
+            if error is not ErrorType.NONCE_INVALID:
+                # Il server consuma il nonce solo con una prova valida
+                conn.put_nonce(nonce)
+                logger.warning(
+                    f"[CLIENT] Autenticazione di {username} fallita: "
+                    f"{error.message() if error else response.get('type')}"
+                )
+                return False
+        return False
+
+    def _auth_interactive(self, conn: MultiplexedConnection, username: str, alpha: int) -> bool:
+        group = conn.group
+        alpha_t, u_t = get_commitment_pool(group, self.commitments).take()
+        response = conn.call(
+            MessageType.AUTH_REQUEST,
+            {"username": username, "temp": u_t, "key_id": self._key_id(group, alpha)},
+        )
+        if response.get("type_code") != MessageType.CHALLENGE.code:
+            error = ErrorType.from_code(response.get("error_code"))
+            logger.warning(
+                f"[CLIENT] Autenticazione di {username} fallita: "
+                f"{error.message() if error else response.get('type')}"
+            )
+            return False
+
+        c = scalar_value(response["challenge"])
+        response = conn.call(
+            MessageType.AUTH_RESPONSE, {"response": hex((alpha_t + alpha * c) % group.q)}
+        )
+        if response.get("type_code") != MessageType.ACCEPTED.code:
+            return False
+        # Il login appena registrato dal server verrebbe sostituito dal prossimo utente
+        # sulla connessione senza poter più essere chiuso
+        conn.call(MessageType.LOGOUT)
+        return True
+
+    def close(self) -> None:
+        with self._pools_lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def stats(self) -> dict:
+        """Connessioni aperte, in uso e aperte in totale, per gruppo."""
+        return {group_id: pool.stats() for group_id, pool in self._pools.items()}
@@ -1,5 +1,4 @@
 import argparse
-import json
 import platform
 import qrcode
 import random
@@ -7,10 +6,28 @@ import socket
 import sys
 from pathlib import Path
 
-from utils.groups import GROUPS
+from utils.commitments import DEFAULT_POOL_SIZE, get_commitment_pool
+from utils.fiat_shamir import derive_challenge
+from utils.framing import (
+    DEFAULT_MAX_FRAME_SIZE,
+    RECV_BUFFER_SIZE,
+    FrameDecoder,
+    FrameTooLargeError,
+    encode_frame,
+)
+from utils.group import get_group, key_fingerprint
+from utils.groups import GROUPS, LEGACY_GROUP_ID
 from utils.logger import Logger
 from utils.message import MessageType, ErrorType
 from utils.utils import get_linux_device_model
+from utils.wire import (
+    ENCODING_JSON,
+    JSON_CODEC,
+    SUPPORTED_ENCODINGS,
+    MalformedMessageError,
+    get_codec,
+    scalar_value,
+)
 
 # --- COSTANTI ---
 
@@ -20,43 +37,74 @@ logger = Logger()
 
 
 class ClientConnection:
-    MESSAGE_LENGTH = 4096
+    MESSAGE_LENGTH = RECV_BUFFER_SIZE
 
-    def __init__(self, sock: socket.socket):
+    def __init__(self, sock: socket.socket, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
         self.sock = sock
-
-    def _send_json(self, message: dict):
+        self.max_frame_size = max_frame_size
+        self._recv_buffer = bytearray(self.MESSAGE_LENGTH)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._decoder = FrameDecoder(max_frame_size)
+        # Codifica dei messaggi: JSON fino all'esito dell'handshake
+        self.codec = JSON_CODEC
+        # Ultimo errore ricevuto dal server, per chi usa ClientApp senza menu
+        self.last_error: ErrorType | None = None
+        # Byte scambiati sulla connessione, header dei frame compresi
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.closed = False
+
+    def set_encoding(self, encoding: str, group) -> None:
+        """Usa `encoding` (negoziata nell'handshake) per i messaggi successivi."""
+        self.codec = get_codec(encoding, group)
+
+    def _send(self, msg_type: MessageType, extra_data=None) -> bool:
         try:
-            self.sock.sendall(json.dumps(message).encode())
+            frame = encode_frame(self.codec.encode(msg_type, extra_data), self.max_frame_size)
+            self.sock.sendall(frame)
+            self.bytes_sent += len(frame)
+            return True
+        except FrameTooLargeError as e:
+            logger.error(f"[CLIENT] Errore: messaggio troppo grande ({e})")
         except BrokenPipeError:
             logger.error("[CLIENT] Errore: connessione chiusa durante l'invio")
         except OSError as e:
             logger.error(f"[CLIENT] Errore di invio: {e}")
+        except ValueError as e:
+            logger.error(f"[CLIENT] Errore: messaggio {msg_type} non codificabile ({e})")
+        return False
 
     def receive(self):
         try:
-            data = self.sock.recv(self.MESSAGE_LENGTH)
-            if not data:
-                logger.warning("[CLIENT] Connessione chiusa dal server")
-                return None
-            return json.loads(data.decode())
-        except json.JSONDecodeError:
-            logger.error("[CLIENT] Errore nel parsing del messaggio JSON")
+            while (frame := self._decoder.next_frame()) is None:
+                n = self.sock.recv_into(self._recv_view)
+                if not n:
+                    if not self.closed:
+                        logger.warning("[CLIENT] Connessione chiusa dal server")
+                    return None
+                self.bytes_received += n
+                self._decoder.feed(self._recv_view[:n])
+            return self.codec.decode(frame)
+        except MalformedMessageError as e:
+            logger.error(f"[CLIENT] Errore: {e}")
+            return None
+        except FrameTooLargeError as e:
+            logger.error(f"[CLIENT] Errore: {e}")
             return None
         except ConnectionResetError:
             logger.warning("[CLIENT] Connessione resettata dal server")
             return None
 
-    def send(self, msg_type: MessageType, extra_data=None):
-        payload = {
-            "type_code": msg_type.code,
-            "type": msg_type.label,
-        }
-        if extra_data:
-            payload.update(extra_data)
-        self._send_json(payload)
+    def send(self, msg_type: MessageType, extra_data=None) -> bool:
+        return self._send(msg_type, extra_data)
 
     def close(self):
+        self.closed = True
+        try:
+            # Sveglia un eventuale thread fermo in `receive`
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         try:
             self.sock.close()
         except OSError:
@@ -68,8 +116,11 @@ class KeyManager:
     SCHNORR_DIR = CONFIG_PATH / "schnorr"
 
     @classmethod
-    def load_private_key(cls, username: str) -> int:
-        """Carica la chiave privata dal file, esce se non trovata."""
+    def find_private_key(cls, username: str) -> tuple[int, str] | None:
+        """
+        Carica la chiave privata e il gruppo in cui è stata generata, None se non trovata.
+        I file senza gruppo appartengono a LEGACY_GROUP_ID.
+        """
         privkey_path = cls.SCHNORR_DIR / f"{username}_privkey.txt"
         try:
             with open(privkey_path, "r") as f:
@@ -77,20 +128,29 @@ class KeyManager:
                     logger.debug(
                         f"[CLIENT] INFO: lettura chiave privata da {privkey_path}."
                     )
-                return int(f.read())
+                group_id, _, key = f.read().strip().rpartition(":")
+                return int(key), group_id or LEGACY_GROUP_ID
         except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load_private_key(cls, username: str) -> tuple[int, str]:
+        """Come `find_private_key`, ma esce se la chiave non è stata trovata."""
+        key = cls.find_private_key(username)
+        if key is None:
             logger.error(
                 "[CLIENT] Errore: chiave privata non trovata. Registrati prima di autenticarti."
             )
             sys.exit(1)
+        return key
 
     @classmethod
-    def save_private_key(cls, username: str, key: int) -> None:
-        """Salva la chiave privata su file."""
+    def save_private_key(cls, username: str, key: int, group_id: str) -> None:
+        """Salva la chiave privata su file, insieme al gruppo in cui è stata generata."""
         cls.SCHNORR_DIR.mkdir(parents=True, exist_ok=True)
         privkey_path = cls.SCHNORR_DIR / f"{username}_privkey.txt"
         with open(privkey_path, "w") as f:
-            f.write(str(key))
+            f.write(f"{group_id}:{key}")
         if DEBUG:
             logger.debug(
                 f"[CLIENT] INFO: chiave privata memorizzata in {privkey_path}."
@@ -98,11 +158,35 @@ class KeyManager:
 
 
 class ClientApp:
-    def __init__(self, client_conn: ClientConnection):
+    def __init__(
+        self,
+        client_conn: ClientConnection,
+        interactive: bool = False,
+        keys=KeyManager,
+        encodings: list[str] | None = None,
+        commitments: int = DEFAULT_POOL_SIZE,
+    ):
         self.client_conn = client_conn
-
-    def handshake(self, client: ClientConnection) -> bool:
-        self.client_conn.send(MessageType.HANDSHAKE_REQ)
+        # Codifiche dei messaggi proposte al server, in ordine di preferenza
+        self.encodings = encodings or SUPPORTED_ENCODINGS
+        # Dove leggere e salvare le chiavi private: di default i file in ~/.config/schnorr
+        self.keys = keys
+        # Con interactive=True si usa sempre lo scambio AUTH_REQUEST/CHALLENGE/AUTH_RESPONSE
+        self.interactive = interactive
+        self.nonce = None
+        self.fast_auth = False
+        # Commitment da tenere pronti per l'autenticazione (0: calcolati al momento)
+        self.commitment_pool_size = commitments
+        self.commitments = None
+        # Impronte delle chiavi già calcolate, per (gruppo, chiave privata)
+        self._key_ids: dict[tuple[str, int], str] = {}
+
+    def handshake(self, client: ClientConnection, groups: list[str] | None = None) -> bool:
+        """Negozia il gruppo con il server tra quelli indicati (di default tutti i supportati)."""
+        self.client_conn.send(
+            MessageType.HANDSHAKE_REQ,
+            {"groups": groups or list(GROUPS), "encodings": self.encodings},
+        )
         if DEBUG:
             logger.debug("[CLIENT] Richiesta di handshake inviata al server...")
 
@@ -114,8 +198,6 @@ class ClientApp:
         if DEBUG:
             logger.debug("[CLIENT] Fase di handshake...")
 
-        self.client_conn.send(MessageType.HANDSHAKE_RES)
-
         if response.get("type_code") == MessageType.GROUP_SELECTION.code:
             group = response.get("group_id")
             logger.info(f"[CLIENT] Gruppo selezionato dal server: {group}")
@@ -124,19 +206,32 @@ class ClientApp:
                 logger.error("[CLIENT] Gruppo crittografico non supportato dal client.")
                 return False
 
-            self.p = GROUPS[group]["p"]
-            self.g = GROUPS[group]["g"]
-            self.q = (self.p - 1) // 2
+            self.group_id = group
+            self.group = get_group(group)
+            self.q = self.group.q
+            # Dopo GROUP_SELECTION il server usa la codifica scelta, HANDSHAKE_RES compreso
+            encoding = response.get("encoding", ENCODING_JSON)
+            self.client_conn.set_encoding(encoding, self.group)
+            if DEBUG:
+                logger.debug(f"[CLIENT] Codifica dei messaggi: {encoding}")
+            self.client_conn.send(MessageType.HANDSHAKE_RES)
+
+            self.group.precompute(KeyManager.SCHNORR_DIR)
+            self.commitments = get_commitment_pool(self.group, self.commitment_pool_size)
+            # Nonce per l'autenticazione in un solo round trip, se il server la supporta
+            self.nonce = response.get("nonce")
+            self.fast_auth = self.nonce is not None
 
             return True
 
-    def register(self) -> bool:
-        username = input(
-            "[INPUT] Inserisci uno username per la registrazione: "
-        ).strip()
+    def register(self, username: str | None = None, device_name: str | None = None) -> bool:
+        if username is None:
+            username = input(
+                "[INPUT] Inserisci uno username per la registrazione: "
+            ).strip()
         alpha = random.randint(1, self.q - 1)
-        device_name = get_device_name()
-        public_key = hex(pow(self.g, alpha, self.p))
+        device_name = device_name or get_device_name()
+        public_key = self.group.encode(self.group.base_exp(alpha))
 
         self.client_conn.send(
             MessageType.REGISTER,
@@ -154,33 +249,50 @@ class ClientApp:
 
         if response.get("type_code") == MessageType.REGISTERED.code:
             logger.info(f"[CLIENT] {MessageType.REGISTERED.message()}")
-            KeyManager.save_private_key(username, alpha)
+            self.keys.save_private_key(username, alpha, self.group_id)
+            self.key_id(alpha, public_key)
             return True
         else:
             logger.warning("[CLIENT] Risposta inattesa dal server:", response)
             return False
 
-    def auth(self) -> bool:
-        username = input(
-            "[INPUT] Inserisci uno username per l'autenticazione: "
-        ).strip()
-        alpha = KeyManager.load_private_key(username)
+    def auth(self, username: str | None = None) -> bool:
+        if username is None:
+            username = input(
+                "[INPUT] Inserisci uno username per l'autenticazione: "
+            ).strip()
+        alpha, group_id = self.keys.load_private_key(username)
+
+        # La chiave vale solo nel gruppo in cui è stata generata: se serve si rinegozia
+        if group_id != self.group_id:
+            if DEBUG:
+                logger.debug(f"[CLIENT] Rinegoziazione del gruppo {group_id}...")
+            if not self.handshake(self.client_conn, [group_id]):
+                return False
+        elif self.fast_auth and not self.nonce and not self.interactive:
+            # Il nonce è già stato usato: se ne chiede uno nuovo rifacendo l'handshake
+            if not self.handshake(self.client_conn, [group_id]):
+                return False
+
+        # Commitment precalcolato in background: nessuna esponenziazione prima dell'invio
+        alpha_t, u_t = self.commitments.take()
+        # Impronta della chiave: il server verifica solo questo dispositivo
+        key_id = self.key_id(alpha)
+
+        if self.nonce and not self.interactive:
+            return self.auth_proof(username, alpha, alpha_t, u_t, key_id)
 
-        alpha_t = random.randint(1, self.q - 1)
-        u_t = hex(pow(self.g, alpha_t, self.p))
         self.client_conn.send(
-            MessageType.AUTH_REQUEST, {"temp": u_t, "username": username}
+            MessageType.AUTH_REQUEST, {"temp": u_t, "username": username, "key_id": key_id}
         )
 
         response = wait_for_response(self.client_conn, {MessageType.CHALLENGE.code})
         if response is None:
             return False
 
-        c = int(response["challenge"], 16)
+        c = scalar_value(response["challenge"])
         if DEBUG:
-            logger.debug(
-                f"[CLIENT] Ricevuto challenge: {response['challenge'][:20]}..."
-            )
+            logger.debug(f"[CLIENT] Ricevuto challenge: {hex(c)[:20]}...")
 
         alpha_z = (alpha_t + alpha * c) % self.q
         self.client_conn.send(MessageType.AUTH_RESPONSE, {"response": hex(alpha_z)})
@@ -200,11 +312,60 @@ class ClientApp:
             logger.info("[CLIENT] Autenticazione fallita.")
             return False
 
-    def assoc(self) -> bool:
-        device_name = get_device_name()
+    def key_id(self, alpha: int, public_key: str | None = None) -> str:
+        """Impronta della chiave pubblica di `alpha` nel gruppo corrente, calcolata una volta."""
+        key = (self.group_id, alpha)
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            public_key = public_key or self.group.encode(self.group.base_exp(alpha))
+            key_id = self._key_ids[key] = key_fingerprint(public_key)
+        return key_id
+
+    def auth_proof(
+        self, username: str, alpha: int, alpha_t: int, u_t: str, key_id: str
+    ) -> bool:
+        """Autenticazione non interattiva: la sfida è l'hash della trascrizione."""
+        nonce, self.nonce = self.nonce, None
+        c = derive_challenge(self.group_id, self.q, username, u_t, nonce)
+        alpha_z = (alpha_t + alpha * c) % self.q
+        self.client_conn.send(
+            MessageType.AUTH_PROOF,
+            {
+                "username": username,
+                "temp": u_t,
+                "response": hex(alpha_z),
+                "nonce": nonce,
+                "key_id": key_id,
+            },
+        )
+        if DEBUG:
+            logger.debug("[CLIENT] Inviata prova di autenticazione non interattiva")
+
+        response = wait_for_response(
+            self.client_conn, {MessageType.ACCEPTED.code, MessageType.REJECTED.code}
+        )
+
+        if response is None:
+            return False
+
+        self.nonce = response.get("nonce")
+
+        if response.get("type_code") == MessageType.ACCEPTED.code:
+            logger.info("[CLIENT] Autenticazione riuscita!")
+            logger.info(f"[CLIENT] Benvenuto {username}!")
+            return True
+        logger.info("[CLIENT] Autenticazione fallita.")
+        return False
+
+    def assoc(self, device_name: str | None = None, on_token=None) -> bool:
+        """
+        Chiede l'abbinamento di questo dispositivo. Il token ricevuto viene passato a
+        `on_token` (di default viene mostrato come QR code) e si attende la conferma.
+        """
+        device_name = device_name or get_device_name()
 
         alpha = random.randint(1, self.q - 1)
-        public_key = hex(pow(self.g, alpha, self.p))
+        public_key = self.group.encode(self.group.base_exp(alpha))
 
         # Invio della richiesta di associazione
         self.client_conn.send(
@@ -223,7 +384,7 @@ class ClientApp:
         if response.get("type_code") == MessageType.TOKEN_ASSOC.code:
             token = response.get("token")
             logger.info(f"[CLIENT] Token ricevuto: {token}")
-            create_qr_code(token)
+            (on_token or create_qr_code)(token)
 
         # Secondo step: attendere conferma di associazione
         response = wait_for_response(
@@ -235,11 +396,12 @@ class ClientApp:
         if response.get("type_code") == MessageType.ACCEPTED.code:
             logger.info("[CLIENT] Associazione completata, login effettuato!")
             logger.info(f"[CLIENT] Benvenuto {response.get("username")}!")
-            KeyManager.save_private_key(response.get("username"), alpha)
+            self.keys.save_private_key(response.get("username"), alpha, self.group_id)
+            self.key_id(alpha, public_key)
             return True
 
-    def confirm_assoc(self) -> bool:
-        ans = input("[INPUT] Inserisci codice di abbinamento: ").strip()
+    def confirm_assoc(self, token: str | None = None) -> bool:
+        ans = token or input("[INPUT] Inserisci codice di abbinamento: ").strip()
 
         self.client_conn.send(MessageType.TOKEN_ASSOC, {"token": ans})
 
@@ -277,6 +439,7 @@ def wait_for_response(client: ClientConnection, expected_types: set[MessageType]
             return msg
         elif msg.get("type_code") == MessageType.ERROR.code:
             err = ErrorType.from_code(msg["error_code"])
+            client.last_error = err
             logger.warning(f"[CLIENT] Errore: {err.message()}")
             return None
         else:
@@ -348,6 +511,25 @@ def parse_args():
         help="Abilita il logging in modalità debug"
     )
     
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="Usa l'autenticazione interattiva (sfida inviata dal server)"
+    )
+
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Usa solo la codifica JSON dei messaggi (senza quella binaria)"
+    )
+
+    parser.add_argument(
+        "--commitments",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="Commitment precalcolati in background (0 per calcolarli al momento)"
+    )
+
     parser.add_argument(
         "-g",
         "--gui",
@@ -381,10 +563,18 @@ def main():
     
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect((ip, port))
+        # HANDSHAKE_RES non ha risposta: senza TCP_NODELAY il messaggio successivo
+        # attenderebbe l'ACK ritardato del server
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         logger.info(f"[CLIENT] Connesso a {ip}:{port}")
 
         client_conn = ClientConnection(sock)
-        app = ClientApp(client_conn)
+        app = ClientApp(
+            client_conn,
+            interactive=args.interactive,
+            encodings=[ENCODING_JSON] if args.json else None,
+            commitments=args.commitments,
+        )
 
         if not app.handshake(client_conn):
             sys.exit(1)
@@ -0,0 +1,97 @@
+import secrets
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from utils.group import Group
+
+# Commitment tenuti pronti per ogni gruppo
+DEFAULT_POOL_SIZE = 8
+
+
+class CommitmentPool:
+    """
+    Commitment (alpha_t, g^alpha_t) precalcolati per l'autenticazione.
+
+    Un thread in background riempie la riserva fino a `size` coppie, con
+    l'elemento già codificato come viene inviato al server; `take` ne consegna una
+    e sveglia il thread perché la rimpiazzi. Ogni coppia esce dalla riserva una sola
+    volta: riusare alpha_t con due sfide diverse rivelerebbe la chiave privata.
+    Se la riserva è vuota la coppia viene calcolata al momento.
+    """
+
+    def __init__(self, group: Group, size: int = DEFAULT_POOL_SIZE):
+        self.group = group
+        self.size = size
+        self._pairs: Deque[Tuple[int, str]] = deque()
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self._thread = None
+        if size > 0:
+            self._thread = threading.Thread(
+                target=self._run, name=f"commitments-{group.group_id}", daemon=True
+            )
+            self._refill.set()
+            self._thread.start()
+
+    def _generate(self) -> Tuple[int, str]:
+        alpha_t = secrets.randbelow(self.group.q - 1) + 1
+        return alpha_t, self.group.encode(self.group.base_exp(alpha_t))
+
+    def _run(self) -> None:
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while not self._closed:
+                with self._lock:
+                    if len(self._pairs) >= self.size:
+                        break
+                pair = self._generate()
+                with self._lock:
+                    self._pairs.append(pair)
+            if self._closed:
+                return
+
+    def take(self) -> Tuple[int, str]:
+        """Consegna una coppia (alpha_t, commitment codificato) mai usata prima."""
+        with self._lock:
+            pair = self._pairs.popleft() if self._pairs else None
+            if pair is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self._thread is not None:
+            self._refill.set()
+        return pair if pair is not None else self._generate()
+
+    def close(self) -> None:
+        """Ferma il thread di riempimento e scarta le coppie non usate."""
+        self._closed = True
+        self._refill.set()
+        with self._lock:
+            self._pairs.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._pairs), "hits": self.hits, "misses": self.misses}
+
+
+_pools: Dict[Tuple[str, int], CommitmentPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_commitment_pool(group: Group, size: int = DEFAULT_POOL_SIZE) -> CommitmentPool:
+    """Riserva di commitment del gruppo, condivisa da tutti i client del processo."""
+    key = (group.group_id, size)
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = CommitmentPool(group, size)
+        return pool
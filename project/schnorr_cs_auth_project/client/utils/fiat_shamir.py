@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Validità dei nonce emessi dal server, in secondi
+DEFAULT_NONCE_TTL = 60
+# Numero massimo di nonce già usati ricordati contemporaneamente
+DEFAULT_REPLAY_CACHE_SIZE = 100_000
+
+# Etichetta di dominio della trascrizione, per non confondere questo hash con altri usi
+_TRANSCRIPT_DOMAIN = b"schnorr-auth-fiat-shamir-v1"
+
+# Nonce: istante di emissione (secondi), 16 byte casuali, HMAC troncato a 16 byte
+_NONCE_HEADER = struct.Struct("!Q")
+_NONCE_RANDOM_SIZE = 16
+_NONCE_MAC_SIZE = 16
+_NONCE_SIZE = _NONCE_HEADER.size + _NONCE_RANDOM_SIZE + _NONCE_MAC_SIZE
+# Caratteri esadecimali di un nonce
+NONCE_LENGTH = 2 * _NONCE_SIZE
+
+
+def derive_challenge(group_id: str, q: int, username: str, temp: str, nonce: str) -> int:
+    """
+    Sfida non interattiva c = H(gruppo, username, t, nonce) mod q.
+
+    I campi sono preceduti dalla loro lunghezza, così che trascrizioni diverse non
+    possano produrre lo stesso input dell'hash.
+    """
+    h = hashlib.sha256(_TRANSCRIPT_DOMAIN)
+    for field in (group_id, username, temp, nonce):
+        data = field.encode()
+        h.update(struct.pack("!I", len(data)))
+        h.update(data)
+    return int.from_bytes(h.digest(), "big") % q
+
+
+class NonceIssuer:
+    """
+    Emette nonce autenticati con HMAC, così che il server possa riconoscerli
+    senza doverli memorizzare finché non vengono usati.
+    """
+
+    def __init__(self, secret: Optional[bytes] = None, ttl: int = DEFAULT_NONCE_TTL):
+        self.secret = secret or os.urandom(32)
+        self.ttl = ttl
+
+    def _mac(self, body: bytes) -> bytes:
+        return hmac.new(self.secret, body, hashlib.sha256).digest()[:_NONCE_MAC_SIZE]
+
+    def issue(self) -> str:
+        body = _NONCE_HEADER.pack(int(time.time())) + os.urandom(_NONCE_RANDOM_SIZE)
+        return (body + self._mac(body)).hex()
+
+    def expires_at(self, nonce: str) -> Optional[float]:
+        """
+        Restituisce l'istante di scadenza del nonce, oppure None se il nonce non è
+        stato emesso da questo server o è già scaduto.
+        """
+        try:
+            raw = bytes.fromhex(nonce)
+        except (ValueError, TypeError):
+            return None
+        if len(raw) != _NONCE_SIZE:
+            return None
+
+        body, mac = raw[:-_NONCE_MAC_SIZE], raw[-_NONCE_MAC_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(body)):
+            return None
+
+        (issued_at,) = _NONCE_HEADER.unpack_from(body)
+        expires_at = issued_at + self.ttl
+        now = time.time()
+        if issued_at > now + 1 or expires_at < now:
+            return None
+        return expires_at
+
+
+class ReplayCache:
+    """
+    Insieme limitato dei nonce già usati. Ogni nonce resta in memoria fino alla
+    sua scadenza: dopo viene comunque rifiutato da `NonceIssuer`.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_REPLAY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float) -> None:
+        # I nonce sono inseriti all'incirca in ordine di scadenza
+        while self._entries:
+            nonce, expires_at = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            self._entries.popitem(last=False)
+
+    def add(self, nonce: str, expires_at: float) -> bool:
+        """
+        Registra il nonce come usato. Restituisce False se era già presente o se la
+        cache è piena di nonce non ancora scaduti (in tal caso si rifiuta per sicurezza).
+        """
+        with self._lock:
+            self._purge(time.time())
+            if nonce in self._entries or len(self._entries) >= self.max_entries:
+                return False
+            self._entries[nonce] = expires_at
+            return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,146 @@
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_WINDOW = 6
+
+# Header dei file di cache: window, numero di righe, byte per elemento
+_CACHE_HEADER = struct.Struct("!HII")
+
+
+class FixedBaseExp:
+    """
+    Esponenziazione a base fissa g^x mod p con tabelle precalcolate.
+
+    L'esponente viene diviso in finestre da `window` bit; per la finestra i la tabella
+    contiene g^(d * 2^(window * i)) per ogni cifra d, quindi g^x si ottiene con una
+    moltiplicazione per finestra non nulla e nessun quadrato
+    (circa bits/window moltiplicazioni invece delle ~1.5 * bits di `pow`).
+    """
+
+    def __init__(self, g: int, p: int, max_bits: Optional[int] = None, window: int = DEFAULT_WINDOW):
+        self.g = g
+        self.p = p
+        self.window = window
+        self.max_bits = max_bits or p.bit_length()
+        self._mask = (1 << window) - 1
+        self._table: List[List[int]] = []
+
+    @property
+    def rows(self) -> int:
+        return -(-self.max_bits // self.window)
+
+    def build(self) -> "FixedBaseExp":
+        """Calcola la tabella g^(d * 2^(window * i)) per ogni finestra i e cifra d."""
+        p = self.p
+        table = []
+        base = self.g % p
+        for _ in range(self.rows):
+            row = [1] * (1 << self.window)
+            acc = 1
+            for d in range(1, 1 << self.window):
+                acc = acc * base % p
+                row[d] = acc
+            table.append(row)
+            # base^(2^window) per la finestra successiva
+            base = acc * base % p
+        self._table = table
+        return self
+
+    def pow(self, x: int) -> int:
+        """Calcola g^x mod p; per esponenti fuori tabella ricade su `pow`."""
+        if x < 0 or x.bit_length() > self.max_bits or not self._table:
+            return pow(self.g, x, self.p)
+
+        p = self.p
+        mask = self._mask
+        window = self.window
+        result = 1
+        for row in self._table:
+            if not x:
+                break
+            d = x & mask
+            if d:
+                result = result * row[d] % p
+            x >>= window
+        return result
+
+    def save(self, path: Path) -> None:
+        """Salva la tabella su disco in formato binario a larghezza fissa."""
+        size = (self.p.bit_length() + 7) // 8
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_CACHE_HEADER.pack(self.window, len(self._table), size))
+            for row in self._table:
+                f.write(b"".join(v.to_bytes(size, "big") for v in row))
+
+    def load(self, path: Path) -> bool:
+        """Carica la tabella da disco; restituisce False se il file non è compatibile."""
+        try:
+            data = Path(path).read_bytes()
+        except OSError:
+            return False
+        if len(data) < _CACHE_HEADER.size:
+            return False
+
+        window, rows, size = _CACHE_HEADER.unpack_from(data)
+        entries = 1 << window
+        if (
+            window != self.window
+            or rows != self.rows
+            or size != (self.p.bit_length() + 7) // 8
+            or len(data) != _CACHE_HEADER.size + rows * entries * size
+        ):
+            return False
+
+        offset = _CACHE_HEADER.size
+        table = []
+        for _ in range(rows):
+            table.append(
+                [
+                    int.from_bytes(data[offset + d * size : offset + (d + 1) * size], "big")
+                    for d in range(entries)
+                ]
+            )
+            offset += entries * size
+
+        # Controllo di coerenza: la tabella deve appartenere a questo generatore
+        if table[0][1] != self.g % self.p:
+            return False
+        self._table = table
+        return True
+
+
+_tables: Dict[Tuple[int, int], FixedBaseExp] = {}
+_tables_lock = threading.Lock()
+
+
+def get_fixed_base(
+    g: int,
+    p: int,
+    max_bits: Optional[int] = None,
+    window: int = DEFAULT_WINDOW,
+    cache_path: Optional[Path] = None,
+) -> FixedBaseExp:
+    """
+    Restituisce la tabella a base fissa per (g, p), costruendola una sola volta per processo.
+    `max_bits` è la lunghezza massima degli esponenti (tipicamente quella di q).
+    Se `cache_path` è indicato, la tabella viene letta da disco o salvata dopo il calcolo.
+    """
+    key = (g, p)
+    with _tables_lock:
+        fb = _tables.get(key)
+        if fb is not None:
+            return fb
+
+        fb = FixedBaseExp(g, p, max_bits=max_bits, window=window)
+        if cache_path is None or not fb.load(cache_path):
+            fb.build()
+            if cache_path is not None:
+                try:
+                    fb.save(cache_path)
+                except OSError:
+                    pass
+        _tables[key] = fb
+        return fb
@@ -0,0 +1,80 @@
+import struct
+from typing import Iterator, Optional
+
+# Ogni frame è composto da un header di 4 byte (lunghezza del payload, big-endian)
+# seguito dal payload vero e proprio.
+HEADER = struct.Struct("!I")
+HEADER_SIZE = HEADER.size
+
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024
+RECV_BUFFER_SIZE = 4096
+
+
+class FrameTooLargeError(Exception):
+    """Il frame dichiara una lunghezza superiore al massimo consentito."""
+    pass
+
+
+def encode_frame(payload: bytes, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE) -> bytes:
+    """Antepone al payload l'header con la sua lunghezza."""
+    if len(payload) > max_frame_size:
+        raise FrameTooLargeError(
+            f"Frame di {len(payload)} byte oltre il limite di {max_frame_size}"
+        )
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Ricostruisce i frame a partire dai byte ricevuti dal socket.
+
+    I dati vengono accumulati in un unico buffer per connessione: un frame spezzato
+    su più `recv` viene riassemblato, e più frame arrivati nella stessa `recv`
+    vengono restituiti uno alla volta senza perdere quelli successivi.
+    """
+
+    def __init__(self, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def feed(self, data) -> None:
+        """Aggiunge al buffer i byte appena ricevuti."""
+        # Compatta il buffer solo quando la parte già consumata è predominante,
+        # così da non spostare memoria ad ogni frame estratto.
+        if self._offset and self._offset * 2 >= len(self._buffer):
+            del self._buffer[: self._offset]
+            self._offset = 0
+        self._buffer += data
+
+    def next_frame(self) -> Optional[bytes]:
+        """Restituisce il prossimo frame completo, oppure None se servono altri byte."""
+        available = len(self._buffer) - self._offset
+        if available < HEADER_SIZE:
+            return None
+
+        (length,) = HEADER.unpack_from(self._buffer, self._offset)
+        if length > self.max_frame_size:
+            raise FrameTooLargeError(
+                f"Frame di {length} byte oltre il limite di {self.max_frame_size}"
+            )
+        if available < HEADER_SIZE + length:
+            return None
+
+        start = self._offset + HEADER_SIZE
+        frame = bytes(self._buffer[start : start + length])
+        self._offset = start + length
+        if self._offset == len(self._buffer):
+            self._buffer.clear()
+            self._offset = 0
+        return frame
+
+    def frames(self) -> Iterator[bytes]:
+        """Itera su tutti i frame completi presenti nel buffer."""
+        while (frame := self.next_frame()) is not None:
+            yield frame
+
+    @property
+    def pending(self) -> int:
+        """Numero di byte ricevuti ma non ancora consumati."""
+        return len(self._buffer) - self._offset
@@ -1,4 +1,118 @@
+# Ogni gruppo è descritto dal modulo p, dall'ordine q del sottogruppo generato da g
+# e dal generatore g. Chiavi, nonce e sfide sono esponenti modulo q.
+#
+# I gruppi con "type": "ec" sono curve y^2 = x^3 + ax + b su F_p con punto base
+# (gx, gy) di ordine primo q e cofattore 1 (vedi utils/group.py).
+#
+# I gruppi "schnorr-*" hanno un sottogruppo di ordine primo a 256 bit: gli esponenti
+# sono lunghi 256 bit invece di ~1535 e ogni esponenziazione costa molto meno.
+# Sono stati generati in modo deterministico (q primo a 256 bit, p = 2kq + 1 primo,
+# g = 2^((p-1)/q) mod p) e verificati con: p, q primi, q | p - 1, g != 1, g^q = 1.
+
 GROUPS = {
+    # SEC 2: secp256k1
+    "secp256k1": {
+        "type": "ec",
+        "p": int(
+            "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F",
+            16,
+        ),
+        "q": int(
+            "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141",
+            16,
+        ),
+        "a": 0,
+        "b": 7,
+        "gx": int(
+            "79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798",
+            16,
+        ),
+        "gy": int(
+            "483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8",
+            16,
+        ),
+    },
+    "schnorr-2048-256": {
+        "p": int(
+            "8370C6C8D008B5F70E0344E8BF94AE7066B7129550E1F89D"
+            "B66187FA50C88D9F0A1C1AF4FACDD13DA9B747BC5CF9DE98"
+            "5A8734BA10717E831D8E3B97DBB88640BE01FBFB9D637095"
+            "566B42FA03355C72764614977694908482D21E705EA6367B"
+            "9537E18D7BB23474EEAEA118589DB3EBC41F421703345635"
+            "91C0B8EEF295EF0286D34B804BDD6FF048429AB700BD7F9B"
+            "75B8F849A1B861681692EA57AD7649AA26C874408D6C5163"
+            "5C14BF2ADD2945A22B7F739838A63B73B1B08C4D3A73C688"
+            "AB1C03987EEED3DAA974DC03C3540CD4BB7B3380894FBC14"
+            "59846DA06E3CC02F217EEBF50BCF52DB67D17BDADCD31904"
+            "1CC28F49C063B3CD687C989950F9731F",
+            16,
+        ),
+        "q": int(
+            "FF2779EF5ECF3B3500D7A94ACB8EE224C34C5514A08846CD"
+            "21FAF2C6E0363FE9",
+            16,
+        ),
+        "g": int(
+            "48E1FE0A4A5D8F130E7A3527C68882929D18D308C6E2D2B1"
+            "A67763195FFB1F03688B9C18064A2F39A42C287D5B39FD19"
+            "0104E3A3C22842A77E2B85633C4A783EDC62A663DF715FF8"
+            "2C0B75C305ABF81C08C7B4DCC433FDFEF2A611C5900374FB"
+            "AFC8E7CCDE3EB26B69DC08A44878B907FB7AD384292CBCA7"
+            "23729499892F8E1CF3A58F46D8CF4DBDFE05926EEB2EC851"
+            "9C7C22F7A0D589C6EB420C7F4C335FA8D9673699C8A6FC84"
+            "52BBB400C0DBC744334A62A35D1394BA320369C668AA22A1"
+            "A1284C339250BD8ED32758A726BF87AACD4105478AF6FF84"
+            "35604231954ED143FA0B3C5A2334422F99064FBF468030D2"
+            "A96C5094D50CFC25A62B4E6B821A7D8E",
+            16,
+        ),
+    },
+    "schnorr-3072-256": {
+        "p": int(
+            "8C338B5580AB9BF426848D9DC0925E872BA7BA60F0E852FF"
+            "7709B0FA9FBBF092B917FFA5ADC3F1105CBD4DF845563746"
+            "E1FC809D2F6A9019EB4578BC8DF4D2579DCAFE056F6508BE"
+            "88B04C629BEFC3670CB3EA5140329CA449C308FA83389CCA"
+            "5F228E9AE61AA58FDB03AB725565E96FC79E9DD81386A1DB"
+            "9064D5E5B2BD95D9C162A807D87F819F132F37BDE8776A02"
+            "78FDC228CECE51DE1CA941A5655DFBDCA3165847D8B19FEF"
+            "6C7B7FE52A069EB7DD0E4F9A888EB3992B99B92A228996DD"
+            "F843BD162BDB5D52CD49AA4D4AD5093BBCD2F98179737716"
+            "8DCEEBEB008F6F19CA0ACA2A9E23B22C0BF1B0A07655D7E0"
+            "545FC8DB9E2726CB4F78F00EC4AA4F6A96539F64708C6847"
+            "1F8203105A7B49D8816704BA4570AB3C6D57A503B96ACBCC"
+            "4046C3604B48EB1E1C122799F0B854D9FBBE3937120C4CE2"
+            "153FC59935E1B3F410AEBB12596C8A8F8714CB32919B7C7F"
+            "903352A53EFCC3FB0FFA078909BFD033F77F1AED1BB99FB0"
+            "BD6BF92377CD0A45827C5C6E9A76BC8A53D9065E55E9A615",
+            16,
+        ),
+        "q": int(
+            "C98E9AAE6F58B471AFB2BBE177CB802990F483E084786AFE"
+            "BAEA60572B3EFD6F",
+            16,
+        ),
+        "g": int(
+            "627CAE6FDB726083F21DF579DB62BDD6B2EDFB2F2D2D430E"
+            "59A74852D40DF5C73CB24D0CA01E061C1D1CBCAD6F1A2E5F"
+            "63DE5BFCE035CCF44F1ACCC50AFE0511854BA583C7184D55"
+            "C66412AEAA68E1A7CF71F5079F1A5DE254F439523D23025E"
+            "DD55803ACAD7C4D762E8AD1D76F13C69C6E365377A95223B"
+            "DD7B4F293F0FFC15E2C2DAD8B300CDC7AEDEA1601DC0CF62"
+            "BFFD9828F5C163DA36FE1719B39205E0D036DF56B82607CE"
+            "080648DF40F8FF125BA2B09E17BFA01B50AF6F8031A98900"
+            "4D5C27D68F3DE253287CF1068F0CBA6638D081D9C35F1081"
+            "793C7BD8D5DF043938545652E26292429ED04F2AEB858BA6"
+            "CC3BF61FCA1148456E02D8ECEEC470B68B079AC02E8F0F6A"
+            "4BBBBA4D2DAC285EAA89CDF5BC9B37756FA442605DAFD304"
+            "395B756474103EFDF904669DC6849AC2128CA311C16570DA"
+            "47BF90D70DD523309D724EE3DCB5847AAC5972C237FE14A3"
+            "90840D539DDD8B1B1257F8180F3501E7CB5AE63553F0E6A4"
+            "6285C8C119CDAC6589DF1FC62D0A25DF99137972D9E2E58D",
+            16,
+        ),
+    },
+    # RFC 3526: p primo sicuro, g = 2 genera il sottogruppo di ordine q = (p - 1) / 2
     "modp-1536": {
         "p": int(
             "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1"
@@ -11,10 +125,33 @@ GROUPS = {
             "670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF",
             16,
         ),
+        "q": int(
+            "7FFFFFFFFFFFFFFFE487ED5110B4611A62633145C06E0E68"
+            "948127044533E63A0105DF531D89CD9128A5043CC71A026E"
+            "F7CA8CD9E69D218D98158536F92F8A1BA7F09AB6B6A8E122"
+            "F242DABB312F3F637A262174D31BF6B585FFAE5B7A035BF6"
+            "F71C35FDAD44CFD2D74F9208BE258FF324943328F6722D9E"
+            "E1003E5C50B1DF82CC6D241B0E2AE9CD348B1FD47E9267AF"
+            "C1B2AE91EE51D6CB0E3179AB1042A95DCF6A9483B84B4B36"
+            "B3861AA7255E4C0278BA36046511B993FFFFFFFFFFFFFFFF",
+            16,
+        ),
         "g": 2,
     },
     "mymod": {
         "p": 23,
+        "q": 11,
         "g": 2,
-    }
-}
\ No newline at end of file
+    },
+}
+
+# Preferenza di default nella negoziazione: il primo gruppo supportato anche dal client
+DEFAULT_GROUP_PREFERENCE = [
+    "secp256k1",
+    "schnorr-2048-256",
+    "schnorr-3072-256",
+    "modp-1536",
+]
+
+# Gruppo usato prima della negoziazione: chiavi e dispositivi senza gruppo appartengono a questo
+LEGACY_GROUP_ID = "modp-1536"
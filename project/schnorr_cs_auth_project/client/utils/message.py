@@ -18,6 +18,7 @@ class MessageType(Enum):
     LOGGED_OUT = (14, "LOGGED_OUT", "Logout effettuato")
     DEVICES_REQUEST = (15, "DEVICES_REQUEST", "Richiesta elenco dispositivi")
     DEVICES_RESPONSE = (16, "DEVICES_RESPONSE", "Risposta elenco dispositivi")
+    AUTH_PROOF = (17, "AUTH_PROOF", "Ricevuta prova di autenticazione non interattiva")
 
     def __init__(self, code, label, log_message):
         self.code = code
@@ -26,10 +27,11 @@ class MessageType(Enum):
 
     @classmethod
     def from_code(cls, code):
-        for item in cls:
-            if item.code == code:
-                return item
-        return None
+        return _MESSAGE_TYPES.get(code)
+
+    @classmethod
+    def from_label(cls, label):
+        return _MESSAGE_LABELS.get(label)
 
     def __str__(self):
         return self.label
@@ -49,6 +51,8 @@ class ErrorType(Enum):
     UNAUTHORIZED = (7, "UNAUTHORIZED", "Operazione non autorizzata")
     DEVICE_ALREADY_REGISTERED = (8, "DEVICE_ALREADY_REGISTERED", "Il dispositivo risulta già registrato")
     ASSOC_FAILURE = (9, "ASSOC_FAILURE", "Associazione del dispositivo non riuscita")
+    UNSUPPORTED_GROUP = (10, "UNSUPPORTED_GROUP", "Nessun gruppo crittografico in comune con il server")
+    NONCE_INVALID = (11, "NONCE_INVALID", "Nonce non valido, scaduto o già utilizzato")
 
 
     def __init__(self, code, label, log_message):
@@ -58,10 +62,7 @@ class ErrorType(Enum):
 
     @classmethod
     def from_code(cls, code):
-        for item in cls:
-            if item.code == code:
-                return item
-        return None
+        return _ERROR_TYPES.get(code)
 
     def __str__(self):
         return self.label
@@ -69,3 +70,8 @@ class ErrorType(Enum):
     def message(self):
         return self.log_message
 
+
+# Tabelle di ricerca costruite una volta sola: from_code/from_label in O(1)
+_MESSAGE_TYPES = {item.code: item for item in MessageType}
+_MESSAGE_LABELS = {item.label: item for item in MessageType}
+_ERROR_TYPES = {item.code: item for item in ErrorType}
@@ -0,0 +1,175 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.logger import Logger
+
+# Ritardo massimo (secondi) e numero massimo di aggiornamenti per scrittura
+DEFAULT_WRITE_DELAY = 0.1
+DEFAULT_WRITE_BATCH = 500
+
+logger = Logger()
+
+# Aggiornamento dello stato di un dispositivo: (user_id, device_name, logged)
+Update = Tuple[str, str, bool]
+
+
+class DeviceStateWriter:
+    """
+    Scrittura differita del flag `logged` dei dispositivi.
+
+    Gli aggiornamenti vengono accodati e scritti da un thread in background con
+    `flush_fn` al più ogni `max_delay` secondi o quando se ne accumulano `max_batch`.
+    Più login e logout dello stesso dispositivo prima della scrittura si riducono
+    all'ultimo valore. Se la scrittura fallisce, gli aggiornamenti non ancora superati
+    vengono rimessi in coda; `close` scrive quelli rimasti.
+
+    La coda è indicizzata per utente e il lotto in scrittura resta visibile a `pending`
+    finché `flush_fn` non termina, così che una lettura dal database nel frattempo non
+    riporti il vecchio stato.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[List[Update]], None],
+        max_delay: float = DEFAULT_WRITE_DELAY,
+        max_batch: int = DEFAULT_WRITE_BATCH,
+    ):
+        self.flush_fn = flush_fn
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.written = 0
+        self.coalesced = 0
+        # Aggiornamenti in coda e in scrittura: user_id -> device_name -> logged
+        self._pending: Dict[str, Dict[str, bool]] = {}
+        self._inflight: Dict[str, Dict[str, bool]] = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="device-state-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: str, device_name: str, logged: bool) -> None:
+        with self._cond:
+            devices = self._pending.setdefault(user_id, {})
+            if device_name in devices:
+                self.coalesced += 1
+            else:
+                self._size += 1
+            devices[device_name] = logged
+            if self._size == 1 or self._size >= self.max_batch:
+                self._cond.notify()
+
+    def pending(self, user_id: str) -> Dict[str, bool]:
+        """Stato dei dispositivi di `user_id` non ancora scritto: device_name -> logged."""
+        with self._cond:
+            inflight = self._inflight.get(user_id)
+            queued = self._pending.get(user_id)
+            if inflight is None:
+                return dict(queued) if queued else {}
+            # Quelli in coda sono più recenti di quelli in scrittura
+            return {**inflight, **queued} if queued else dict(inflight)
+
+    def _take(self) -> List[Update]:
+        """Sposta fino a `max_batch` aggiornamenti dalla coda al lotto in scrittura."""
+        batch = []
+        while self._pending and len(batch) < self.max_batch:
+            # Gli utenti escono dalla coda nell'ordine del loro primo aggiornamento
+            user_id = next(iter(self._pending))
+            devices = self._pending[user_id]
+            inflight = self._inflight.setdefault(user_id, {})
+            while devices and len(batch) < self.max_batch:
+                device_name, logged = devices.popitem()
+                inflight[device_name] = logged
+                batch.append((user_id, device_name, logged))
+            if not devices:
+                del self._pending[user_id]
+        self._size -= len(batch)
+        return batch
+
+    def _done(self, batch: List[Update], requeue: bool = False) -> None:
+        """Toglie il lotto da quelli in scrittura; se `requeue`, lo rimette in coda."""
+        with self._cond:
+            for user_id, device_name, logged in batch:
+                inflight = self._inflight.get(user_id)
+                if inflight is not None:
+                    inflight.pop(device_name, None)
+                    if not inflight:
+                        del self._inflight[user_id]
+                if requeue:
+                    # Un aggiornamento arrivato nel frattempo prevale su quello fallito
+                    devices = self._pending.setdefault(user_id, {})
+                    if device_name not in devices:
+                        devices[device_name] = logged
+                        self._size += 1
+            if not requeue:
+                self.written += len(batch)
+
+    def _write(self, batch: List[Update]) -> None:
+        try:
+            self.flush_fn(batch)
+        except Exception as e:
+            logger.error(f"[SERVER] Scrittura dello stato dei dispositivi fallita: {e}")
+            self._done(batch, requeue=True)
+            time.sleep(self.max_delay)
+            return
+        self._done(batch)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                deadline = time.monotonic() + self.max_delay
+                while self._size < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+                batch = self._take()
+            self._write(batch)
+
+    def flush(self) -> None:
+        """Scrive subito tutti gli aggiornamenti in coda dal thread chiamante."""
+        while True:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return
+            try:
+                self.flush_fn(batch)
+            except Exception:
+                self._done(batch, requeue=True)
+                raise
+            self._done(batch)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"[SERVER] Aggiornamenti dei dispositivi persi alla chiusura: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"pending": self._size, "written": self.written, "coalesced": self.coalesced}
+
+
+def apply_pending(writer: Optional[DeviceStateWriter], user_id: str, devices: List[dict]) -> None:
+    """Riporta sui dispositivi appena letti dal database gli aggiornamenti non ancora scritti."""
+    if writer is None:
+        return
+    pending = writer.pending(user_id)
+    if not pending:
+        return
+    for device in devices:
+        logged = pending.get(device.get("device_name"))
+        if logged is not None:
+            device["logged"] = logged
@@ -0,0 +1,320 @@
+import asyncio
+import copy
+import datetime
+import heapq
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from utils.db import (
+    DEFAULT_DB_NAME,
+    DEFAULT_MONGO_URI,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT_MS,
+    create_database,
+)
+
+# Backend supportati per la persistenza
+MONGO_BACKEND = "mongo"
+MEMORY_BACKEND = "memory"
+
+# Token di abbinamento tenuti al massimo contemporaneamente dal backend in memoria
+DEFAULT_MAX_TEMP_TOKENS = 10_000
+
+
+class UserRepository(ABC):
+    """Accesso asincrono ai documenti degli utenti."""
+
+    async def ensure_indexes(self) -> Dict[str, str]:
+        """Crea gli indici necessari; restituisce nome indice -> stato."""
+        return {}
+
+    @abstractmethod
+    async def find(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def insert(self, doc: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def set_devices(self, user_id: str, devices: List[dict]) -> None:
+        ...
+
+    @abstractmethod
+    async def set_device_logged(self, user_id: str, device_name: str, logged: bool) -> None:
+        ...
+
+    @abstractmethod
+    async def bulk_set_device_logged(self, updates: List[Tuple[str, str, bool]]) -> None:
+        """Applica più aggiornamenti (user_id, device_name, logged) in un'unica operazione."""
+
+
+class TempTokenRepository(ABC):
+    """Accesso asincrono ai token temporanei di abbinamento."""
+
+    async def ensure_indexes(self) -> Dict[str, str]:
+        """Crea gli indici necessari; restituisce nome indice -> stato."""
+        return {}
+
+    @abstractmethod
+    async def find(self, token: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def insert(self, doc: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, token: str) -> None:
+        ...
+
+
+# ---------- MongoDB ----------
+
+
+async def _index_status(collection, names: List[str]) -> Dict[str, str]:
+    """Stato degli indici appena creati, letto dall'elenco degli indici della collezione."""
+    existing = {index["name"] async for index in await collection.list_indexes()}
+    return {name: "pronto" if name in existing else "mancante" for name in names}
+
+
+class MongoUserRepository(UserRepository):
+    def __init__(self, db):
+        self.collection = db["users"]
+
+    async def ensure_indexes(self) -> Dict[str, str]:
+        # device_name per gli aggiornamenti posizionali, key_id per cercare un dispositivo
+        # a partire dall'impronta della chiave
+        names = [
+            await self.collection.create_index("devices.device_name"),
+            await self.collection.create_index("devices.key_id"),
+        ]
+        return await _index_status(self.collection, names)
+
+    async def find(self, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": user_id})
+
+    async def insert(self, doc: dict) -> None:
+        await self.collection.insert_one(doc)
+
+    async def set_devices(self, user_id: str, devices: List[dict]) -> None:
+        await self.collection.update_one({"_id": user_id}, {"$set": {"devices": devices}})
+
+    async def set_device_logged(self, user_id: str, device_name: str, logged: bool) -> None:
+        await self.collection.update_one(
+            {"_id": user_id, "devices.device_name": device_name},
+            {"$set": {"devices.$.logged": logged}},
+        )
+
+    async def bulk_set_device_logged(self, updates: List[Tuple[str, str, bool]]) -> None:
+        if not updates:
+            return
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": user_id, "devices.device_name": device_name},
+                    {"$set": {"devices.$.logged": logged}},
+                )
+                for user_id, device_name, logged in updates
+            ],
+            ordered=False,
+        )
+
+
+class MongoTempTokenRepository(TempTokenRepository):
+    def __init__(self, db):
+        self.collection = db["temp_tokens"]
+
+    async def ensure_indexes(self) -> Dict[str, str]:
+        # I token salvati prima che expiry fosse una data non scadrebbero mai con il TTL
+        await self.collection.delete_many({"expiry": {"$type": "string"}})
+        # TTL: MongoDB elimina da solo i documenti quando `expiry` è passata
+        names = [await self.collection.create_index("expiry", expireAfterSeconds=0)]
+        return await _index_status(self.collection, names)
+
+    async def find(self, token: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": token})
+
+    async def insert(self, doc: dict) -> None:
+        await self.collection.insert_one(doc)
+
+    async def delete(self, token: str) -> None:
+        await self.collection.delete_one({"_id": token})
+
+
+# ---------- memoria ----------
+
+
+class InMemoryUserRepository(UserRepository):
+    """
+    Backend in memoria per test e benchmark senza MongoDB. I documenti vengono copiati
+    in lettura e in scrittura, come se passassero dal database.
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, dict] = {}
+
+    async def find(self, user_id: str) -> Optional[dict]:
+        doc = self._docs.get(user_id)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def insert(self, doc: dict) -> None:
+        if doc["_id"] in self._docs:
+            raise KeyError(f"Utente già presente: {doc['_id']}")
+        self._docs[doc["_id"]] = copy.deepcopy(doc)
+
+    async def set_devices(self, user_id: str, devices: List[dict]) -> None:
+        doc = self._docs.get(user_id)
+        if doc is not None:
+            doc["devices"] = copy.deepcopy(devices)
+
+    async def set_device_logged(self, user_id: str, device_name: str, logged: bool) -> None:
+        doc = self._docs.get(user_id)
+        if doc is None:
+            return
+        # Come l'operatore posizionale $, aggiorna solo il primo dispositivo trovato
+        for device in doc.get("devices", []):
+            if device.get("device_name") == device_name:
+                device["logged"] = logged
+                return
+
+    async def bulk_set_device_logged(self, updates: List[Tuple[str, str, bool]]) -> None:
+        for user_id, device_name, logged in updates:
+            await self.set_device_logged(user_id, device_name, logged)
+
+
+class InMemoryTempTokenRepository(TempTokenRepository):
+    """
+    Token di abbinamento in memoria, con scadenza e dimensione massima.
+
+    La ricerca è O(1) su un dizionario; un heap ordinato per scadenza permette di
+    eliminare i token scaduti appena scadono, con un timer nel loop del database,
+    e di scartare quelli più vicini alla scadenza quando si supera `max_entries`.
+    Nell'heap restano voci obsolete dei token cancellati: vengono saltate quando
+    emergono e l'heap viene ricostruito se cresce troppo rispetto al dizionario.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_TEMP_TOKENS):
+        self.max_entries = max_entries
+        self.evicted = 0
+        self.expired = 0
+        self._docs: Dict[str, Tuple[dict, float]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    async def find(self, token: str) -> Optional[dict]:
+        entry = self._docs.get(token)
+        return copy.deepcopy(entry[0]) if entry is not None else None
+
+    async def insert(self, doc: dict) -> None:
+        token = doc["_id"]
+        if token in self._docs:
+            raise KeyError(f"Token già presente: {token}")
+        expires_at = _timestamp(doc.get("expiry"))
+        self._docs[token] = (copy.deepcopy(doc), expires_at)
+        heapq.heappush(self._heap, (expires_at, token))
+
+        self._purge()
+        while len(self._docs) > self.max_entries:
+            self._pop(evicted=True)
+        if len(self._heap) > 2 * len(self._docs) + 64:
+            self._heap = [(expires_at, token) for token, (_, expires_at) in self._docs.items()]
+            heapq.heapify(self._heap)
+        self._schedule()
+
+    async def delete(self, token: str) -> None:
+        self._docs.pop(token, None)
+
+    def _pop(self, evicted: bool = False) -> None:
+        """Rimuove il token valido più vicino alla scadenza."""
+        while self._heap:
+            expires_at, token = heapq.heappop(self._heap)
+            entry = self._docs.get(token)
+            if entry is not None and entry[1] == expires_at:
+                del self._docs[token]
+                if evicted:
+                    self.evicted += 1
+                else:
+                    self.expired += 1
+                return
+
+    def _purge(self) -> None:
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, token = self._heap[0]
+            entry = self._docs.get(token)
+            if entry is not None and entry[1] == expires_at:
+                self._pop()
+            else:
+                heapq.heappop(self._heap)
+
+    def _schedule(self) -> None:
+        """Programma il prossimo controllo alla scadenza del primo token dell'heap."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._heap:
+            return
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, self._heap[0][0] - time.time())
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._purge()
+        self._schedule()
+
+
+def _timestamp(value) -> float:
+    """Istante di scadenza (epoch) da un datetime o da una stringa ISO."""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float("inf")
+
+
+async def bootstrap_schema(
+    users: UserRepository, tokens: TempTokenRepository
+) -> Dict[str, Dict[str, str]]:
+    """Crea gli indici di tutte le collezioni all'avvio del server."""
+    return {
+        "users": await users.ensure_indexes(),
+        "temp_tokens": await tokens.ensure_indexes(),
+    }
+
+
+def create_repositories(
+    backend: str = MONGO_BACKEND,
+    uri: str = DEFAULT_MONGO_URI,
+    name: str = DEFAULT_DB_NAME,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout_ms: int = DEFAULT_TIMEOUT_MS,
+    token_backend: str = MEMORY_BACKEND,
+    max_temp_tokens: int = DEFAULT_MAX_TEMP_TOKENS,
+) -> Tuple[UserRepository, TempTokenRepository]:
+    """
+    Crea i repository di utenti e token per i backend indicati. I token di abbinamento
+    servono solo finché il dispositivo che li ha chiesti è connesso: di default restano
+    in memoria anche quando gli utenti sono su MongoDB.
+    """
+    for b in (backend, token_backend):
+        if b not in (MONGO_BACKEND, MEMORY_BACKEND):
+            raise ValueError(f"Backend del database non supportato: {b}")
+
+    db = None
+    if MONGO_BACKEND in (backend, token_backend):
+        db = create_database(uri, name, pool_size, timeout_ms)
+
+    users = MongoUserRepository(db) if backend == MONGO_BACKEND else InMemoryUserRepository()
+    if token_backend == MONGO_BACKEND:
+        tokens = MongoTempTokenRepository(db)
+    else:
+        tokens = InMemoryTempTokenRepository(max_temp_tokens)
+    return users, tokens
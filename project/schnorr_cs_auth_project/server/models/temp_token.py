@@ -1,20 +1,44 @@
 import datetime
-from utils.db import db
+from models.repository import InMemoryTempTokenRepository, TempTokenRepository
+from utils.db import db_loop
+from utils.groups import LEGACY_GROUP_ID
+
+
+def _as_utc(value: "datetime.datetime | None") -> "datetime.datetime | None":
+    """Date senza fuso (come quelle lette da MongoDB) interpretate come UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
 
 
 class TempToken:
-    def __init__(self, token, pk, device_name, created_at=None, expiry=None):
+    repository: TempTokenRepository = InMemoryTempTokenRepository()
+
+    def __init__(self, token, pk, device_name, created_at=None, expiry=None, group_id=LEGACY_GROUP_ID):
         self._id = token
         self.pk = pk
         self.device_name = device_name
-        self.created_at = created_at or datetime.datetime.now()
-        self.expiry = expiry or (self.created_at + datetime.timedelta(minutes=10))
+        self.group_id = group_id
+        # Date in UTC: MongoDB le salva come BSON date e l'indice TTL le confronta in UTC
+        self.created_at = _as_utc(created_at) or datetime.datetime.now(datetime.timezone.utc)
+        self.expiry = _as_utc(expiry) or (self.created_at + datetime.timedelta(minutes=10))
 
     def to_dict(self):
         return {
             "_id": self._id,
             "pk": self.pk,
             "device_name": self.device_name,
+            "group_id": self.group_id,
+            "created_at": self.created_at,
+            "expiry": self.expiry,
+        }
+
+    def to_json(self):
+        """Come `to_dict`, con le date in formato ISO per inviarlo ad un altro processo."""
+        return {
+            **self.to_dict(),
             "created_at": self.created_at.isoformat(),
             "expiry": self.expiry.isoformat(),
         }
@@ -23,28 +47,32 @@ class TempToken:
         """
         Inserisce la coppia token - pk nel db
         """
-        temp_tokens_collection = db["temp_tokens"]
-        temp_tokens_collection.insert_one(self.to_dict())
+        db_loop.run(self.repository.insert(self.to_dict()))
 
     @property
     def is_expired(self):
-        return datetime.datetime.now() > self.expiry
+        return datetime.datetime.now(datetime.timezone.utc) > self.expiry
 
-    @staticmethod
-    def delete_one(id: str):
-        temp_tokens_collection = db["temp_tokens"]
-        temp_tokens_collection.delete_one({"_id": id})
+    @classmethod
+    def delete_one(cls, id: str):
+        db_loop.run(cls.repository.delete(id))
 
     @classmethod
     def from_dict(cls, data: dict):
         created_at = datetime.datetime.fromisoformat(data.get("created_at")) if isinstance(data.get("created_at"), str) else data.get("created_at")
         expiry = datetime.datetime.fromisoformat(data.get("expiry")) if isinstance(data.get("expiry"), str) else data.get("expiry")
+        # Le stringhe ISO dei token salvati in precedenza sono in ora locale
+        if isinstance(data.get("created_at"), str):
+            created_at = created_at.astimezone()
+        if isinstance(data.get("expiry"), str):
+            expiry = expiry.astimezone()
         return cls(
             token=data["_id"],
             pk=data["pk"],
             device_name=data["device_name"],
             created_at=created_at,
-            expiry=expiry
+            expiry=expiry,
+            group_id=data.get("group_id", LEGACY_GROUP_ID),
         )
 
     @classmethod
@@ -52,6 +80,5 @@ class TempToken:
         """
         Trova la coppia token - pk dato il token MongoDB per l'id.
         """
-        temp_tokens_collection = db["temp_tokens"]
-        data = temp_tokens_collection.find_one({"_id": token})
+        data = db_loop.run(cls.repository.find(token))
         return cls.from_dict(data) if data else None
@@ -1,9 +1,29 @@
 import datetime
-from utils.db import db
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from models.device_state import DeviceStateWriter, apply_pending
+from models.repository import MongoUserRepository, UserRepository
+from utils.db import db, db_loop
+from utils.group import key_fingerprint
+from utils.groups import LEGACY_GROUP_ID
+
+# Dimensione massima e durata (secondi) della cache degli utenti
+DEFAULT_USER_CACHE_SIZE = 10_000
+DEFAULT_USER_CACHE_TTL = 60
 
 
 class Device:
-    def __init__(self, pk: str, device_name: str, main_device: bool = True, logged: bool = True):
+    def __init__(
+        self,
+        pk: str,
+        device_name: str,
+        main_device: bool = True,
+        logged: bool = True,
+        group_id: str = LEGACY_GROUP_ID,
+    ):
         if not pk or not isinstance(pk, str):
             raise ValueError("Public key must be a non-empty string")
         if not device_name or not isinstance(device_name, str):
@@ -12,6 +32,7 @@ class Device:
         self.device_name = device_name
         self.main_device = main_device
         self.logged = logged
+        self.group_id = group_id
 
     def to_dict(self):
         return {
@@ -19,19 +40,103 @@ class Device:
             "device_name": self.device_name,
             "main_device": self.main_device,
             "logged": self.logged,
+            "group_id": self.group_id,
+            "key_id": key_fingerprint(self.pk),
         }
 
 
+class UserCache:
+    """
+    Cache LRU con scadenza degli utenti letti da MongoDB.
+
+    Gli oggetti `User` in cache sono condivisi tra le connessioni: le modifiche fatte
+    con i metodi `update_user_*` aggiornano sia il database sia la copia in memoria.
+    La scadenza limita quanto a lungo una modifica fatta da un altro processo può
+    restare invisibile.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_USER_CACHE_SIZE, ttl: float = DEFAULT_USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple[User, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> "User | None":
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user: "User") -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[user._id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user._id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, user: "User") -> None:
+        """
+        Scrittura passante dopo una modifica di `user`. Se in cache c'è un'altra istanza
+        dello stesso utente, non si sa quale sia aggiornata: viene scartata.
+        """
+        with self._lock:
+            entry = self._entries.get(user._id)
+            if entry is not None and entry[0] is not user:
+                del self._entries[user._id]
+                return
+        self.put(user)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
 class User:
-    collection = db["users"]
+    repository: UserRepository = MongoUserRepository(db)
+    cache = UserCache()
+    # Se impostato, login e logout non attendono la scrittura del flag `logged`
+    state_writer: Optional[DeviceStateWriter] = None
 
     def __init__(self, _id: str):
         self._id = _id
         self.devices = []
         self.created_at = datetime.datetime.now().isoformat()
+        # Indice impronta della chiave -> posizione in devices, costruito al primo uso
+        self._key_index: Optional[Dict[str, int]] = None
 
     def add_device(self, dev: Device):
         self.devices.append(dev.to_dict())
+        self._key_index = None
+
+    def find_device_index_by_key_id(self, key_id: str) -> Optional[int]:
+        """Posizione del dispositivo la cui chiave ha impronta `key_id`, se esiste."""
+        index = self._key_index
+        if index is None:
+            # I dispositivi salvati prima dell'introduzione di key_id la ricavano dalla chiave
+            index = {
+                device.get("key_id") or key_fingerprint(device["pk"]): i
+                for i, device in enumerate(self.devices)
+            }
+            self._key_index = index
+        return index.get(key_id)
 
     def to_dict(self):
         return {
@@ -40,37 +145,61 @@ class User:
             "created_at": self.created_at,
         }
 
+    def find_device(self, device_name: str) -> Optional[dict]:
+        for device in self.devices:
+            if device["device_name"] == device_name:
+                return device
+        return None
+
     def insert_user(self):
-        self.collection.insert_one(self.to_dict())
+        db_loop.run(self.repository.insert(self.to_dict()))
+        self.cache.put(self)
 
-    def update_user_with_device(self, pk: str, device_name: str):
-        device = Device(pk, device_name, main_device=False, logged=True)
+    def update_user_with_device(self, pk: str, device_name: str, group_id: str = LEGACY_GROUP_ID):
+        device = Device(pk, device_name, main_device=False, logged=True, group_id=group_id)
         self.add_device(device)
-        self.collection.update_one(
-            {"_id": self._id},
-            {"$set": {"devices": self.devices}}
-        )
+        db_loop.run(self.repository.set_devices(self._id, self.devices))
+        self.cache.refresh(self)
+
+    def _set_logged(self, device_name: str, logged: bool):
+        if self.state_writer is not None:
+            self.state_writer.submit(self._id, device_name, logged)
+        else:
+            db_loop.run(self.repository.set_device_logged(self._id, device_name, logged))
+        device = self.find_device(device_name)
+        if device is not None:
+            device["logged"] = logged
+        self.cache.refresh(self)
 
     def update_user_loggedout(self, device_name: str):
-        self.collection.update_one(
-            {"_id": self._id , "devices.device_name": device_name},
-            {"$set": {"devices.$.logged": False}}
-        )
+        self._set_logged(device_name, False)
 
     def update_user_login(self, device_name: str):
-        self.collection.update_one(
-            {"_id": self._id, "devices.device_name": device_name},
-            {"$set": {"devices.$.logged": True}}
-        )
+        self._set_logged(device_name, True)
 
     @classmethod
     def from_dict(cls, data: dict):
         user = cls(data["_id"])
         user.devices = data.get("devices", [])
+        user._key_index = None
         user.created_at = data.get("created_at", datetime.datetime.now().isoformat())
         return user
 
+    @classmethod
+    def write_device_states(cls, updates: list) -> None:
+        """Scrive in blocco gli aggiornamenti accodati da `state_writer`."""
+        db_loop.run(cls.repository.bulk_set_device_logged(updates))
+
     @classmethod
     def find_user_by_id(cls, id: str) -> "User | None":
-        data = cls.collection.find_one({"_id": id})
-        return cls.from_dict(data) if data else None
+        user = cls.cache.get(id)
+        if user is not None:
+            return user
+
+        data = db_loop.run(cls.repository.find(id))
+        if not data:
+            return None
+        user = cls.from_dict(data)
+        apply_pending(cls.state_writer, user._id, user.devices)
+        cls.cache.put(user)
+        return user
@@ -1,66 +1,107 @@
+import asyncio
+import functools
 import hashlib
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
 import random
+import shutil
+import signal
 import socket
 import sys
+import tempfile
 import threading
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Ensure project root is in sys.path for internal imports
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
-from utils.context import ConnContext
+from utils.cluster import MAX_WORKERS, PeerChannel, PeerError
+from utils.context import AsyncConnContext, ConnContext
+from utils.dispatch import MessageDispatcher
+from utils.db import (
+    DEFAULT_DB_NAME,
+    DEFAULT_MONGO_URI,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT_MS,
+    db_loop,
+)
 from utils.exceptions import *
-from utils.groups import GROUPS
+from utils.fiat_shamir import (
+    DEFAULT_NONCE_TTL,
+    DEFAULT_REPLAY_CACHE_SIZE,
+    NonceIssuer,
+    ReplayCache,
+    derive_challenge,
+)
+from utils.framing import DEFAULT_MAX_FRAME_SIZE
+from utils.group import get_group
+from utils.groups import DEFAULT_GROUP_PREFERENCE, GROUPS, LEGACY_GROUP_ID
 from utils.logger import Logger
 from utils.message import ErrorType, MessageType
-
+from utils.registry import ConnectionRegistry
+from utils.verifier import (
+    DEFAULT_KEY_CACHE_SIZE,
+    DEFAULT_KEY_TABLE_CACHE_SIZE,
+    VerificationExecutor,
+)
+from utils.wire import SUPPORTED_ENCODINGS, element_text, select_encoding
+
+from models.device_state import DEFAULT_WRITE_BATCH, DEFAULT_WRITE_DELAY, DeviceStateWriter
+from models.repository import (
+    DEFAULT_MAX_TEMP_TOKENS,
+    MEMORY_BACKEND,
+    MONGO_BACKEND,
+    bootstrap_schema,
+    create_repositories,
+)
 from models.temp_token import *
 from models.user import *
 
 DEBUG = True
 
-logger = Logger()
-
-# --- Struttura globale per le connessioni attive ---
-active_connections = {}
-connections_lock = threading.Lock()
+# Modalità asyncio: dimensione del pool che esegue gli handler e backlog del listener
+DEFAULT_HANDLER_WORKERS = 32
+ASYNC_BACKLOG = 4096
 
+# Modalità multiprocesso: attesa prima di riavviare un worker terminato e prima di
+# forzarne la chiusura allo spegnimento (secondi)
+WORKER_RESTART_DELAY = 1.0
+WORKER_SHUTDOWN_TIMEOUT = 10.0
 
-def register_connection(identifier: str, ctx: ConnContext):
-    with connections_lock:
-        active_connections[identifier] = ctx
+logger = Logger()
 
+# Pool di processi per la verifica delle risposte, configurato in main()
+verification_executor = VerificationExecutor(workers=0)
 
-def get_connection(identifier) -> ConnContext:
-    with connections_lock:
-        return active_connections.get(identifier)
+# Nonce per l'autenticazione non interattiva e nonce già consumati, configurati in main()
+nonce_issuer = NonceIssuer()
+replay_cache = ReplayCache()
 
+# Gruppi negoziabili nell'handshake e gruppo per i client che non ne dichiarano, configurati in main()
+group_preference = DEFAULT_GROUP_PREFERENCE
+default_group_id = LEGACY_GROUP_ID
 
-def remove_connection(identifier):
-    with connections_lock:
-        active_connections.pop(identifier, None)
+# Codifiche dei messaggi proposte ai client nell'handshake (JSON resta sempre accettata),
+# configurate in main()
+encoding_preference = SUPPORTED_ENCODINGS
 
+# --- Registro delle connessioni attive (token di abbinamento, utenti e dispositivi) ---
+connections = ConnectionRegistry()
 
-def validate_message(msg: dict, required_fields: dict):
-    """required_fields: dict con chiave=nome campo, valore=tipo atteso."""
-    if not isinstance(msg, dict):
-        raise ValidationError("Messaggio non valido: non è un dizionario")
+# Canale verso gli altri worker, solo in modalità multiprocesso (configurato in serve())
+peers: PeerChannel | None = None
 
-    parsed = {}
-    for field, expected_type in required_fields.items():
-        value = msg.get(field)
-        if value is None:
-            raise ValidationError(f"Campo mancante: {field}")
-        if not isinstance(value, expected_type):
-            raise ValidationError(
-                f"Il campo {field} deve essere {expected_type.__name__}"
-            )
-        parsed[field] = value
-    return parsed
+# Operazioni sul canale tra i worker
+PEER_FIND_TOKEN = "find_token"
+PEER_DELETE_TOKEN = "delete_token"
+PEER_COMPLETE_ASSOC = "complete_assoc"
+PEER_INVALIDATE_USER = "invalidate_user"
 
 
 def generate_token(token_length: int, pk: str, device_name: str) -> str:
@@ -74,19 +115,9 @@ def generate_token(token_length: int, pk: str, device_name: str) -> str:
 
 
 def handle_registration(ctx: ConnContext, msg: dict):
-    try:
-        data = validate_message(
-            msg, {"username": str, "device": str, "public_key": str}
-        )
-    except ValidationError as e:
-        ctx.send_error(ErrorType.MALFORMED_MESSAGE)
-        if DEBUG:
-            logger.error(f"[SERVER] Errore di validazione {e}")
-            return
-
-    username = data["username"]
-    device_name = data["device"]
-    pk = data["public_key"]
+    username = msg["username"]
+    device_name = msg["device"]
+    pk = element_text(ctx.group, msg["public_key"])
 
     if User.find_user_by_id(username):
         ctx.send_error(ErrorType.USERNAME_ALREADY_EXISTS)
@@ -97,28 +128,21 @@ def handle_registration(ctx: ConnContext, msg: dict):
         return
 
     user = User(username)
-    user.add_device(Device(pk, device_name))
+    user.add_device(Device(pk, device_name, group_id=ctx.group_id))
 
     user.insert_user()
 
     ctx.update_session(user=user, logged_device=device_name, login_time=datetime.datetime.now())
+    connections.bind_user(ctx, username, device_name)
 
     ctx.send_message(MessageType.REGISTERED)
     if DEBUG:
         logger.debug(f"[SERVER] Utente registrato: {username}")
 
 
-def handle_auth_request(ctx: ConnContext, msg: dict, q: int):
-    try:
-        data = validate_message(msg, {"username": str, "temp": str})
-    except ValidationError as e:
-        ctx.send_error(ErrorType.MALFORMED_MESSAGE)
-        if DEBUG:
-            logger.error(f"[SERVER] Errore di validazione {e}")
-        return
-
-    username = data["username"]
-    temp_pk_hex = data["temp"]
+def handle_auth_request(ctx: ConnContext, msg: dict):
+    username = msg["username"]
+    temp = msg["temp"]
 
     user = User.find_user_by_id(username)
 
@@ -131,66 +155,92 @@ def handle_auth_request(ctx: ConnContext, msg: dict, q: int):
         return
 
     try:
-        temp_pk = int(temp_pk_hex, 16)
+        temp_pk = ctx.group.decode(temp)
     except (ValueError, TypeError):
         ctx.send_error(ErrorType.MALFORMED_MESSAGE)
         return
 
-    challenge = random.randint(0, q - 1)
+    challenge = random.randint(0, ctx.group.q - 1)
+
+    # Impronta facoltativa della chiave, per verificare un solo dispositivo
+    key_id = msg.get("key_id")
 
-    ctx.update_session(temp_pk=temp_pk, user=user, challenge=challenge)
+    ctx.update_session(temp_pk=temp_pk, user=user, challenge=challenge, key_id=key_id)
 
     ctx.send_message(MessageType.CHALLENGE, {"challenge": hex(challenge)})
     if DEBUG:
         logger.debug(f"[SERVER] Sfida inviata a {username}: {hex(challenge)[:20]}...")
 
 
-def handle_auth_response(ctx: ConnContext, msg: dict, p: int, g: int):
+def handle_auth_response(ctx: ConnContext, msg: dict):
     if ctx.is_session_empty:
         if DEBUG:
             logger.error("[SERVER] Risposta di autenticazione senza sessione attiva")
         ctx.send_error(ErrorType.SESSION_NOT_FOUND)
         return
 
-    try:
-        data = validate_message(msg, {"response": str})
-    except ValidationError as e:
-        ctx.send_error(ErrorType.MALFORMED_MESSAGE)
-        if DEBUG:
-            logger.error(f"[SERVER] Errore di validazione {e}")
-        return
-
-    resp_hex = data["response"]
-
-    try:
-        alpha_z = int(resp_hex, 16)
-    except (ValueError, TypeError):
-        ctx.send_error(ErrorType.MALFORMED_MESSAGE)
-        return
-
+    # Già convertita in intero in [0, q) dallo schema
+    alpha_z = msg["response"]
     temp_pk = ctx.session.temp_pk
-    devices = ctx.session.user.devices
+    user = ctx.session.user
     challenge = ctx.session.challenge
 
-    authenticated = False
-    matched_device = None
-    for device in devices:
-        try:
-            pk = int(device["pk"], 16)
-        except (ValueError, TypeError):
-            continue
-        left = pow(g, alpha_z, p)
-        right = (temp_pk * pow(pk, challenge, p)) % p
-        if left == right:
-            authenticated = True
-            matched_device = device
-            break
-
-    if authenticated:
-        ctx.send_message(MessageType.ACCEPTED)
+    index = verification_executor.verify(
+        ctx.group_id, temp_pk, challenge, alpha_z,
+        candidate_keys(ctx, user, ctx.session.key_id),
+    )
+    complete_authentication(ctx, user, index)
+
+
+def candidate_keys(ctx: ConnContext, user: User, key_id: str | None = None) -> list:
+    """
+    Chiavi dei dispositivi dell'utente; None per quelle da non provare. Se il client
+    indica l'impronta della propria chiave e questa è nota, resta una sola candidata;
+    altrimenti (client legacy) si provano tutti i dispositivi del gruppo negoziato.
+    """
+    if key_id is not None:
+        index = user.find_device_index_by_key_id(key_id)
+        if index is not None:
+            pks = [None] * len(user.devices)
+            device = user.devices[index]
+            if device.get("group_id", LEGACY_GROUP_ID) == ctx.group_id:
+                pks[index] = device["pk"]
+            return pks
+
+    # Solo le chiavi generate nel gruppo negoziato possono soddisfare l'equazione
+    return [
+        device["pk"] if device.get("group_id", LEGACY_GROUP_ID) == ctx.group_id else None
+        for device in user.devices
+    ]
+
+
+def complete_authentication(
+    ctx: ConnContext,
+    user: User,
+    index: int | None,
+    extra_data: dict | None = None,
+    login: bool = True,
+):
+    """
+    Invia l'esito della verifica e, se positivo, registra il login del dispositivo trovato.
+    Con `login=False` la verifica non apre una sessione sulla connessione né segna il
+    dispositivo come collegato.
+    """
+    authenticated = index is not None
+    matched_device = user.devices[index] if authenticated else None
+
+    if authenticated and not login:
+        ctx.send_message(MessageType.ACCEPTED, extra_data)
+        if DEBUG:
+            logger.debug(f"[SERVER] User {user._id} verificato senza login")
+    elif authenticated:
+        ctx.send_message(MessageType.ACCEPTED, extra_data)
         ctx.update_session(
-            logged_device=matched_device["device_name"], login_time=datetime.datetime.now()
+            user=user,
+            logged_device=matched_device["device_name"],
+            login_time=datetime.datetime.now(),
         )
+        connections.bind_user(ctx, user._id, ctx.session.logged_device)
         ctx.session.user.update_user_login(ctx.session.logged_device)
 
         if DEBUG:
@@ -200,50 +250,108 @@ def handle_auth_response(ctx: ConnContext, msg: dict, p: int, g: int):
                 else "'unknown'"
             )
     else:
-        ctx.send_message(MessageType.REJECTED)
+        ctx.send_message(MessageType.REJECTED, extra_data)
         if DEBUG:
             logger.debug("[SERVER] Autenticazione rifiutata")
 
 
-def handle_assoc_request(ctx: ConnContext, msg: dict):
-    token_length = 32
+def handle_auth_proof(ctx: ConnContext, msg: dict):
+    """
+    Autenticazione non interattiva (Fiat-Shamir) in un solo round trip: il client
+    invia commitment, risposta e un nonce emesso dal server; la sfida è l'hash della
+    trascrizione. Tra un messaggio e l'altro il server non conserva alcuno stato.
+
+    Con `verify_only` la prova viene solo verificata, senza login: così un servizio può
+    verificare più utenti sulla stessa connessione (vedi client/auth_client.py).
+    """
+    username = msg["username"]
+    nonce = msg["nonce"]
+
+    expires_at = nonce_issuer.expires_at(nonce)
+    if expires_at is None:
+        ctx.send_error(ErrorType.NONCE_INVALID)
+        if DEBUG:
+            logger.debug(f"[SERVER] Nonce non valido o scaduto da {ctx.addr}")
+        return
+
+    user = User.find_user_by_id(username)
+    if not user:
+        ctx.send_error(ErrorType.USERNAME_NOT_FOUND)
+        if DEBUG:
+            logger.debug(
+                f"[SERVER] Autenticazione fallita: username '{username}' non trovato"
+            )
+        return
 
     try:
-        data = validate_message(msg, {"pk": str, "device": str})
-    except ValidationError as e:
+        temp_pk = ctx.group.decode(msg["temp"])
+        # La trascrizione usa sempre la forma testuale dell'elemento
+        temp_pk_hex = element_text(ctx.group, msg["temp"])
+    except (ValueError, TypeError):
         ctx.send_error(ErrorType.MALFORMED_MESSAGE)
+        return
+
+    key_id = msg.get("key_id")
+    alpha_z = msg["response"]
+
+    challenge = derive_challenge(ctx.group_id, ctx.group.q, username, temp_pk_hex, nonce)
+    index = verification_executor.verify(
+        ctx.group_id, temp_pk, challenge, alpha_z, candidate_keys(ctx, user, key_id)
+    )
+
+    # Il nonce viene consumato solo da una prova valida: chi lo intercetta non può
+    # bruciarlo al client, e di due prove concorrenti con lo stesso nonce ne passa una
+    if index is not None and not replay_cache.add(nonce, expires_at):
+        ctx.send_error(ErrorType.NONCE_INVALID)
         if DEBUG:
-            logger.error(f"[SERVER] Errore di validazione {e}")
+            logger.debug(f"[SERVER] Nonce già utilizzato da {ctx.addr}")
         return
 
-    pk = data["pk"]
-    device_name = data["device"]
+    # Nonce per il prossimo tentativo sulla stessa connessione
+    complete_authentication(
+        ctx, user, index, {"nonce": nonce_issuer.issue()}, login=not msg.get("verify_only")
+    )
+
+
+def handle_assoc_request(ctx: ConnContext, msg: dict):
+    token_length = 32
+
+    pk = element_text(ctx.group, msg["pk"])
+    device_name = msg["device"]
 
     token = generate_token(token_length, pk, device_name)
+    if peers is not None:
+        token = peers.tag_token(token)
     if DEBUG:
         logger.debug(f"[SERVER] Hashed Token: {token}")
 
-    ctx.send_message(MessageType.TOKEN_ASSOC, {"token": token})
-
-    temp_token = TempToken(token, pk, device_name)
+    temp_token = TempToken(token, pk, device_name, group_id=ctx.group_id)
     temp_token.insert_temp_token()
 
-    register_connection(token, ctx)
+    connections.register_token(token, ctx)
     if DEBUG:
         logger.debug(f"[SERVER] Salvata tupla: {token} - {pk[:20]}...")
 
+    # Il token va inviato solo quando è già confermabile dal dispositivo principale
+    ctx.send_message(MessageType.TOKEN_ASSOC, {"token": token})
+
 
 def handle_assoc_confirm(ctx: ConnContext, msg: dict):
-    try:
-        data = validate_message(msg, {"token": str})
-    except ValidationError as e:
-        ctx.send_error(ErrorType.MALFORMED_MESSAGE)
-        if DEBUG:
-            logger.error(f"[SERVER] Errore di validazione {e}")
-        return
+    token = msg["token"]
 
-    token = data["token"]
-    temp_token = TempToken.find_pk_by_id(token)
+    # Con più processi il token può essere stato emesso da un altro worker, che tiene
+    # sia il token sia la connessione del secondo dispositivo
+    owner = remote_owner(token)
+
+    if owner is None:
+        temp_token = TempToken.find_pk_by_id(token)
+    else:
+        try:
+            found = peers.request(owner, PEER_FIND_TOKEN, token=token)["token"]
+        except PeerError as e:
+            logger.error(f"[SERVER] {e}")
+            found = None
+        temp_token = TempToken.from_dict(found) if found else None
 
     if not temp_token:
         ctx.send_error(ErrorType.UNAUTHORIZED)
@@ -253,7 +361,7 @@ def handle_assoc_confirm(ctx: ConnContext, msg: dict):
             )
         return
 
-    pk, device_name = temp_token.pk, temp_token.device_name
+    pk, device_name, group_id = temp_token.pk, temp_token.device_name, temp_token.group_id
 
     if not ctx.session.is_authenticated():
         ctx.send_error(ErrorType.SESSION_NOT_FOUND)
@@ -277,7 +385,13 @@ def handle_assoc_confirm(ctx: ConnContext, msg: dict):
 
     if temp_token.is_expired:
         ctx.send_error(ErrorType.TOKEN_INVALID_OR_EXPIRED)
-        TempToken.delete_one(token)
+        if owner is None:
+            TempToken.delete_one(token)
+        else:
+            try:
+                peers.request(owner, PEER_DELETE_TOKEN, token=token)
+            except PeerError as e:
+                logger.error(f"[SERVER] {e}")
         if DEBUG:
             logger.error(
                 f"[SERVER] Errore: {ErrorType.TOKEN_INVALID_OR_EXPIRED.message()}"
@@ -286,21 +400,34 @@ def handle_assoc_confirm(ctx: ConnContext, msg: dict):
 
     user = ctx.session.user
 
-    user.update_user_with_device(pk, device_name)
+    user.update_user_with_device(pk, device_name, group_id)
 
     ctx.update_session(user=user)
 
-    TempToken.delete_one(token)
-
     # Verifica che il secondo dispositivo non si sia scollegato nel mentre, altrimenti annulla accoppiamento
     # e dal database viene cancellata la coppia tempo_token
 
-    s_ctx = get_connection(token)
-
-    if not s_ctx:
+    if owner is None:
+        TempToken.delete_one(token)
+        delivered = deliver_pairing(token, user, device_name)
+    else:
+        try:
+            delivered = peers.request(
+                owner, PEER_COMPLETE_ASSOC, token=token, user_id=user._id, device_name=device_name
+            )["delivered"]
+        except PeerError as e:
+            logger.error(f"[SERVER] {e}")
+            delivered = False
+
+    if peers is not None:
+        # Le cache degli altri worker hanno ancora l'elenco dei dispositivi precedente
+        peers.broadcast(PEER_INVALIDATE_USER, user_id=user._id)
+
+    if not delivered:
         ctx.send_error(ErrorType.ASSOC_FAILURE)
         if DEBUG:
             logger.debug(f"[SERVER] {ErrorType.message(ErrorType.ASSOC_FAILURE)}")
+        return
 
     # Send ACCEPT message to main device
     ctx.send_message(MessageType.ACCEPTED)
@@ -309,12 +436,54 @@ def handle_assoc_confirm(ctx: ConnContext, msg: dict):
             f"[SERVER] Dispositivo associato a {user._id}: {device_name} ({pk[:20]}...)"
         )
 
+
+def remote_owner(token: str) -> int | None:
+    """Indice del worker che ha emesso il token, se diverso da questo processo."""
+    if peers is None:
+        return None
+    owner = peers.owner_of(token)
+    return owner if owner != peers.worker_id else None
+
+
+def deliver_pairing(token: str, user: User, device_name: str) -> bool:
+    """
+    Autentica il secondo dispositivo in attesa del token e gli invia l'esito.
+    Restituisce False se la connessione che l'aveva richiesto non è più aperta.
+    """
+    s_ctx = connections.pop_token(token)
+    if not s_ctx:
+        return False
+
     # Send ACCEPT message to second device
-    # TODO: thread lock?
     s_ctx.update_session(
         user=user, logged_device=device_name, login_time=datetime.datetime.now()
     )
+    connections.bind_user(s_ctx, user._id, device_name)
     s_ctx.send_message(MessageType.ACCEPTED, {"username": user._id})
+    return True
+
+
+def handle_peer_request(msg: dict) -> dict:
+    """Operazioni richieste da un altro worker sul canale locale (modalità multiprocesso)."""
+    op = msg.get("op")
+    if op == PEER_FIND_TOKEN:
+        temp_token = TempToken.find_pk_by_id(msg["token"])
+        return {"token": temp_token.to_json() if temp_token else None}
+    if op == PEER_DELETE_TOKEN:
+        TempToken.delete_one(msg["token"])
+        return {}
+    if op == PEER_COMPLETE_ASSOC:
+        TempToken.delete_one(msg["token"])
+        # Il dispositivo è appena stato aggiunto dall'altro worker: si rilegge l'utente
+        User.cache.invalidate(msg["user_id"])
+        user = User.find_user_by_id(msg["user_id"])
+        delivered = user is not None and deliver_pairing(msg["token"], user, msg["device_name"])
+        return {"delivered": delivered}
+    if op == PEER_INVALIDATE_USER:
+        User.cache.invalidate(msg["user_id"])
+        return {}
+    raise ValueError(f"Operazione sconosciuta: {op}")
+
 
 def handle_devices_request(ctx: ConnContext, msg: dict):
     if ctx.is_session_empty:
@@ -341,13 +510,14 @@ def handle_devices_request(ctx: ConnContext, msg: dict):
         logger.debug(f"[SERVER] Lista dispositivi inviata a {user._id}")
 
 
-def handle_logout(ctx: ConnContext):
+def handle_logout(ctx: ConnContext, msg: dict):
     # se session presente, invalida e chiudi
     if not ctx.is_session_empty:
         ctx.send_message(MessageType.LOGGED_OUT)
         user = ctx.session.user
         user.update_user_loggedout(ctx.session.logged_device)
         ctx.clear_session()
+        connections.unbind_user(ctx)
         if DEBUG:
             logger.debug("[SERVER] Logout effettuato con successo")
     else:
@@ -357,50 +527,82 @@ def handle_logout(ctx: ConnContext):
     return True
 
 
-def handle_handshake(ctx: ConnContext, group_id: str):
-    ctx.send_message(MessageType.GROUP_SELECTION, {"group_id": group_id})
-    res = ctx.receive_json()
-    if res is None:
-        logger.info(
-            f"[SERVER] Connessione chiusa dal client {ctx.addr} o messaggio non valido"
-        )
-        ctx.close()
+def select_group(client_groups) -> str | None:
+    """Primo gruppo nella preferenza del server supportato anche dal client."""
+    for group_id in group_preference:
+        if group_id in client_groups:
+            return group_id
+    return None
+
+
+def handle_handshake(ctx: ConnContext, msg: dict):
+    client_groups = msg.get("groups")
+
+    # I client che non dichiarano i gruppi supportati usano quello di default
+    if not isinstance(client_groups, list):
+        group_id = default_group_id
+    else:
+        group_id = select_group(client_groups)
+
+    if group_id is None:
+        ctx.send_error(ErrorType.UNSUPPORTED_GROUP)
+        if DEBUG:
+            logger.debug(
+                f"[SERVER] Nessun gruppo in comune con {ctx.addr}: {client_groups}"
+            )
         return
-    if res.get("type") == MessageType.HANDSHAKE_RES.label:
-        logger.info(f"[SERVER] Handshake riuscito con {ctx.addr}")
+
+    reply = {"group_id": group_id, "nonce": nonce_issuer.issue()}
+    # I client che non dichiarano le codifiche supportate restano su JSON
+    client_encodings = msg.get("encodings")
+    encoding = select_encoding(encoding_preference, client_encodings)
+    if client_encodings is not None:
+        reply["encoding"] = encoding
+
+    # La risposta usa ancora la codifica corrente: il client cambia dopo averla letta
+    ctx.group_id = group_id
+    ctx.send_message(MessageType.GROUP_SELECTION, reply)
+    ctx.set_encoding(encoding)
+
+
+def handle_handshake_response(ctx: ConnContext, msg: dict):
+    logger.info(
+        f"[SERVER] Handshake riuscito con {ctx.addr} "
+        f"(gruppo {ctx.group_id}, codifica {ctx.codec.name})"
+    )
+
+
+# Handler di ogni messaggio accettato dal server; i campi sono in utils.schema.SCHEMAS
+dispatcher = MessageDispatcher(debug=DEBUG)
+dispatcher.register(MessageType.HANDSHAKE_REQ, handle_handshake)
+dispatcher.register(MessageType.HANDSHAKE_RES, handle_handshake_response)
+dispatcher.register(MessageType.REGISTER, handle_registration)
+dispatcher.register(MessageType.AUTH_REQUEST, handle_auth_request)
+dispatcher.register(MessageType.AUTH_RESPONSE, handle_auth_response)
+dispatcher.register(MessageType.AUTH_PROOF, handle_auth_proof)
+dispatcher.register(MessageType.ASSOC_REQUEST, handle_assoc_request)
+dispatcher.register(MessageType.TOKEN_ASSOC, handle_assoc_confirm)
+dispatcher.register(MessageType.DEVICES_REQUEST, handle_devices_request)
+dispatcher.register(MessageType.LOGOUT, handle_logout)
+
+
+def dispatch_message(ctx: ConnContext, msg: dict):
+    dispatcher.dispatch(ctx, msg)
 
 
 # ---------------- client handler ----------------
 
 
-def client_handler(ctx: ConnContext, p: int, g: int, q: int, group_id: str):
+def client_handler(ctx: ConnContext):
     logger.info(f"[SERVER] Thread avviato per {ctx.addr}")
     try:
         while True:
-            msg = ctx.receive_json()
+            msg = ctx.receive_message()
             if msg is None:
                 logger.info(f"[SERVER] Connessione chiusa dal client {ctx.addr}")
                 break
 
-            msg_type = msg.get("type")
-            if msg_type == MessageType.HANDSHAKE_REQ.label:
-                handle_handshake(ctx, group_id)
-            elif msg_type == MessageType.REGISTER.label:
-                handle_registration(ctx, msg)
-            elif msg_type == MessageType.AUTH_REQUEST.label:
-                handle_auth_request(ctx, msg, q)
-            elif msg_type == MessageType.AUTH_RESPONSE.label:
-                handle_auth_response(ctx, msg, p, g)
-            elif msg_type == MessageType.ASSOC_REQUEST.label:
-                handle_assoc_request(ctx, msg)
-            elif msg_type == MessageType.TOKEN_ASSOC.label:
-                handle_assoc_confirm(ctx, msg)
-            elif msg_type == MessageType.DEVICES_REQUEST.label:
-                handle_devices_request(ctx, msg)
-            elif msg_type == MessageType.LOGOUT.label:
-                handle_logout(ctx)
-            else:
-                logger.info(f"[SERVER] Tipo messaggio sconosciuto: {msg_type}")
+            dispatch_message(ctx, msg)
     except Exception as e:
         logger.error(f"[SERVER] Errore nel thread per {ctx.addr}: {e}")
     finally:
@@ -409,35 +611,322 @@ def client_handler(ctx: ConnContext, p: int, g: int, q: int, group_id: str):
         logger.info(f"[SERVER] Thread terminato per {ctx.addr}")
 
 
-# ---------------- main ----------------
+async def async_client_handler(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    executor: ThreadPoolExecutor,
+    max_frame_size: int,
+):
+    """
+    Gestisce una connessione sull'event loop. La lettura è non bloccante, mentre
+    ogni messaggio viene elaborato nel thread pool, così che esponenziazioni modulari
+    e accessi a MongoDB non blocchino le altre connessioni.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = AsyncConnContext(reader, writer, loop, max_frame_size, default_group_id)
+    logger.info(f"[SERVER] Connessione avviata per {ctx.addr}")
+    try:
+        while True:
+            msg = await ctx.receive_message_async()
+            if msg is None:
+                logger.info(f"[SERVER] Connessione chiusa dal client {ctx.addr}")
+                break
 
+            await loop.run_in_executor(executor, dispatch_message, ctx, msg)
+            if ctx._closed:
+                break
+            # Come `sendall` in modalità threaded: finché il client non legge le
+            # risposte già accodate non si passa al messaggio successivo
+            await writer.drain()
+    except ConnectionError:
+        logger.info(f"[SERVER] Connessione chiusa dal client {ctx.addr}")
+    except Exception as e:
+        logger.error(f"[SERVER] Errore nella connessione con {ctx.addr}: {e}")
+    finally:
+        if not ctx._closed:
+            ctx.close()
+        logger.info(f"[SERVER] Connessione terminata per {ctx.addr}")
 
-def main():
-    with open("config.json", "r", encoding="utf-8") as f:
-        config = json.load(f)
 
-    HOST = config["host"]
-    PORT = config["port"]
-    GROUP_ID = config["group_id"]
+# ---------------- main ----------------
 
-    GROUP_ID = "modp-1536"
-    p = GROUPS[GROUP_ID]["p"]
-    g = GROUPS[GROUP_ID]["g"]
-    q = (p - 1) // 2
 
+def serve_threaded(host: str, port: int, max_frame_size: int, reuse_port: bool = False):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
+        if reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((host, port))
         s.listen()
-        logger.info(f"[SERVER] In ascolto su {HOST}:{PORT}")
+        logger.info(f"[SERVER] In ascolto su {host}:{port}")
 
         while True:
             conn, addr = s.accept()
-            ctx = ConnContext(conn, addr)
-            t = threading.Thread(target=client_handler, args=(ctx, p, g, q, GROUP_ID))
+            # Messaggi piccoli e inviati anche senza richiesta (es. ACCEPTED al secondo
+            # dispositivo): con Nagle resterebbero in attesa dell'ACK ritardato del client
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            ctx = ConnContext(conn, addr, max_frame_size, default_group_id)
+            t = threading.Thread(target=client_handler, args=(ctx,))
             t.daemon = True
             t.start()
 
 
+async def serve_async(
+    host: str, port: int, max_frame_size: int, handler_workers: int, reuse_port: bool = False
+):
+    executor = ThreadPoolExecutor(
+        max_workers=handler_workers, thread_name_prefix="handler"
+    )
+    server = await asyncio.start_server(
+        functools.partial(
+            async_client_handler, executor=executor, max_frame_size=max_frame_size
+        ),
+        host,
+        port,
+        reuse_address=True,
+        reuse_port=reuse_port,
+        backlog=ASYNC_BACKLOG,
+    )
+    logger.info(f"[SERVER] In ascolto (asyncio) su {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def serve(config: dict, worker_id: int = 0, workers: int = 1, socket_dir: str | None = None):
+    """
+    Avvia il server nel processo corrente. Con `workers > 1` è uno dei worker avviati
+    da `supervise`: ascolta con SO_REUSEPORT e apre il canale verso gli altri worker.
+    """
+    HOST = config["host"]
+    PORT = config["port"]
+    GROUP_ID = config.get("group_id", LEGACY_GROUP_ID)
+    GROUP_PREFERENCE = config.get("group_preference", DEFAULT_GROUP_PREFERENCE)
+    ENCODINGS = config.get("encodings", SUPPORTED_ENCODINGS)
+    MAX_FRAME_SIZE = config.get("max_frame_size", DEFAULT_MAX_FRAME_SIZE)
+    MODE = config.get("mode", "threaded")
+    HANDLER_WORKERS = config.get("handler_workers", DEFAULT_HANDLER_WORKERS)
+    VERIFY_WORKERS = config.get("verify_workers")
+    BATCH_MAX_SIZE = config.get("batch_max_size", 0)
+    BATCH_MAX_DELAY_MS = config.get("batch_max_delay_ms", 2)
+    NONCE_TTL = config.get("nonce_ttl", DEFAULT_NONCE_TTL)
+    REPLAY_CACHE_SIZE = config.get("replay_cache_size", DEFAULT_REPLAY_CACHE_SIZE)
+    USER_CACHE_SIZE = config.get("user_cache_size", DEFAULT_USER_CACHE_SIZE)
+    USER_CACHE_TTL = config.get("user_cache_ttl", DEFAULT_USER_CACHE_TTL)
+    KEY_CACHE_SIZE = config.get("key_cache_size", DEFAULT_KEY_CACHE_SIZE)
+    KEY_TABLE_CACHE_SIZE = config.get("key_table_cache_size", DEFAULT_KEY_TABLE_CACHE_SIZE)
+    DB_BACKEND = config.get("db_backend", MONGO_BACKEND)
+    MONGO_URI = config.get("mongo_uri", DEFAULT_MONGO_URI)
+    MONGO_DB = config.get("mongo_db", DEFAULT_DB_NAME)
+    MONGO_POOL_SIZE = config.get("mongo_pool_size", DEFAULT_POOL_SIZE)
+    MONGO_TIMEOUT_MS = config.get("mongo_timeout_ms", DEFAULT_TIMEOUT_MS)
+    BOOTSTRAP_INDEXES = config.get("bootstrap_indexes", True)
+    PAIRING_BACKEND = config.get("pairing_backend", MEMORY_BACKEND)
+    PAIRING_MAX_TOKENS = config.get("pairing_max_tokens", DEFAULT_MAX_TEMP_TOKENS)
+    DEVICE_STATE_DELAY_MS = config.get("device_state_delay_ms", DEFAULT_WRITE_DELAY * 1000)
+    DEVICE_STATE_BATCH = config.get("device_state_batch", DEFAULT_WRITE_BATCH)
+
+    global default_group_id, group_preference, encoding_preference
+    default_group_id = GROUP_ID
+    group_preference = [group_id for group_id in GROUP_PREFERENCE if group_id in GROUPS]
+    encoding_preference = [e for e in ENCODINGS if e in SUPPORTED_ENCODINGS]
+
+    # Il pool di verifica di default si divide tra i worker
+    if workers > 1 and VERIFY_WORKERS is None:
+        VERIFY_WORKERS = max(1, (os.cpu_count() or 1) // workers)
+
+    # Tabelle a base fissa per ogni generatore: costruite prima del pool così che i
+    # processi le ereditino (nei worker sono già state ereditate dal supervisore)
+    precompute_groups(config)
+
+    # Il pool di verifica viene creato con fork prima di qualunque altro thread: canale
+    # tra i worker, client MongoDB, db_loop e scrittura dello stato dei dispositivi
+    global verification_executor
+    verification_executor = VerificationExecutor(
+        VERIFY_WORKERS,
+        batch_size=BATCH_MAX_SIZE,
+        batch_delay=BATCH_MAX_DELAY_MS / 1000,
+        key_cache_size=KEY_CACHE_SIZE,
+        key_table_cache_size=KEY_TABLE_CACHE_SIZE,
+    )
+    logger.info(
+        f"[SERVER] Verifica delle risposte su {verification_executor.workers} processi"
+    )
+    if BATCH_MAX_SIZE > 1:
+        logger.info(
+            f"[SERVER] Verifica a lotti: fino a {BATCH_MAX_SIZE} prove "
+            f"ogni {BATCH_MAX_DELAY_MS} ms"
+        )
+
+    global peers
+    if workers > 1:
+        peers = PeerChannel(worker_id, workers, socket_dir, handle_peer_request)
+        peers.start()
+        logger.info(f"[SERVER] Worker {worker_id} avviato (pid {os.getpid()})")
+
+    # Segreto dei nonce generato in ogni processo: un nonce vale solo sul worker che
+    # l'ha emesso, lo stesso che ne tiene la cache anti-replay
+    global nonce_issuer, replay_cache
+    nonce_issuer = NonceIssuer(ttl=NONCE_TTL)
+    replay_cache = ReplayCache(REPLAY_CACHE_SIZE)
+
+    User.cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+    User.repository, TempToken.repository = create_repositories(
+        DB_BACKEND,
+        MONGO_URI,
+        MONGO_DB,
+        MONGO_POOL_SIZE,
+        MONGO_TIMEOUT_MS,
+        token_backend=PAIRING_BACKEND,
+        max_temp_tokens=PAIRING_MAX_TOKENS,
+    )
+    db_loop.timeout = MONGO_TIMEOUT_MS / 1000
+    logger.info(
+        f"[SERVER] Backend del database: {DB_BACKEND}, token di abbinamento: {PAIRING_BACKEND}"
+    )
+    # Con più processi gli indici vengono creati da un solo worker
+    if BOOTSTRAP_INDEXES and worker_id == 0:
+        try:
+            report = db_loop.run(bootstrap_schema(User.repository, TempToken.repository))
+            for collection, indexes in report.items():
+                for name, status in indexes.items():
+                    logger.info(f"[SERVER] Indice {collection}.{name}: {status}")
+        except Exception as e:
+            logger.error(f"[SERVER] Creazione degli indici non riuscita: {e}")
+
+    # Con ritardo 0 il flag `logged` viene scritto prima di rispondere al client
+    if DEVICE_STATE_DELAY_MS > 0:
+        User.state_writer = DeviceStateWriter(
+            User.write_device_states, DEVICE_STATE_DELAY_MS / 1000, DEVICE_STATE_BATCH
+        )
+
+    try:
+        if MODE == "asyncio":
+            asyncio.run(
+                serve_async(HOST, PORT, MAX_FRAME_SIZE, HANDLER_WORKERS, reuse_port=workers > 1)
+            )
+        elif MODE == "threaded":
+            serve_threaded(HOST, PORT, MAX_FRAME_SIZE, reuse_port=workers > 1)
+        else:
+            logger.error(f"[SERVER] Modalità non supportata: {MODE}")
+            sys.exit(1)
+    finally:
+        if peers is not None:
+            peers.close()
+        # Un worker termina senza gli handler di uscita dell'interprete: il pool va
+        # chiuso qui, altrimenti i suoi processi restano in attesa
+        verification_executor.shutdown(wait=workers > 1)
+        if User.state_writer is not None:
+            User.state_writer.close()
+            logger.info(f"[SERVER] Stato dei dispositivi: {User.state_writer.stats()}")
+        db_loop.close()
+        logger.info(f"[SERVER] Cache utenti: {User.cache.stats()}")
+        logger.info(f"[SERVER] Connessioni registrate: {connections.stats()}")
+        logger.info(f"[SERVER] Handler: {dispatcher.stats()}")
+
+
+
+def precompute_groups(config: dict):
+    group_ids = [config.get("group_id", LEGACY_GROUP_ID)]
+    group_ids += [g for g in config.get("group_preference", DEFAULT_GROUP_PREFERENCE) if g in GROUPS]
+    for group_id in set(group_ids):
+        get_group(group_id).precompute(config.get("fixed_base_cache_dir"))
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(config: dict, worker_id: int, workers: int, socket_dir: str):
+    # SIGTERM dal supervisore: chiusura ordinata come con Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        serve(config, worker_id, workers, socket_dir)
+    except KeyboardInterrupt:
+        pass
+
+
+def supervise(config: dict, processes: int):
+    """
+    Modalità multiprocesso: avvia `processes` worker che ascoltano sulla stessa porta
+    con SO_REUSEPORT e riavvia quelli che terminano inaspettatamente.
+
+    Il kernel distribuisce le nuove connessioni tra i worker, e ogni connessione resta
+    sullo stesso processo per tutta la sua durata: cache, registro delle connessioni,
+    nonce e pool di verifica sono propri di ogni worker. Un abbinamento confermato su
+    un worker diverso da quello del secondo dispositivo passa dal canale locale tra i
+    worker; utenti e dispositivi devono invece stare su MongoDB per essere condivisi.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logger.error("[SERVER] SO_REUSEPORT non disponibile su questo sistema")
+        sys.exit(1)
+    if config.get("mode", "threaded") not in ("threaded", "asyncio"):
+        logger.error(f"[SERVER] Modalità non supportata: {config.get('mode')}")
+        sys.exit(1)
+    if processes > MAX_WORKERS:
+        logger.error(f"[SERVER] Al massimo {MAX_WORKERS} processi")
+        sys.exit(1)
+    if config.get("db_backend", MONGO_BACKEND) != MONGO_BACKEND:
+        # Ogni worker avrebbe i propri utenti: login e abbinamenti tra connessioni
+        # finite su worker diversi fallirebbero
+        logger.error('[SERVER] Con più processi serve "db_backend": "mongo"')
+        sys.exit(1)
+
+    # Costruite una sola volta ed ereditate dai worker con fork
+    precompute_groups(config)
+
+    socket_dir = tempfile.mkdtemp(prefix="schnorr-auth-")
+    context = multiprocessing.get_context("fork")
+
+    def start(worker_id: int):
+        process = context.Process(
+            target=run_worker,
+            args=(config, worker_id, processes, socket_dir),
+            name=f"worker-{worker_id}",
+        )
+        process.start()
+        return process
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    workers = {worker_id: start(worker_id) for worker_id in range(processes)}
+    logger.info(f"[SERVER] Supervisore avviato con {processes} processi worker")
+    try:
+        while True:
+            multiprocessing.connection.wait([p.sentinel for p in workers.values()])
+            for worker_id, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                logger.error(
+                    f"[SERVER] Worker {worker_id} terminato (codice {process.exitcode}), riavvio"
+                )
+                time.sleep(WORKER_RESTART_DELAY)
+                workers[worker_id] = start(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers.values():
+            if process.is_alive():
+                process.terminate()
+        for process in workers.values():
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+        logger.info("[SERVER] Supervisore terminato")
+
+
+def main():
+    with open("config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    PROCESSES = config.get("processes", 1)
+    if PROCESSES > 1:
+        supervise(config, PROCESSES)
+    else:
+        serve(config)
+
+
 if __name__ == "__main__":
     main()
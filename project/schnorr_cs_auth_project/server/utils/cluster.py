@@ -0,0 +1,151 @@
+import json
+import os
+import socket
+import threading
+from typing import Callable, Optional
+
+from utils.framing import FrameDecoder, RECV_BUFFER_SIZE, encode_frame
+from utils.logger import Logger
+
+# Numero massimo di processi worker: l'indice del worker occupa i primi 2 caratteri del token
+MAX_WORKERS = 256
+# Timeout (secondi) di una richiesta verso un altro worker
+DEFAULT_PEER_TIMEOUT = 5.0
+
+logger = Logger()
+
+
+class PeerError(Exception):
+    """Richiesta verso un altro processo worker non riuscita."""
+    pass
+
+
+class PeerChannel:
+    """
+    Canale locale tra i processi worker avviati dal supervisore, su socket Unix.
+
+    Ogni worker ascolta su `<socket_dir>/worker-<id>.sock` e risponde alle richieste
+    degli altri con `handler`, che riceve il messaggio e restituisce la risposta.
+    Messaggi e risposte sono oggetti JSON con lo stesso framing delle connessioni dei
+    client. Ogni richiesta usa una connessione propria: le operazioni tra worker
+    (abbinamenti, invalidazioni della cache) sono rare e nessuna resta in coda
+    dietro a un'altra più lenta.
+
+    I token di abbinamento emessi da un worker iniziano con il suo indice in
+    esadecimale, così che il worker che riceve la conferma sappia a chi inoltrarla.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        workers: int,
+        socket_dir: str,
+        handler: Callable[[dict], dict],
+        timeout: float = DEFAULT_PEER_TIMEOUT,
+    ):
+        if not 0 <= worker_id < workers <= MAX_WORKERS:
+            raise ValueError(f"Indice del worker non valido: {worker_id} su {workers}")
+        self.worker_id = worker_id
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.handler = handler
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+
+    def path(self, worker_id: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{worker_id}.sock")
+
+    # ---------- token ----------
+
+    def tag_token(self, token: str) -> str:
+        """Sostituisce i primi 2 caratteri del token con l'indice di questo worker."""
+        return f"{self.worker_id:02x}{token[2:]}"
+
+    def owner_of(self, token: str) -> Optional[int]:
+        """Worker che ha emesso il token, oppure None se il token non ne indica uno valido."""
+        try:
+            owner = int(token[:2], 16)
+        except ValueError:
+            return None
+        return owner if owner < self.workers else None
+
+    # ---------- server ----------
+
+    def start(self) -> None:
+        path = self.path(self.worker_id)
+        # Socket rimasto da un worker precedente con lo stesso indice
+        if os.path.exists(path):
+            os.unlink(path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen()
+        threading.Thread(target=self._accept_loop, name="peer-channel", daemon=True).start()
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        decoder = FrameDecoder()
+        with conn:
+            try:
+                while True:
+                    data = conn.recv(RECV_BUFFER_SIZE)
+                    if not data:
+                        return
+                    decoder.feed(data)
+                    for frame in decoder.frames():
+                        try:
+                            reply = self.handler(json.loads(frame))
+                        except Exception as e:
+                            logger.error(f"[SERVER] Richiesta di un altro worker fallita: {e}")
+                            reply = {"error": str(e)}
+                        conn.sendall(encode_frame(json.dumps(reply).encode()))
+            except OSError as e:
+                logger.error(f"[SERVER] Errore sul canale tra i worker: {e}")
+
+    # ---------- client ----------
+
+    def request(self, worker_id: int, op: str, **fields) -> dict:
+        """Invia l'operazione `op` al worker indicato e ne attende la risposta."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(self.timeout)
+                s.connect(self.path(worker_id))
+                s.sendall(encode_frame(json.dumps({"op": op, **fields}).encode()))
+                decoder = FrameDecoder()
+                while (frame := decoder.next_frame()) is None:
+                    data = s.recv(RECV_BUFFER_SIZE)
+                    if not data:
+                        raise PeerError(f"Worker {worker_id} disconnesso")
+                    decoder.feed(data)
+        except OSError as e:
+            raise PeerError(f"Worker {worker_id} non raggiungibile: {e}") from e
+
+        reply = json.loads(frame)
+        if "error" in reply:
+            raise PeerError(f"Worker {worker_id}: {reply['error']}")
+        return reply
+
+    def broadcast(self, op: str, **fields) -> None:
+        """Invia `op` a tutti gli altri worker, ignorando quelli che non rispondono."""
+        for worker_id in range(self.workers):
+            if worker_id == self.worker_id:
+                continue
+            try:
+                self.request(worker_id, op, **fields)
+            except PeerError as e:
+                logger.error(f"[SERVER] {e}")
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.path(self.worker_id))
+            except OSError:
+                pass
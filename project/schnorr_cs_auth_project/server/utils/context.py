@@ -1,35 +1,73 @@
-import json
+import asyncio
 import socket
 import datetime
+import threading
+from contextlib import contextmanager
 
 from typing import Optional, Any, Dict
 
+from utils.framing import (
+    DEFAULT_MAX_FRAME_SIZE,
+    HEADER,
+    HEADER_SIZE,
+    RECV_BUFFER_SIZE,
+    FrameDecoder,
+    FrameTooLargeError,
+    encode_frame,
+)
+from utils.group import Group, get_group
+from utils.groups import LEGACY_GROUP_ID
+from utils.logger import Logger
 from utils.message import ErrorType, MessageType
+from utils.wire import JSON_CODEC, MalformedMessageError, get_codec
 from dataclasses import dataclass
 
 from models.user import User
 
+logger = Logger()
+
+# Richiesta servita dal thread corrente, come (contesto, request_id): i messaggi inviati
+# a quel contesto durante l'handler riportano il request_id, quelli verso altre
+# connessioni (es. la conferma di un abbinamento) no
+_current_request = threading.local()
+
 
 @dataclass
 class SessionData:
     user: User = None
     logged_device: Optional[str] = None
     login_time: datetime.datetime = None
-    temp_pk: Optional[int] = None
+    temp_pk: Optional[Any] = None
     challenge: Optional[int] = None
+    key_id: Optional[str] = None
 
     def is_authenticated(self) -> bool:
         return self.user is not None
 
 
 class ConnContext:
-    MESSAGE_LENGTH = 4096
+    MESSAGE_LENGTH = RECV_BUFFER_SIZE
 
-    def __init__(self, conn: socket.socket, addr: str):
+    def __init__(
+        self,
+        conn: socket.socket,
+        addr: str,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+        group_id: str = LEGACY_GROUP_ID,
+    ):
         self.conn = conn
         self.addr = addr
         self.session = SessionData()
+        self.max_frame_size = max_frame_size
+        # Gruppo e codifica dei messaggi negoziati nell'handshake; sopravvivono al logout
+        self.group_id = group_id
+        self.codec = JSON_CODEC
         self._closed = False
+        self._close_callbacks = []
+        # Buffer di ricezione riutilizzato per tutta la vita della connessione
+        self._recv_buffer = bytearray(self.MESSAGE_LENGTH)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._decoder = FrameDecoder(max_frame_size)
 
     def close(self) -> None:
         """Chiude la connessione e pulisce i dati di sessione."""
@@ -42,8 +80,25 @@ class ConnContext:
         finally:
             self.clear_session()
             self._closed = True
+            self._run_close_callbacks()
             print(f"[SERVER] Connessione con {self.addr} chiusa.")
 
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def add_close_callback(self, callback) -> None:
+        """Registra una funzione da chiamare (una volta) alla chiusura della connessione."""
+        self._close_callbacks.append(callback)
+
+    def _run_close_callbacks(self) -> None:
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[SERVER] Errore nella pulizia della connessione {self.addr}: {e}")
+
     def update_session(self, **kwargs):
         for key, value in kwargs.items():
             if hasattr(self.session, key):
@@ -56,35 +111,79 @@ class ConnContext:
     def clear_session(self):
         self.session = SessionData()  # reset
 
+    @property
+    def group(self) -> Group:
+        """Gruppo negoziato per questa connessione."""
+        return get_group(self.group_id)
+
+    def set_encoding(self, encoding: str) -> None:
+        """Usa `encoding` per i messaggi successivi, nel gruppo già negoziato."""
+        self.codec = get_codec(encoding, self.group)
+
     @property
     def is_session_empty(self) -> bool:
         return not self.session.is_authenticated()
 
-    def _send_json(self, message: Dict[str, Any]) -> bool:
-        """Invia un messaggio JSON al client."""
+    @contextmanager
+    def request(self, request_id: int):
+        """Le risposte inviate a questo contesto dal thread corrente riportano `request_id`."""
+        previous = getattr(_current_request, "scope", None)
+        _current_request.scope = (self, request_id)
+        try:
+            yield
+        finally:
+            _current_request.scope = previous
+
+    def _encode(
+        self, msg_type: MessageType, fields: Optional[Dict[str, Any]]
+    ) -> Optional[bytes]:
+        """Codifica il messaggio e lo incapsula in un frame; None se non è inviabile."""
+        scope = getattr(_current_request, "scope", None)
+        if scope is not None and scope[0] is self:
+            fields = {**fields, "request_id": scope[1]} if fields else {"request_id": scope[1]}
+        try:
+            return encode_frame(self.codec.encode(msg_type, fields), self.max_frame_size)
+        except FrameTooLargeError as e:
+            print(f"[SERVER] Errore: messaggio per {self.addr} troppo grande ({e})")
+        except ValueError as e:
+            print(f"[SERVER] Errore: messaggio {msg_type} per {self.addr} non valido ({e})")
+        return None
+
+    def _send(self, msg_type: MessageType, fields: Optional[Dict[str, Any]] = None) -> bool:
+        """Invia un messaggio al client nella codifica della connessione."""
         if self._closed:
             print(f"[SERVER] Tentativo di invio a {self.addr}, ma connessione già chiusa.")
             return False
+        frame = self._encode(msg_type, fields)
+        if frame is None:
+            return False
         try:
-            self.conn.sendall(json.dumps(message).encode())
+            self.conn.sendall(frame)
             return True
         except (BrokenPipeError, ConnectionResetError):
             print(f"[SERVER] Errore: connessione chiusa dal client {self.addr} durante l'invio")
             self.close()
             return False
 
-    def receive_json(self) -> Optional[Dict[str, Any]]:
-        """Riceve un messaggio JSON dal client."""
+    def receive_message(self) -> Optional[Dict[str, Any]]:
+        """Riceve e decodifica il prossimo messaggio del client, riassemblando i frame."""
         if self._closed:
             return None
         try:
-            data = self.conn.recv(self.MESSAGE_LENGTH)
-            if not data:
-                self.close()
-                return None
-            return json.loads(data.decode())
-        except json.JSONDecodeError:
-            print(f"[SERVER] Errore: messaggio JSON non valido da {self.addr}")
+            while (frame := self._decoder.next_frame()) is None:
+                n = self.conn.recv_into(self._recv_view)
+                if not n:
+                    self.close()
+                    return None
+                self._decoder.feed(self._recv_view[:n])
+            return self.codec.decode(frame)
+        except MalformedMessageError as e:
+            print(f"[SERVER] Errore: {e} da {self.addr}")
+            return None
+        except FrameTooLargeError as e:
+            # Lo stream non è più sincronizzabile: la connessione va chiusa
+            print(f"[SERVER] Errore: {e} da {self.addr}")
+            self.close()
             return None
         except ConnectionResetError:
             self.close()
@@ -94,23 +193,103 @@ class ConnContext:
         self, msg_type: MessageType, extra_data: Optional[Dict[str, Any]] = None
     ) -> bool:
         """Invia un messaggio standard al client."""
-        payload = {
-            "type_code": msg_type.code,
-            "type": msg_type.label,
-        }
-        if extra_data:
-            payload.update(extra_data)
-        return self._send_json(payload)
+        return self._send(msg_type, extra_data)
 
     def send_error(self, error_type: ErrorType, details: Optional[str] = None) -> bool:
         """Invia un messaggio di errore al client."""
         payload = {
-            "type_code": MessageType.ERROR.code,
-            "type": MessageType.ERROR.label,
             "error_code": error_type.code,
             "error": error_type.label,
             "message": error_type.message(),
         }
         if details:
             payload["details"] = details
-        return self._send_json(payload)
+        return self._send(MessageType.ERROR, payload)
+
+
+class AsyncConnContext(ConnContext):
+    """
+    Contesto di connessione per la modalità asyncio.
+
+    La ricezione avviene sull'event loop tramite `receive_message_async`, mentre gli
+    handler girano in un thread pool: gli invii vengono quindi rimandati al loop
+    con `call_soon_threadsafe`, così da poter essere effettuati da qualunque thread.
+    Il buffer di scrittura viene svuotato da `async_client_handler` (`drain`) prima
+    di leggere il messaggio successivo.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        loop: asyncio.AbstractEventLoop,
+        max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+        group_id: str = LEGACY_GROUP_ID,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.conn = None
+        self.addr = writer.get_extra_info("peername")
+        self.session = SessionData()
+        self.max_frame_size = max_frame_size
+        self.group_id = group_id
+        self.codec = JSON_CODEC
+        self._closed = False
+        self._close_callbacks = []
+
+    def close(self) -> None:
+        """Chiude la connessione e pulisce i dati di sessione."""
+        if self._closed:
+            return
+        self._closed = True
+        self.clear_session()
+        self._run_close_callbacks()
+        try:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        except RuntimeError as e:
+            # Event loop già chiuso
+            logger.error(f"[SERVER] Errore durante la chiusura di {self.addr}: {e}")
+        logger.info(f"[SERVER] Connessione con {self.addr} chiusa.")
+
+    def _send(self, msg_type: MessageType, fields: Optional[Dict[str, Any]] = None) -> bool:
+        """Accoda un messaggio verso il client sull'event loop."""
+        if self._closed:
+            logger.warning(
+                f"[SERVER] Tentativo di invio a {self.addr}, ma connessione già chiusa."
+            )
+            return False
+        frame = self._encode(msg_type, fields)
+        if frame is None:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.writer.write, frame)
+            return True
+        except RuntimeError:
+            self._closed = True
+            return False
+
+    def receive_message(self) -> Optional[Dict[str, Any]]:
+        raise RuntimeError("In modalità asyncio usare receive_message_async()")
+
+    async def receive_message_async(self) -> Optional[Dict[str, Any]]:
+        """Riceve il prossimo messaggio del client senza bloccare l'event loop."""
+        if self._closed:
+            return None
+        try:
+            (length,) = HEADER.unpack(await self.reader.readexactly(HEADER_SIZE))
+            if length > self.max_frame_size:
+                raise FrameTooLargeError(
+                    f"Frame di {length} byte oltre il limite di {self.max_frame_size}"
+                )
+            return self.codec.decode(await self.reader.readexactly(length))
+        except MalformedMessageError as e:
+            logger.error(f"[SERVER] Errore: {e} da {self.addr}")
+            return None
+        except FrameTooLargeError as e:
+            logger.error(f"[SERVER] Errore: {e} da {self.addr}")
+            self.close()
+            return None
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            self.close()
+            return None
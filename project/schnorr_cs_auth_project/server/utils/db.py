@@ -1,4 +1,80 @@
-from pymongo import MongoClient
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["schnorr_auth_app"]
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+
+DEFAULT_MONGO_URI = "mongodb://localhost:27017/"
+DEFAULT_DB_NAME = "schnorr_auth_app"
+# Connessioni massime del pool verso MongoDB
+DEFAULT_POOL_SIZE = 100
+# Timeout (ms) per la selezione del server, la connessione, le operazioni e l'attesa
+# di una connessione libera nel pool
+DEFAULT_TIMEOUT_MS = 5000
+
+
+def create_database(
+    uri: str = DEFAULT_MONGO_URI,
+    name: str = DEFAULT_DB_NAME,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout_ms: int = DEFAULT_TIMEOUT_MS,
+) -> AsyncDatabase:
+    """Crea il client asincrono di MongoDB; la connessione avviene al primo utilizzo."""
+    client = AsyncMongoClient(
+        uri,
+        maxPoolSize=pool_size,
+        serverSelectionTimeoutMS=timeout_ms,
+        connectTimeoutMS=timeout_ms,
+        socketTimeoutMS=timeout_ms,
+        waitQueueTimeoutMS=timeout_ms,
+        tz_aware=True,
+    )
+    return client[name]
+
+
+class DatabaseLoop:
+    """
+    Event loop dedicato agli accessi al database, in un thread avviato al primo utilizzo.
+
+    Il client asincrono resta legato a questo loop: gli handler sincroni usano `run`,
+    il codice che gira in un altro event loop usa `call` senza bloccarlo.
+    """
+
+    def __init__(self, timeout: Optional[float] = DEFAULT_TIMEOUT_MS / 1000):
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever, name="db-loop", daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro: Awaitable[Any]):
+        """Esegue `coro` nel loop del database e restituisce un concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        """Esegue `coro` nel loop del database e ne attende il risultato dal thread chiamante."""
+        return self.submit(coro).result(self.timeout)
+
+    async def call(self, coro: Awaitable[Any]) -> Any:
+        """Come `run`, ma da un altro event loop e senza bloccarlo."""
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(coro)), self.timeout)
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+# Database con le impostazioni di default, sostituito in main() secondo la configurazione
+db = create_database()
+db_loop = DatabaseLoop()
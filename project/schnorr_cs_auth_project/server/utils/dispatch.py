@@ -0,0 +1,138 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from utils.exceptions import ValidationError
+from utils.logger import Logger
+from utils.message import ErrorType, MessageType
+from utils.schema import CompiledSchema, compile_schema
+from utils.wire import is_request_id
+
+logger = Logger()
+
+Handler = Callable[[Any, dict], None]
+
+
+class _Route:
+    """Handler di un tipo di messaggio, con il suo schema e le sue statistiche."""
+
+    __slots__ = (
+        "msg_type", "handler", "schema", "lock", "calls", "invalid", "errors", "total", "max"
+    )
+
+    def __init__(self, msg_type: MessageType, handler: Handler, schema: CompiledSchema):
+        self.msg_type = msg_type
+        self.handler = handler
+        self.schema = schema
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.invalid = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float, failed: bool) -> None:
+        with self.lock:
+            self.calls += 1
+            self.errors += failed
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+
+
+class MessageDispatcher:
+    """
+    Tabella dei gestori dei messaggi indicizzata per `type_code`.
+
+    Ogni tipo di messaggio viene registrato una volta sola con il suo handler; lo
+    schema dei campi (utils.schema) è compilato al momento della registrazione. La ricerca
+    dell'handler è un accesso a dizionario, indipendente dal numero di tipi gestiti.
+    I messaggi che non rispettano lo schema ricevono MALFORMED_MESSAGE senza arrivare
+    all'handler. Per ogni handler vengono contati chiamate, messaggi scartati ed
+    eccezioni, insieme al tempo di esecuzione medio e massimo.
+
+    Se il messaggio ha un `request_id`, tutte le risposte dell'handler alla stessa
+    connessione lo riportano: un client può così avere più richieste in corso sulla
+    stessa connessione e riconoscere a quale si riferisce ogni risposta.
+
+    Con `debug` gli errori di validazione vengono anche registrati nel log.
+    """
+
+    def __init__(self, debug: bool = False):
+        self.debug = debug
+        self._routes: Dict[int, _Route] = {}
+        self._by_label: Dict[str, _Route] = {}
+        self._unknown = 0
+        self._unknown_lock = threading.Lock()
+
+    def register(self, msg_type: MessageType, handler: Handler):
+        if msg_type.code in self._routes:
+            raise ValueError(f"Handler già registrato per {msg_type}")
+        route = _Route(msg_type, handler, compile_schema(msg_type))
+        self._routes[msg_type.code] = route
+        self._by_label[msg_type.label] = route
+
+    def _route(self, msg) -> Optional[_Route]:
+        if not isinstance(msg, dict):
+            return None
+        code = msg.get("type_code")
+        if isinstance(code, int):
+            return self._routes.get(code)
+        # Client che indicano solo l'etichetta del tipo
+        label = msg.get("type")
+        return self._by_label.get(label) if isinstance(label, str) else None
+
+    def dispatch(self, ctx, msg: dict) -> None:
+        route = self._route(msg)
+        if route is None:
+            with self._unknown_lock:
+                self._unknown += 1
+            logger.info(
+                f"[SERVER] Tipo messaggio sconosciuto: "
+                f"{msg.get('type') if isinstance(msg, dict) else type(msg).__name__}"
+            )
+            return
+
+        request_id = msg.get("request_id")
+        if is_request_id(request_id):
+            with ctx.request(request_id):
+                self._handle(ctx, route, msg)
+        else:
+            self._handle(ctx, route, msg)
+
+    def _handle(self, ctx, route: _Route, msg: dict) -> None:
+        try:
+            route.schema.validate(msg, ctx.group)
+        except ValidationError as e:
+            with route.lock:
+                route.invalid += 1
+            ctx.send_error(ErrorType.MALFORMED_MESSAGE)
+            if self.debug:
+                logger.debug(f"[SERVER] Errore di validazione ({route.msg_type}): {e}")
+            return
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            route.handler(ctx, msg)
+            failed = False
+        finally:
+            route.record(time.perf_counter() - start, failed)
+
+    def stats(self) -> dict:
+        """Chiamate, messaggi scartati, eccezioni e tempi (ms) per tipo di messaggio."""
+        result = {}
+        for route in self._routes.values():
+            with route.lock:
+                if not route.calls and not route.invalid:
+                    continue
+                result[route.msg_type.label] = {
+                    "calls": route.calls,
+                    "invalid": route.invalid,
+                    "errors": route.errors,
+                    "mean_ms": round(route.total / route.calls * 1e3, 3) if route.calls else 0.0,
+                    "max_ms": round(route.max * 1e3, 3),
+                }
+        if self._unknown:
+            result["unknown"] = self._unknown
+        return result
@@ -0,0 +1,426 @@
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from utils.fixed_base import DEFAULT_WINDOW, FixedBaseExp, get_fixed_base
+from utils.groups import GROUPS
+from utils.multiexp import multi_exp
+
+
+class Group(ABC):
+    """
+    Gruppo ciclico di ordine primo q usato dal protocollo di Schnorr.
+
+    Le operazioni sono scritte in notazione moltiplicativa (g^x, a * b) anche per le
+    curve ellittiche, dove corrispondono a x * G e A + B. Gli elementi viaggiano sul
+    canale come stringhe esadecimali prodotte da `encode`; nella codifica binaria dei
+    messaggi occupano invece `element_size` byte (`to_wire`/`from_wire`).
+    """
+
+    # True se ogni elemento restituito da `decode` appartiene al sottogruppo di ordine
+    # primo q: solo in questo caso la verifica a lotti con combinazione lineare casuale
+    # equivale a verificare le prove una per una.
+    batchable = False
+
+    # Byte di un elemento nella codifica binaria dei messaggi
+    element_size = 0
+
+    def __init__(self, group_id: str, q: int):
+        self.group_id = group_id
+        self.q = q
+        # Byte di un esponente (sfida, risposta) nella codifica binaria dei messaggi
+        self.scalar_size = (q.bit_length() + 7) // 8
+
+    @property
+    @abstractmethod
+    def generator(self) -> Any:
+        ...
+
+    @property
+    @abstractmethod
+    def identity(self) -> Any:
+        ...
+
+    @abstractmethod
+    def base_exp(self, x: int) -> Any:
+        """g^x, con eventuali tabelle precalcolate per il generatore."""
+
+    @abstractmethod
+    def exp(self, a: Any, x: int) -> Any:
+        """a^x per un elemento qualsiasi."""
+
+    @abstractmethod
+    def mul(self, a: Any, b: Any) -> Any:
+        ...
+
+    @abstractmethod
+    def inverse(self, a: Any) -> Any:
+        ...
+
+    @abstractmethod
+    def multi_exp(self, pairs: Sequence[Tuple[Any, int]]) -> Any:
+        """prod(a_i ^ x_i) calcolato con quadrati (raddoppi) condivisi."""
+
+    @abstractmethod
+    def encode(self, a: Any) -> str:
+        ...
+
+    @abstractmethod
+    def decode(self, data: Union[str, bytes]) -> Any:
+        """
+        Decodifica un elemento, in forma testuale o nei byte di `to_wire`; solleva
+        ValueError se non appartiene al gruppo.
+        """
+
+    @abstractmethod
+    def to_wire(self, data: str) -> bytes:
+        """Converte un elemento codificato con `encode` nei suoi `element_size` byte."""
+
+    @abstractmethod
+    def from_wire(self, raw: bytes) -> str:
+        """Inverso di `to_wire`: restituisce la stessa stringa prodotta da `encode`."""
+
+    @abstractmethod
+    def fixed_base(self, a: Any, window: int = DEFAULT_WINDOW) -> Any:
+        """Tabella per esponenziazioni ripetute di `a`: l'oggetto restituito ha `pow(x)`."""
+
+    def precompute(self, cache_dir: Optional[Path] = None) -> None:
+        """Prepara le tabelle per `base_exp`, eventualmente leggendole da `cache_dir`."""
+
+
+class ModPGroup(Group):
+    """Sottogruppo di ordine q di Z_p^*, generato da g."""
+
+    def __init__(self, group_id: str, p: int, q: int, g: int):
+        super().__init__(group_id, q)
+        self.p = p
+        self.g = g
+        self.element_size = (p.bit_length() + 7) // 8
+
+    @property
+    def generator(self) -> int:
+        return self.g
+
+    @property
+    def identity(self) -> int:
+        return 1
+
+    def precompute(self, cache_dir: Optional[Path] = None) -> None:
+        get_fixed_base(
+            self.g,
+            self.p,
+            max_bits=self.q.bit_length(),
+            window=DEFAULT_WINDOW,
+            cache_path=(
+                Path(cache_dir) / f"fixed_base_{self.group_id}.bin" if cache_dir else None
+            ),
+        )
+
+    def base_exp(self, x: int) -> int:
+        return get_fixed_base(self.g, self.p, max_bits=self.q.bit_length()).pow(x)
+
+    def exp(self, a: int, x: int) -> int:
+        return pow(a, x, self.p)
+
+    def mul(self, a: int, b: int) -> int:
+        return a * b % self.p
+
+    def inverse(self, a: int) -> int:
+        return pow(a, -1, self.p)
+
+    def multi_exp(self, pairs: Sequence[Tuple[int, int]]) -> int:
+        return multi_exp(pairs, self.p)
+
+    def fixed_base(self, a: int, window: int = DEFAULT_WINDOW) -> FixedBaseExp:
+        return FixedBaseExp(a, self.p, max_bits=self.q.bit_length(), window=window).build()
+
+    def encode(self, a: int) -> str:
+        return hex(a)
+
+    def decode(self, data: Union[str, bytes]) -> int:
+        if isinstance(data, bytes):
+            if len(data) != self.element_size:
+                raise ValueError("Elemento di lunghezza non valida")
+            a = int.from_bytes(data, "big")
+        else:
+            a = int(data, 16)
+        if not 0 < a < self.p:
+            raise ValueError("Elemento fuori dall'intervallo (0, p)")
+        return a
+
+    def to_wire(self, data: str) -> bytes:
+        try:
+            return int(data, 16).to_bytes(self.element_size, "big")
+        except OverflowError:
+            raise ValueError("Elemento fuori dall'intervallo (0, p)") from None
+
+    def from_wire(self, raw: bytes) -> str:
+        return hex(int.from_bytes(raw, "big"))
+
+
+# Punto in coordinate affini (x, y); None rappresenta il punto all'infinito
+Point = Optional[Tuple[int, int]]
+# Punto in coordinate jacobiane (X, Y, Z), con x = X / Z^2 e y = Y / Z^3
+JacobianPoint = Optional[Tuple[int, int, int]]
+
+
+class ECGroup(Group):
+    """
+    Curva ellittica in forma di Weierstrass corta y^2 = x^3 + ax + b su F_p, con
+    punto base G di ordine primo q.
+
+    I calcoli interni avvengono in coordinate jacobiane per evitare un'inversione
+    modulare a ogni somma; gli elementi restituiti sono sempre in forma affine.
+    I punti sono codificati in forma compressa (SEC 1): 02/03 seguito da x.
+    Con cofattore 1 ogni punto della curva appartiene al gruppo generato da G.
+    """
+
+    batchable = True
+
+    def __init__(
+        self, group_id: str, p: int, a: int, b: int, gx: int, gy: int, q: int,
+        window: int = DEFAULT_WINDOW,
+    ):
+        super().__init__(group_id, q)
+        if p % 4 != 3:
+            raise ValueError("La decompressione dei punti richiede p = 3 (mod 4)")
+        self.p = p
+        self.a = a
+        self.b = b
+        self.g = (gx, gy)
+        self.window = window
+        self.size = (p.bit_length() + 7) // 8
+        self.element_size = self.size + 1
+        self._base: Optional[ECFixedBase] = None
+        self._base_lock = threading.Lock()
+
+    @property
+    def generator(self) -> Point:
+        return self.g
+
+    @property
+    def identity(self) -> Point:
+        return None
+
+    # ---------- aritmetica in coordinate jacobiane ----------
+
+    def _to_jacobian(self, P: Point) -> JacobianPoint:
+        return None if P is None else (P[0], P[1], 1)
+
+    def _to_affine(self, P: JacobianPoint) -> Point:
+        if P is None:
+            return None
+        X, Y, Z = P
+        p = self.p
+        z_inv = pow(Z, -1, p)
+        z_inv2 = z_inv * z_inv % p
+        return (X * z_inv2 % p, Y * z_inv2 * z_inv % p)
+
+    def _double(self, P: JacobianPoint) -> JacobianPoint:
+        if P is None:
+            return None
+        X, Y, Z = P
+        if Y == 0:
+            return None
+        p = self.p
+        YY = Y * Y % p
+        S = 4 * X * YY % p
+        M = 3 * X * X
+        if self.a:
+            ZZ = Z * Z % p
+            M += self.a * ZZ * ZZ
+        M %= p
+        X3 = (M * M - 2 * S) % p
+        Y3 = (M * (S - X3) - 8 * YY * YY) % p
+        Z3 = 2 * Y * Z % p
+        return (X3, Y3, Z3)
+
+    def _add(self, P: JacobianPoint, Q: JacobianPoint) -> JacobianPoint:
+        if P is None:
+            return Q
+        if Q is None:
+            return P
+        p = self.p
+        X1, Y1, Z1 = P
+        X2, Y2, Z2 = Q
+        Z1Z1 = Z1 * Z1 % p
+        Z2Z2 = Z2 * Z2 % p
+        U1 = X1 * Z2Z2 % p
+        U2 = X2 * Z1Z1 % p
+        S1 = Y1 * Z2 * Z2Z2 % p
+        S2 = Y2 * Z1 * Z1Z1 % p
+        if U1 == U2:
+            return self._double(P) if S1 == S2 else None
+        H = (U2 - U1) % p
+        R = (S2 - S1) % p
+        HH = H * H % p
+        HHH = H * HH % p
+        V = U1 * HH % p
+        X3 = (R * R - HHH - 2 * V) % p
+        Y3 = (R * (V - X3) - S1 * HHH) % p
+        Z3 = H * Z1 * Z2 % p
+        return (X3, Y3, Z3)
+
+    def _multiples(self, P: JacobianPoint, count: int) -> List[JacobianPoint]:
+        """[O, P, 2P, ..., (count - 1)P]."""
+        row = [None] * count
+        acc = None
+        for d in range(1, count):
+            acc = self._add(acc, P)
+            row[d] = acc
+        return row
+
+    def _straus(self, pairs: Sequence[Tuple[JacobianPoint, int]], window: int = 4) -> JacobianPoint:
+        mask = (1 << window) - 1
+        tables = [self._multiples(P, 1 << window) for P, _ in pairs]
+        bits = max((k.bit_length() for _, k in pairs), default=0)
+        R = None
+        for i in range(-(-bits // window) - 1, -1, -1):
+            if R is not None:
+                for _ in range(window):
+                    R = self._double(R)
+            shift = i * window
+            for (_, k), row in zip(pairs, tables):
+                d = (k >> shift) & mask
+                if d:
+                    R = self._add(R, row[d])
+        return R
+
+    # ---------- interfaccia Group ----------
+
+    def precompute(self, cache_dir: Optional[Path] = None) -> None:
+        with self._base_lock:
+            if self._base is None:
+                self._base = self.fixed_base(self.g, self.window)
+
+    def base_exp(self, x: int) -> Point:
+        if self._base is None:
+            self.precompute()
+        return self._base.pow(x)
+
+    def exp(self, a: Point, x: int) -> Point:
+        return self._to_affine(self._straus([(self._to_jacobian(a), x % self.q)]))
+
+    def mul(self, a: Point, b: Point) -> Point:
+        return self._to_affine(self._add(self._to_jacobian(a), self._to_jacobian(b)))
+
+    def inverse(self, a: Point) -> Point:
+        if a is None:
+            return None
+        return (a[0], (-a[1]) % self.p)
+
+    def multi_exp(self, pairs: Sequence[Tuple[Point, int]]) -> Point:
+        return self._to_affine(
+            self._straus([(self._to_jacobian(a), x % self.q) for a, x in pairs])
+        )
+
+    def fixed_base(self, a: Point, window: int = DEFAULT_WINDOW) -> "ECFixedBase":
+        return ECFixedBase(self, a, window)
+
+    def is_on_curve(self, a: Point) -> bool:
+        if a is None:
+            return False
+        x, y = a
+        p = self.p
+        return (y * y - (x * x * x + self.a * x + self.b)) % p == 0
+
+    def encode(self, a: Point) -> str:
+        if a is None:
+            raise ValueError("Il punto all'infinito non è codificabile")
+        x, y = a
+        prefix = b"\x03" if y & 1 else b"\x02"
+        return (prefix + x.to_bytes(self.size, "big")).hex()
+
+    def decode(self, data: Union[str, bytes]) -> Point:
+        if isinstance(data, bytes):
+            raw = data
+        else:
+            raw = bytes.fromhex(data[2:] if data.startswith("0x") else data)
+        if len(raw) != self.size + 1 or raw[0] not in (2, 3):
+            raise ValueError("Codifica compressa del punto non valida")
+        x = int.from_bytes(raw[1:], "big")
+        p = self.p
+        if x >= p:
+            raise ValueError("Coordinata x fuori dal campo")
+        rhs = (x * x * x + self.a * x + self.b) % p
+        y = pow(rhs, (p + 1) // 4, p)
+        if y * y % p != rhs:
+            raise ValueError("Il punto non appartiene alla curva")
+        if (y & 1) != (raw[0] & 1):
+            y = p - y
+        return (x, y)
+
+    def to_wire(self, data: str) -> bytes:
+        raw = bytes.fromhex(data[2:] if data.startswith("0x") else data)
+        if len(raw) != self.element_size:
+            raise ValueError("Codifica compressa del punto non valida")
+        return raw
+
+    def from_wire(self, raw: bytes) -> str:
+        return raw.hex()
+
+
+class ECFixedBase:
+    """Tabella d * 2^(window * i) * P per ogni finestra i e cifra d, come `FixedBaseExp`."""
+
+    def __init__(self, group: ECGroup, P: Point, window: int = DEFAULT_WINDOW):
+        self.group = group
+        self.window = window
+        table = []
+        base = group._to_jacobian(P)
+        for _ in range(-(-group.q.bit_length() // window)):
+            row = group._multiples(base, 1 << window)
+            table.append(row)
+            base = group._add(row[-1], base)
+        self._table: List[List[JacobianPoint]] = table
+
+    def pow(self, x: int) -> Point:
+        group = self.group
+        x %= group.q
+        mask = (1 << self.window) - 1
+        R = None
+        for row in self._table:
+            if not x:
+                break
+            d = x & mask
+            if d:
+                R = group._add(R, row[d])
+            x >>= self.window
+        return group._to_affine(R)
+
+
+# Caratteri esadecimali dell'identificativo di una chiave (64 bit)
+KEY_ID_LENGTH = 16
+
+
+def key_fingerprint(pk: str) -> str:
+    """Identificativo breve di una chiave pubblica codificata, inviato per indicare il dispositivo."""
+    return hashlib.sha256(pk.encode()).hexdigest()[:KEY_ID_LENGTH]
+
+
+_groups: Dict[str, Group] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(group_id: str) -> Group:
+    """Restituisce l'implementazione del gruppo `group_id`, una sola istanza per processo."""
+    group = _groups.get(group_id)
+    if group is not None:
+        return group
+
+    with _groups_lock:
+        group = _groups.get(group_id)
+        if group is None:
+            params = GROUPS[group_id]
+            if params.get("type") == "ec":
+                group = ECGroup(
+                    group_id,
+                    params["p"], params["a"], params["b"],
+                    params["gx"], params["gy"], params["q"],
+                )
+            else:
+                group = ModPGroup(group_id, params["p"], params["q"], params["g"])
+            _groups[group_id] = group
+        return group
@@ -0,0 +1,41 @@
+from typing import List, Sequence, Tuple
+
+DEFAULT_WINDOW = 4
+
+
+def multi_exp(pairs: Sequence[Tuple[int, int]], p: int, window: int = DEFAULT_WINDOW) -> int:
+    """
+    Calcola prod(b_i ^ e_i) mod p con il metodo di Straus (Shamir generalizzato).
+
+    Gli esponenti vengono scanditi insieme a finestre di `window` bit: i quadrati sono
+    condivisi tra tutte le basi, quindi k esponenziazioni costano circa quanto una sola
+    più bits/window moltiplicazioni per base.
+    """
+    if not pairs:
+        return 1 % p
+    if any(e < 0 for _, e in pairs):
+        raise ValueError("Gli esponenti devono essere non negativi")
+
+    mask = (1 << window) - 1
+    tables: List[List[int]] = []
+    for base, _ in pairs:
+        row = [1] * (1 << window)
+        acc = 1
+        base %= p
+        for d in range(1, 1 << window):
+            acc = acc * base % p
+            row[d] = acc
+        tables.append(row)
+
+    bits = max(e.bit_length() for _, e in pairs)
+    result = 1
+    for i in range(-(-bits // window) - 1, -1, -1):
+        if result != 1:
+            for _ in range(window):
+                result = result * result % p
+        shift = i * window
+        for (_, e), row in zip(pairs, tables):
+            d = (e >> shift) & mask
+            if d:
+                result = result * row[d] % p
+    return result
@@ -0,0 +1,169 @@
+import threading
+from typing import Any, Dict, List, Optional
+
+# Numero di partizioni (potenza di 2): ogni partizione ha il proprio lock
+DEFAULT_STRIPES = 64
+
+
+class _Stripe:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: Dict[Any, Any] = {}
+
+
+class _Owned:
+    """Voci registrate da una connessione, per rimuoverle in O(1) alla chiusura."""
+
+    __slots__ = ("token", "user_id")
+
+    def __init__(self):
+        self.token: Optional[str] = None
+        self.user_id: Optional[str] = None
+
+
+class ConnectionRegistry:
+    """
+    Registro delle connessioni attive, indicizzato per token di abbinamento, utente e
+    dispositivo.
+
+    Ogni indice è diviso in partizioni con un lock ciascuna, scelte in base all'hash
+    della chiave: gli aggiornamenti su chiavi diverse raramente si contendono lo stesso
+    lock e le letture di una singola chiave non ne prendono nessuno. Ogni connessione
+    ha al più un token e un utente: il token precedente viene sostituito e tutte le voci
+    vengono rimosse quando la connessione si chiude, quindi il registro non cresce oltre
+    il numero di connessioni aperte.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        if stripes <= 0 or stripes & (stripes - 1):
+            raise ValueError("Il numero di partizioni deve essere una potenza di 2")
+        self._mask = stripes - 1
+        self._tokens = [_Stripe() for _ in range(stripes)]
+        self._users = [_Stripe() for _ in range(stripes)]
+        self._owners = [_Stripe() for _ in range(stripes)]
+
+    def _stripe(self, index: List[_Stripe], key: Any) -> _Stripe:
+        return index[hash(key) & self._mask]
+
+    def _owned(self, ctx) -> _Owned:
+        """Voci della connessione; alla prima registrazione aggancia la pulizia alla chiusura."""
+        stripe = self._stripe(self._owners, id(ctx))
+        with stripe.lock:
+            owned = stripe.entries.get(id(ctx))
+            if owned is not None:
+                return owned
+            owned = stripe.entries[id(ctx)] = _Owned()
+        ctx.add_close_callback(lambda: self.remove(ctx))
+        return owned
+
+    # ---------- token di abbinamento ----------
+
+    def register_token(self, token: str, ctx) -> None:
+        """Associa `token` alla connessione, sostituendo un suo eventuale token precedente."""
+        owned = self._owned(ctx)
+        previous, owned.token = owned.token, token
+        if previous is not None:
+            self._discard_token(previous, ctx)
+
+        stripe = self._stripe(self._tokens, token)
+        with stripe.lock:
+            stripe.entries[token] = ctx
+
+        # La connessione potrebbe essersi chiusa durante la registrazione
+        if ctx.is_closed:
+            self._discard_token(token, ctx)
+            self.remove(ctx)
+
+    def get_token(self, token: str):
+        return self._stripe(self._tokens, token).entries.get(token)
+
+    def pop_token(self, token: str):
+        """Rimuove il token (monouso) e restituisce la connessione che l'ha richiesto."""
+        stripe = self._stripe(self._tokens, token)
+        with stripe.lock:
+            ctx = stripe.entries.pop(token, None)
+        if ctx is not None:
+            owned = self._stripe(self._owners, id(ctx)).entries.get(id(ctx))
+            if owned is not None and owned.token == token:
+                owned.token = None
+        return ctx
+
+    def _discard_token(self, token: str, ctx) -> None:
+        stripe = self._stripe(self._tokens, token)
+        with stripe.lock:
+            if stripe.entries.get(token) is ctx:
+                del stripe.entries[token]
+
+    # ---------- utenti e dispositivi ----------
+
+    def bind_user(self, ctx, user_id: str, device_name: str) -> None:
+        """Registra la connessione come sessione di `device_name` dell'utente `user_id`."""
+        owned = self._owned(ctx)
+        previous, owned.user_id = owned.user_id, user_id
+        if previous is not None and previous != user_id:
+            self._discard_user(previous, ctx)
+
+        stripe = self._stripe(self._users, user_id)
+        with stripe.lock:
+            connections = stripe.entries.get(user_id)
+            # Copia in scrittura: le letture senza lock vedono sempre un dizionario completo
+            connections = dict(connections) if connections else {}
+            connections[ctx] = device_name
+            stripe.entries[user_id] = connections
+
+        if ctx.is_closed:
+            self._discard_user(user_id, ctx)
+            self.remove(ctx)
+
+    def unbind_user(self, ctx) -> None:
+        owned = self._stripe(self._owners, id(ctx)).entries.get(id(ctx))
+        if owned is None or owned.user_id is None:
+            return
+        user_id, owned.user_id = owned.user_id, None
+        self._discard_user(user_id, ctx)
+
+    def _discard_user(self, user_id: str, ctx) -> None:
+        stripe = self._stripe(self._users, user_id)
+        with stripe.lock:
+            connections = stripe.entries.get(user_id)
+            if not connections or ctx not in connections:
+                return
+            connections = dict(connections)
+            del connections[ctx]
+            if connections:
+                stripe.entries[user_id] = connections
+            else:
+                del stripe.entries[user_id]
+
+    def connections_of(self, user_id: str) -> Dict[Any, str]:
+        """Connessioni autenticate dell'utente: contesto -> nome del dispositivo."""
+        return self._stripe(self._users, user_id).entries.get(user_id) or {}
+
+    def device_connection(self, user_id: str, device_name: str):
+        for ctx, name in self.connections_of(user_id).items():
+            if name == device_name:
+                return ctx
+        return None
+
+    # ---------- chiusura ----------
+
+    def remove(self, ctx) -> None:
+        """Rimuove tutte le voci della connessione."""
+        stripe = self._stripe(self._owners, id(ctx))
+        with stripe.lock:
+            owned = stripe.entries.pop(id(ctx), None)
+        if owned is None:
+            return
+        if owned.token is not None:
+            self._discard_token(owned.token, ctx)
+        if owned.user_id is not None:
+            self._discard_user(owned.user_id, ctx)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": sum(len(s.entries) for s in self._owners),
+            "tokens": sum(len(s.entries) for s in self._tokens),
+            "users": sum(len(s.entries) for s in self._users),
+        }
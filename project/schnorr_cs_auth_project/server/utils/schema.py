@@ -0,0 +1,168 @@
+from typing import Any, Dict, Optional, Tuple
+
+from utils.exceptions import ValidationError
+from utils.fiat_shamir import NONCE_LENGTH
+from utils.group import KEY_ID_LENGTH, Group
+from utils.message import MessageType
+from utils.wire import ELEMENT, HEX, SCALAR, STR, is_request_id
+
+# Tipi di campo usati solo in validazione: lista di stringhe (gruppi, codifiche),
+# identificativo di richiesta (intero a 32 bit, vedi utils.wire) e flag (booleano in
+# JSON, 0 o 1 nella codifica binaria)
+LIST = "list"
+REQUEST_ID = "request_id"
+FLAG = "flag"
+
+# Caratteri massimi di username e nomi dei dispositivi
+MAX_NAME_LENGTH = 128
+# Caratteri esadecimali massimi di un token di associazione
+MAX_TOKEN_LENGTH = 64
+# Voci massime (e caratteri massimi per voce) delle liste dell'handshake
+MAX_LIST_ITEMS = 16
+MAX_LIST_ITEM_LENGTH = 32
+
+# Campo di uno schema: (nome, tipo, lunghezza massima, facoltativo). I tipi sono quelli
+# della codifica binaria (utils.wire); la lunghezza di elementi ed esponenti dipende dal
+# gruppo negoziato ed è quindi omessa.
+Field = Tuple[str, str, Optional[int], bool]
+
+# Campi accettati dal server per ogni messaggio
+SCHEMAS: Dict[MessageType, Tuple[Field, ...]] = {
+    MessageType.HANDSHAKE_REQ: (
+        ("groups", LIST, MAX_LIST_ITEMS, True),
+        ("encodings", LIST, MAX_LIST_ITEMS, True),
+    ),
+    MessageType.HANDSHAKE_RES: (),
+    MessageType.REGISTER: (
+        ("username", STR, MAX_NAME_LENGTH, False),
+        ("device", STR, MAX_NAME_LENGTH, False),
+        ("public_key", ELEMENT, None, False),
+    ),
+    MessageType.AUTH_REQUEST: (
+        ("username", STR, MAX_NAME_LENGTH, False),
+        ("temp", ELEMENT, None, False),
+        ("key_id", HEX, KEY_ID_LENGTH, True),
+    ),
+    MessageType.AUTH_RESPONSE: (("response", SCALAR, None, False),),
+    MessageType.AUTH_PROOF: (
+        ("username", STR, MAX_NAME_LENGTH, False),
+        ("temp", ELEMENT, None, False),
+        ("response", SCALAR, None, False),
+        ("nonce", HEX, NONCE_LENGTH, False),
+        ("key_id", HEX, KEY_ID_LENGTH, True),
+        ("verify_only", FLAG, None, True),
+    ),
+    MessageType.ASSOC_REQUEST: (
+        ("pk", ELEMENT, None, False),
+        ("device", STR, MAX_NAME_LENGTH, False),
+    ),
+    MessageType.TOKEN_ASSOC: (("token", HEX, MAX_TOKEN_LENGTH, False),),
+    MessageType.DEVICES_REQUEST: (),
+    MessageType.LOGOUT: (),
+}
+
+# Campi facoltativi di tutti i messaggi
+COMMON_FIELDS: Tuple[Field, ...] = (("request_id", REQUEST_ID, None, True),)
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+_KINDS = (STR, HEX, ELEMENT, SCALAR, LIST, REQUEST_ID, FLAG)
+
+
+def _hex_digits(value: str) -> str:
+    return value[2:] if value.startswith(("0x", "0X")) else value
+
+
+class CompiledSchema:
+    """
+    Validatore di uno schema di SCHEMAS, costruito una volta sola per tipo di messaggio.
+
+    Tutti i controlli sono su tipo e lunghezza dei valori ricevuti e precedono
+    qualunque conversione in intero: elementi ed esponenti in forma testuale devono
+    essere esadecimali di al più `element_size` o `scalar_size` byte, quindi un
+    payload di migliaia di cifre viene scartato senza passare da `int(..., 16)` né da
+    `pow`. Gli esponenti vengono poi convertiti (una sola volta) e confrontati con q:
+    nel messaggio restano come interi, che `scalar_value` restituisce invariati.
+    L'appartenenza degli elementi al gruppo resta compito di `Group.decode`.
+    """
+
+    __slots__ = ("msg_type", "fields")
+
+    def __init__(self, msg_type: MessageType, fields: Tuple[Field, ...]):
+        compiled = []
+        for name, kind, max_length, optional in fields:
+            if kind not in _KINDS:
+                raise ValueError(f"Tipo di campo non valido in {msg_type}: {kind}")
+            if kind in (STR, HEX, LIST) and max_length is None:
+                raise ValueError(f"Lunghezza massima mancante in {msg_type}: {name}")
+            compiled.append((name, kind, max_length, optional, f"Campo non valido: {name}"))
+        self.msg_type = msg_type
+        self.fields = tuple(compiled)
+
+    def validate(self, msg: Dict[str, Any], group: Group) -> None:
+        """Solleva ValidationError al primo campo mancante o non valido."""
+        for name, kind, max_length, optional, error in self.fields:
+            value = msg.get(name)
+            if value is None:
+                if optional:
+                    continue
+                raise ValidationError(f"Campo mancante: {name}")
+
+            if kind is STR:
+                if not isinstance(value, str) or len(value) > max_length:
+                    raise ValidationError(error)
+            elif kind is HEX:
+                if (
+                    not isinstance(value, str)
+                    or len(value) > max_length
+                    or not _HEX_DIGITS.issuperset(value)
+                ):
+                    raise ValidationError(error)
+            elif kind is ELEMENT:
+                if isinstance(value, bytes):
+                    if len(value) != group.element_size:
+                        raise ValidationError(error)
+                elif isinstance(value, str):
+                    digits = _hex_digits(value)
+                    if (
+                        not digits
+                        or len(digits) > 2 * group.element_size
+                        or not _HEX_DIGITS.issuperset(digits)
+                    ):
+                        raise ValidationError(error)
+                else:
+                    raise ValidationError(error)
+            elif kind is SCALAR:
+                if isinstance(value, str):
+                    digits = _hex_digits(value)
+                    if (
+                        not digits
+                        or len(digits) > 2 * group.scalar_size
+                        or not _HEX_DIGITS.issuperset(digits)
+                    ):
+                        raise ValidationError(error)
+                    value = msg[name] = int(digits, 16)
+                elif type(value) is not int:
+                    raise ValidationError(error)
+                if not 0 <= value < group.q:
+                    raise ValidationError(f"Il campo {name} è fuori dall'intervallo [0, q)")
+            elif kind is REQUEST_ID:
+                if not is_request_id(value):
+                    raise ValidationError(error)
+            elif kind is FLAG:
+                if type(value) not in (bool, int) or value not in (0, 1):
+                    raise ValidationError(error)
+            else:
+                if (
+                    not isinstance(value, list)
+                    or len(value) > max_length
+                    or not all(
+                        isinstance(item, str) and len(item) <= MAX_LIST_ITEM_LENGTH
+                        for item in value
+                    )
+                ):
+                    raise ValidationError(error)
+
+
+def compile_schema(msg_type: MessageType) -> CompiledSchema:
+    """Validatore dello schema di `msg_type`; i messaggi senza schema hanno solo COMMON_FIELDS."""
+    return CompiledSchema(msg_type, SCHEMAS.get(msg_type, ()) + COMMON_FIELDS)
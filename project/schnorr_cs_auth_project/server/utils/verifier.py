@@ -0,0 +1,418 @@
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.group import Group, get_group
+from utils.logger import Logger
+
+logger = Logger()
+
+# Finestra delle tabelle per le chiavi dei dispositivi, più piccola di quella del
+# generatore perché le tabelle sono molte
+KEY_TABLE_WINDOW = 4
+# Utilizzi dopo i quali una chiave riceve la propria tabella
+KEY_TABLE_MIN_USES = 3
+DEFAULT_KEY_CACHE_SIZE = 10_000
+DEFAULT_KEY_TABLE_CACHE_SIZE = 32
+
+
+class ParsedKey:
+    """Chiave pubblica già decodificata, con la tabella di pk^(-1) se usata spesso."""
+
+    __slots__ = ("element", "inverse", "uses", "table")
+
+    def __init__(self, element: Any, inverse: Any):
+        self.element = element
+        self.inverse = inverse
+        self.uses = 0
+        self.table = None
+
+
+class KeyCache:
+    """
+    Cache LRU delle chiavi pubbliche decodificate, per processo, indicizzata per
+    (gruppo, pk). Le chiavi usate almeno `KEY_TABLE_MIN_USES` volte ricevono una
+    tabella a base fissa per pk^(-1); al massimo `max_tables` tabelle restano in memoria.
+    """
+
+    def __init__(
+        self,
+        max_keys: int = DEFAULT_KEY_CACHE_SIZE,
+        max_tables: int = DEFAULT_KEY_TABLE_CACHE_SIZE,
+    ):
+        self.max_keys = max_keys
+        self.max_tables = max_tables
+        self._keys: "OrderedDict[Tuple[str, str], ParsedKey]" = OrderedDict()
+        self._tables: "OrderedDict[Tuple[str, str], ParsedKey]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group: Group, pk_hex: str) -> Optional[ParsedKey]:
+        """Restituisce la chiave decodificata, o None se `pk_hex` non è un elemento del gruppo."""
+        cache_key = (group.group_id, pk_hex)
+        with self._lock:
+            key = self._keys.get(cache_key)
+            if key is not None:
+                self._keys.move_to_end(cache_key)
+
+        if key is None:
+            try:
+                element = group.decode(pk_hex)
+            except (ValueError, TypeError):
+                return None
+            key = ParsedKey(element, group.inverse(element))
+            with self._lock:
+                self._keys[cache_key] = key
+                while len(self._keys) > self.max_keys:
+                    _, evicted = self._keys.popitem(last=False)
+                    evicted.table = None
+
+        key.uses += 1
+        if key.table is None and key.uses >= KEY_TABLE_MIN_USES and self.max_tables > 0:
+            table = group.fixed_base(key.inverse, KEY_TABLE_WINDOW)
+            with self._lock:
+                key.table = table
+                self._tables[cache_key] = key
+                while len(self._tables) > self.max_tables:
+                    _, evicted = self._tables.popitem(last=False)
+                    evicted.table = None
+        elif key.table is not None:
+            with self._lock:
+                if cache_key in self._tables:
+                    self._tables.move_to_end(cache_key)
+        return key
+
+
+_key_cache = KeyCache()
+
+
+def configure_key_cache(max_keys: int, max_tables: int) -> None:
+    """Dimensiona la cache delle chiavi del processo corrente (anche nei processi del pool)."""
+    global _key_cache
+    _key_cache = KeyCache(max_keys, max_tables)
+
+
+def verify_response(
+    group_id: str, temp: Any, challenge: int, response: int, pks: List[Optional[str]]
+) -> Optional[int]:
+    """
+    Verifica la risposta di Schnorr controllando g^z * pk^(-c) == t per ogni chiave
+    candidata del gruppo `group_id`. Le chiavi None o non decodificabili vengono saltate.
+
+    Le chiavi con una tabella in `KeyCache` costano due esponenziazioni a base fissa.
+    Altrimenti, con una sola chiave il controllo è un'unica multi-esponenziazione; con
+    più chiavi g^z, che non dipende dal dispositivo, viene calcolato una volta sola con
+    la tabella a base fissa e per ogni dispositivo resta soltanto pk^c.
+
+    Returns:
+        L'indice della prima chiave pubblica che soddisfa l'equazione, None altrimenti.
+    """
+    group = get_group(group_id)
+
+    candidates = []
+    for index, pk_hex in enumerate(pks):
+        if pk_hex is None:
+            continue
+        key = _key_cache.get(group, pk_hex)
+        if key is not None:
+            candidates.append((index, key))
+
+    if len(candidates) == 1 and candidates[0][1].table is None:
+        index, key = candidates[0]
+        left = group.multi_exp(((group.generator, response), (key.inverse, challenge)))
+        return index if left == temp else None
+
+    left = group.base_exp(response)
+    for index, key in candidates:
+        if key.table is not None:
+            if group.mul(left, key.table.pow(challenge)) == temp:
+                return index
+        elif left == group.mul(temp, group.exp(key.element, challenge)):
+            return index
+    return None
+
+
+# Una verifica in attesa: (temp, challenge, response, pks)
+Job = Tuple[Any, int, int, List[Optional[str]]]
+
+# Bit dei coefficienti casuali della verifica a lotti: un lotto con una prova
+# non valida viene accettato con probabilità al più 2^-BATCH_SECURITY_BITS
+BATCH_SECURITY_BITS = 128
+
+
+def _batch_holds(group: Group, items: Sequence[Tuple[int, Any, Any, int, int]]) -> bool:
+    """
+    Controlla insieme le equazioni g^z_i == t_i * pk_i^c_i combinandole con
+    coefficienti casuali r_i: g^(sum r_i z_i) * prod t_i^(-r_i) * pk_i^(-r_i c_i) == 1.
+    """
+    q = group.q
+    z_sum = 0
+    pairs = []
+    for _, temp, pk_inverse, challenge, response in items:
+        r = secrets.randbits(BATCH_SECURITY_BITS) | 1
+        z_sum += r * response
+        pairs.append((group.inverse(temp), r))
+        pairs.append((pk_inverse, r * challenge % q))
+    pairs.append((group.generator, z_sum % q))
+    return group.multi_exp(pairs) == group.identity
+
+
+def _verify_batch_items(
+    group: Group, items: Sequence[Tuple[int, Any, Any, int, int]], results: List[Optional[int]]
+) -> None:
+    """Accetta tutto il lotto se l'equazione combinata vale, altrimenti lo divide a metà."""
+    if not items:
+        return
+    if _batch_holds(group, items):
+        for job_index, *_ in items:
+            results[job_index] = 0
+        return
+    if len(items) == 1:
+        return
+
+    middle = len(items) // 2
+    _verify_batch_items(group, items[:middle], results)
+    _verify_batch_items(group, items[middle:], results)
+
+
+def verify_batch(group_id: str, jobs: List[Job]) -> List[Optional[int]]:
+    """
+    Verifica un lotto di risposte dello stesso gruppo.
+
+    Le prove con un'unica chiave candidata, in un gruppo che lo consente, vengono
+    verificate insieme con una sola multi-esponenziazione; solo i lotti che falliscono
+    vengono suddivisi. Le altre prove vengono verificate singolarmente.
+
+    Returns:
+        Per ogni job, l'indice della chiave trovata come in `verify_response`.
+    """
+    group = get_group(group_id)
+    results: List[Optional[int]] = [None] * len(jobs)
+
+    batch = []
+    for job_index, (temp, challenge, response, pks) in enumerate(jobs):
+        candidates = [index for index, pk in enumerate(pks) if pk is not None]
+        if group.batchable and len(candidates) == 1:
+            key = _key_cache.get(group, pks[candidates[0]])
+            if key is None:
+                continue
+            batch.append((job_index, temp, key.inverse, challenge, response))
+        else:
+            results[job_index] = verify_response(group_id, temp, challenge, response, pks)
+
+    _verify_batch_items(group, batch, results)
+
+    # Nel lotto le prove accettate hanno un'unica candidata: si riporta il suo indice
+    for job_index, *_ in batch:
+        if results[job_index] is not None:
+            pks = jobs[job_index][3]
+            results[job_index] = next(i for i, pk in enumerate(pks) if pk is not None)
+    return results
+
+
+class BatchCollector:
+    """
+    Raccoglie le verifiche in arrivo per al massimo `max_delay` secondi o `max_size`
+    elementi e le passa a `submit_batch` raggruppate per gruppo crittografico.
+    """
+
+    def __init__(
+        self,
+        submit_batch: Callable[[str, List[Job]], Future],
+        max_size: int,
+        max_delay: float,
+    ):
+        self.submit_batch = submit_batch
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending: List[Tuple[str, Job, Future]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="batch-verifier", daemon=True)
+        self._thread.start()
+
+    def submit(self, group_id: str, job: Job) -> Future:
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Verificatore a lotti chiuso")
+            self._pending.append((group_id, job, future))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_size:
+                self._cond.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending = self._pending[: self.max_size]
+                del self._pending[: self.max_size]
+
+            by_group: Dict[str, List[Tuple[Job, Future]]] = {}
+            for group_id, job, future in pending:
+                by_group.setdefault(group_id, []).append((job, future))
+            for group_id, entries in by_group.items():
+                self._dispatch(group_id, entries)
+
+    def _dispatch(self, group_id: str, entries: List[Tuple[Job, Future]]) -> None:
+        futures = [future for _, future in entries]
+
+        def done(batch_future: Future) -> None:
+            try:
+                results = batch_future.result()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                return
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+        try:
+            self.submit_batch(group_id, [job for job, _ in entries]).add_done_callback(done)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def _warmup() -> None:
+    return None
+
+
+class VerificationExecutor:
+    """
+    Esegue le verifiche di Schnorr in un pool di processi, così che le esponenziazioni
+    modulari non tengano il GIL del processo che gestisce le connessioni.
+
+    Con `workers=0` le verifiche vengono eseguite direttamente nel thread chiamante.
+    Con `batch_size > 1` le verifiche concorrenti vengono raccolte per al massimo
+    `batch_delay` secondi e verificate a lotti (vedi `verify_batch`).
+    Ogni processo ha la propria `KeyCache`, dimensionata da `key_cache_size` e
+    `key_table_cache_size`.
+
+    Se un processo del pool termina inaspettatamente (es. OOM), il pool viene
+    ricreato con `forkserver`, che a differenza di fork è sicuro anche quando il
+    processo ha già altri thread; le verifiche interrotte vengono ripetute una volta.
+    Se anche il nuovo pool non parte, le verifiche proseguono nel thread chiamante.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        batch_size: int = 0,
+        batch_delay: float = 0.002,
+        key_cache_size: int = DEFAULT_KEY_CACHE_SIZE,
+        key_table_cache_size: int = DEFAULT_KEY_TABLE_CACHE_SIZE,
+    ):
+        self.workers = os.cpu_count() if workers is None else workers
+        self._cache_sizes = (key_cache_size, key_table_cache_size)
+        self._pool = None
+        # Incrementata a ogni sostituzione del pool, così che un pool rotto venga
+        # ricreato una sola volta anche se più thread ne ricevono l'errore
+        self._generation = 0
+        self._pool_lock = threading.Lock()
+        if self.workers > 0:
+            # Avvia subito i processi, prima che vengano creati i thread delle connessioni
+            self._pool = self._start_pool()
+        else:
+            configure_key_cache(*self._cache_sizes)
+
+        self._batcher = None
+        if batch_size > 1:
+            self._batcher = BatchCollector(self._submit_batch, batch_size, batch_delay)
+
+    def _start_pool(self, context=None) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=configure_key_cache,
+            initargs=self._cache_sizes,
+        )
+        pool.submit(_warmup).result()
+        return pool
+
+    def _restart(self, generation: int, error: Exception) -> None:
+        """Sostituisce il pool rotto, se nessun altro thread l'ha già fatto."""
+        with self._pool_lock:
+            if generation != self._generation or self._pool is None:
+                return
+            logger.error(f"[SERVER] Pool di verifica non più utilizzabile ({error}), riavvio")
+            broken = self._pool
+            try:
+                self._pool = self._start_pool(multiprocessing.get_context("forkserver"))
+            except Exception as e:
+                logger.error(
+                    f"[SERVER] Riavvio del pool di verifica non riuscito ({e}), "
+                    f"verifica nel processo principale"
+                )
+                self._pool = None
+                configure_key_cache(*self._cache_sizes)
+            self._generation += 1
+        broken.shutdown(wait=False)
+
+    def _run(self, fn: Callable, *args) -> Future:
+        """Esegue `fn` nel pool di processi, o subito se il pool non è attivo."""
+        generation = self._generation
+        pool = self._pool
+        if pool is not None:
+            try:
+                return pool.submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._restart(generation, e)
+                return self._run(fn, *args)
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _submit_batch(self, group_id: str, jobs: List[Job]) -> Future:
+        return self._run(verify_batch, group_id, jobs)
+
+    def submit(
+        self, group_id: str, temp: Any, challenge: int, response: int, pks: List[Optional[str]]
+    ) -> Future:
+        """Accoda una verifica e restituisce il Future con l'indice della chiave trovata."""
+        if self._batcher is not None:
+            return self._batcher.submit(group_id, (temp, challenge, response, pks))
+        return self._run(verify_response, group_id, temp, challenge, response, pks)
+
+    def verify(
+        self, group_id: str, temp: Any, challenge: int, response: int, pks: List[Optional[str]]
+    ) -> Optional[int]:
+        """Attende il risultato della verifica dal thread chiamante."""
+        generation = self._generation
+        try:
+            return self.submit(group_id, temp, challenge, response, pks).result()
+        except BrokenProcessPool as e:
+            # Verifica interrotta dalla terminazione di un processo del pool
+            self._restart(generation, e)
+            return self.submit(group_id, temp, challenge, response, pks).result()
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Chiude il pool; con `wait` attende che i processi di verifica siano terminati."""
+        if self._batcher is not None:
+            self._batcher.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,291 @@
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.group import Group
+from utils.message import ErrorType, MessageType
+
+# Codifiche dei messaggi negoziabili nell'handshake, in ordine di preferenza.
+# JSON è sempre accettata: è quella dei client che non ne dichiarano altre.
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+SUPPORTED_ENCODINGS = [ENCODING_BINARY, ENCODING_JSON]
+
+# Tipi di campo della codifica binaria
+STR = "str"          # testo UTF-8, preceduto dalla lunghezza (2 byte)
+HEX = "hex"          # stringa esadecimale trasmessa come byte, preceduta dalla lunghezza (1 byte)
+ELEMENT = "element"  # elemento del gruppo, element_size byte
+SCALAR = "scalar"    # esponente modulo q (sfida, risposta), scalar_size byte big-endian
+CODE = "code"        # intero su 1 byte (codice di errore, flag)
+JSON = "json"        # valore JSON qualsiasi, preceduto dalla lunghezza (4 byte)
+
+_OPCODE = struct.Struct("!B")
+_REQUEST_ID = struct.Struct("!I")
+_STR_LENGTH = struct.Struct("!H")
+_HEX_LENGTH = struct.Struct("!B")
+_JSON_LENGTH = struct.Struct("!I")
+
+# Bit dell'opcode che indica un request_id (4 byte) subito dopo: i codici dei
+# messaggi devono quindi restare sotto 0x80
+_REQUEST_ID_FLAG = 0x80
+# Identificativi di richiesta ammessi: interi senza segno a 32 bit
+REQUEST_ID_LIMIT = 1 << 32
+
+# Campi di ogni messaggio nella codifica binaria: (nome, tipo, facoltativo).
+# I campi facoltativi sono preceduti da un byte che ne indica la presenza.
+LAYOUTS: Dict[MessageType, Tuple[Tuple[str, str, bool], ...]] = {
+    MessageType.HANDSHAKE_REQ: (("groups", JSON, True), ("encodings", JSON, True)),
+    MessageType.GROUP_SELECTION: (
+        ("group_id", STR, False),
+        ("nonce", HEX, True),
+        ("encoding", STR, True),
+    ),
+    MessageType.HANDSHAKE_RES: (),
+    MessageType.REGISTER: (
+        ("username", STR, False),
+        ("device", STR, False),
+        ("public_key", ELEMENT, False),
+    ),
+    MessageType.REGISTERED: (),
+    MessageType.AUTH_REQUEST: (
+        ("username", STR, False),
+        ("temp", ELEMENT, False),
+        ("key_id", HEX, True),
+    ),
+    MessageType.CHALLENGE: (("challenge", SCALAR, False),),
+    MessageType.AUTH_RESPONSE: (("response", SCALAR, False),),
+    MessageType.AUTH_PROOF: (
+        ("username", STR, False),
+        ("temp", ELEMENT, False),
+        ("response", SCALAR, False),
+        ("nonce", HEX, False),
+        ("key_id", HEX, True),
+        ("verify_only", CODE, True),
+    ),
+    MessageType.ACCEPTED: (("nonce", HEX, True), ("username", STR, True)),
+    MessageType.REJECTED: (("nonce", HEX, True),),
+    MessageType.ASSOC_REQUEST: (("pk", ELEMENT, False), ("device", STR, False)),
+    MessageType.TOKEN_ASSOC: (("token", STR, False),),
+    MessageType.DEVICES_REQUEST: (),
+    MessageType.DEVICES_RESPONSE: (("devices", JSON, False),),
+    MessageType.LOGOUT: (),
+    MessageType.LOGGED_OUT: (),
+    MessageType.ERROR: (("error_code", CODE, False), ("details", STR, True)),
+}
+
+# Tipi con cui arrivano agli handler elementi ed esponenti: stringhe esadecimali in
+# JSON, byte e interi nella codifica binaria (senza passare dal testo)
+ELEMENT_VALUE = (str, bytes)
+SCALAR_VALUE = (str, int)
+
+
+def is_request_id(value) -> bool:
+    """True se `value` può essere usato come `request_id` di un messaggio."""
+    return type(value) is int and 0 <= value < REQUEST_ID_LIMIT
+
+
+class MalformedMessageError(ValueError):
+    """Il payload ricevuto non è un messaggio valido nella codifica della connessione."""
+    pass
+
+
+class JsonCodec:
+    """Codifica originale: un oggetto JSON con `type_code`, `type` e i campi del messaggio."""
+
+    name = ENCODING_JSON
+
+    def encode(self, msg_type: MessageType, fields: Optional[Dict[str, Any]] = None) -> bytes:
+        message = {"type_code": msg_type.code, "type": msg_type.label}
+        if fields:
+            message.update(fields)
+        return json.dumps(message).encode()
+
+    def decode(self, payload: bytes) -> Any:
+        try:
+            return json.loads(payload)
+        except ValueError as e:
+            # Comprende i numeri oltre il limite di cifre di `int` (sys.int_info)
+            raise MalformedMessageError(f"Messaggio JSON non valido: {e}") from None
+
+
+class BinaryCodec:
+    """
+    Codifica compatta: 1 byte con `MessageType.code` seguito dai campi di LAYOUTS,
+    senza nomi. Elementi del gruppo e esponenti hanno larghezza fissa (big-endian),
+    le stringhe esadecimali (nonce, impronte) viaggiano come byte.
+
+    `decode` restituisce lo stesso dizionario della codifica JSON, con due sole
+    differenze: gli elementi restano nei loro `element_size` byte (`Group.decode` li
+    accetta così) e gli esponenti sono già interi, per non convertire numeri di
+    centinaia di cifre in testo e ritorno. `element_text` e `scalar_value` danno la
+    stessa forma per entrambe le codifiche. In codifica gli elementi possono essere
+    testo o byte, gli esponenti testo o interi. I campi non previsti dal layout del
+    messaggio non vengono trasmessi, tranne `request_id`: se presente è segnalato dal
+    bit alto dell'opcode e occupa i 4 byte successivi, senza costi per chi non lo usa.
+
+    I campi sono gestiti in un unico ciclo per messaggio, senza una chiamata di
+    funzione per campo: con messaggi di poche decine di byte è questo a decidere se
+    la decodifica è più veloce di `json.loads`.
+    """
+
+    name = ENCODING_BINARY
+
+    def __init__(self, group: Group):
+        self.group = group
+        self.element_size = group.element_size
+        self.scalar_size = group.scalar_size
+        self._opcodes = {msg_type: _OPCODE.pack(msg_type.code) for msg_type in LAYOUTS}
+        self._types = {msg_type.code: msg_type for msg_type in LAYOUTS}
+
+    # ---------- codifica ----------
+
+    def encode(self, msg_type: MessageType, fields: Optional[Dict[str, Any]] = None) -> bytes:
+        opcode = self._opcodes.get(msg_type)
+        if opcode is None:
+            raise ValueError(f"Messaggio {msg_type} non codificabile in binario")
+        fields = fields or {}
+        request_id = fields.get("request_id")
+        if request_id is None:
+            parts: List[bytes] = [opcode]
+        elif is_request_id(request_id):
+            parts = [_OPCODE.pack(msg_type.code | _REQUEST_ID_FLAG), _REQUEST_ID.pack(request_id)]
+        else:
+            raise ValueError(f"request_id non valido: {request_id!r}")
+        for name, kind, optional in LAYOUTS[msg_type]:
+            value = fields.get(name)
+            if optional:
+                if value is None:
+                    parts.append(b"\x00")
+                    continue
+                parts.append(b"\x01")
+            elif value is None:
+                raise ValueError(f"Campo mancante in {msg_type}: {name}")
+
+            if kind is ELEMENT:
+                if isinstance(value, str):
+                    value = self.group.to_wire(value)
+                elif len(value) != self.element_size:
+                    raise ValueError("Elemento di lunghezza non valida")
+                parts.append(value)
+            elif kind is SCALAR:
+                try:
+                    parts.append(scalar_value(value).to_bytes(self.scalar_size, "big"))
+                except OverflowError:
+                    raise ValueError("Esponente fuori dall'intervallo [0, q)") from None
+            elif kind is STR:
+                data = value.encode()
+                parts += (_STR_LENGTH.pack(len(data)), data)
+            elif kind is HEX:
+                data = bytes.fromhex(value)
+                parts += (_HEX_LENGTH.pack(len(data)), data)
+            elif kind is CODE:
+                parts.append(_OPCODE.pack(value))
+            else:
+                data = json.dumps(value).encode()
+                parts += (_JSON_LENGTH.pack(len(data)), data)
+        return b"".join(parts)
+
+    # ---------- decodifica ----------
+
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        try:
+            return self._decode(payload)
+        except MalformedMessageError:
+            raise
+        except (struct.error, IndexError, ValueError) as e:
+            raise MalformedMessageError(f"Messaggio binario non valido: {e}") from None
+
+    def _decode(self, data: bytes) -> Dict[str, Any]:
+        code = data[0]
+        offset = 1
+        request_id = None
+        if code & _REQUEST_ID_FLAG:
+            code ^= _REQUEST_ID_FLAG
+            (request_id,) = _REQUEST_ID.unpack_from(data, offset)
+            offset += _REQUEST_ID.size
+        msg_type = self._types.get(code)
+        if msg_type is None:
+            # Come un "type" sconosciuto in JSON: il dispatch lo scarta
+            return {"type_code": code, "type": None}
+
+        message = {"type_code": code, "type": msg_type.label}
+        if request_id is not None:
+            message["request_id"] = request_id
+        size = len(data)
+        for name, kind, optional in LAYOUTS[msg_type]:
+            if optional:
+                offset += 1
+                if not data[offset - 1]:
+                    continue
+
+            if kind is ELEMENT:
+                end = offset + self.element_size
+                value = data[offset:end]
+            elif kind is SCALAR:
+                end = offset + self.scalar_size
+                value = int.from_bytes(data[offset:end], "big")
+            elif kind is STR:
+                start = offset + _STR_LENGTH.size
+                (length,) = _STR_LENGTH.unpack_from(data, offset)
+                end = start + length
+                value = data[start:end].decode()
+            elif kind is HEX:
+                start = offset + 1
+                end = start + data[offset]
+                value = data[start:end].hex()
+            elif kind is CODE:
+                end = offset + 1
+                value = data[offset]
+            else:
+                start = offset + _JSON_LENGTH.size
+                (length,) = _JSON_LENGTH.unpack_from(data, offset)
+                end = start + length
+                value = json.loads(data[start:end])
+
+            if end > size:
+                raise MalformedMessageError(f"Messaggio {msg_type} troncato")
+            message[name] = value
+            offset = end
+
+        if offset != size:
+            raise MalformedMessageError(f"{size - offset} byte in eccesso nel messaggio {msg_type}")
+        if msg_type is MessageType.ERROR:
+            error = ErrorType.from_code(message["error_code"])
+            if error is not None:
+                message["error"] = error.label
+                message["message"] = error.message()
+        return message
+
+
+JSON_CODEC = JsonCodec()
+
+_binary_codecs: Dict[str, BinaryCodec] = {}
+
+
+def get_codec(encoding: str, group: Group):
+    """Codec per la codifica negoziata; quella binaria dipende dal gruppo della connessione."""
+    if encoding != ENCODING_BINARY:
+        return JSON_CODEC
+    codec = _binary_codecs.get(group.group_id)
+    if codec is None:
+        codec = _binary_codecs.setdefault(group.group_id, BinaryCodec(group))
+    return codec
+
+
+def element_text(group: Group, value) -> str:
+    """Elemento ricevuto nella forma testuale di `Group.encode`, qualunque sia la codifica."""
+    return value if isinstance(value, str) else group.from_wire(value)
+
+
+def scalar_value(value) -> int:
+    """Esponente ricevuto come intero, qualunque sia la codifica."""
+    return value if isinstance(value, int) else int(value, 16)
+
+
+def select_encoding(preference: List[str], offered) -> str:
+    """Prima codifica nella preferenza del server proposta anche dal client, altrimenti JSON."""
+    if isinstance(offered, list):
+        for encoding in preference:
+            if encoding in offered and encoding in SUPPORTED_ENCODINGS:
+                return encoding
+    return ENCODING_JSON